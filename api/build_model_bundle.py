@@ -0,0 +1,34 @@
+import sys
+import torch
+from transformers import AutoTokenizer
+from api.utils.vocab import load_vocab
+from api.utils.two_tower_model import TwoTowerModel, MODEL_NAME, save_bundle, load_bundle, load_state_dict_file
+
+# ---------------------------------------------------------
+# 学習済みの .pth と hub の tokenizer / BERT config を1つのモデルバンドルにまとめる
+# (hub にアクセスするのはこのスクリプトだけ。Docker ビルド時に1回実行する)
+#   python -m api.build_model_bundle [model.pth] [vocab.json] [出力ディレクトリ]
+# ---------------------------------------------------------
+MODEL_PATH = "api/data/mercari_twotower_model.pth"
+VOCAB_PATH = "api/data/vocab.json"
+BUNDLE_PATH = "api/data/model_bundle"
+
+def build_bundle(model_path: str, vocab_path: str, bundle_dir: str) -> None:
+    _, dims = load_vocab(vocab_path)
+
+    model = TwoTowerModel(dims)
+    model.load_state_dict(load_state_dict_file(model_path, "cpu"))
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    save_bundle(model, tokenizer, bundle_dir)
+
+    # 書き出したバンドルだけで元の重みが復元できることを確認する
+    restored, _ = load_bundle(bundle_dir, dims, "cpu")
+    expected = model.state_dict()
+    for key, value in restored.state_dict().items():
+        if not torch.equal(value, expected[key]):
+            raise RuntimeError(f"bundle mismatch: {key}")
+    print(f"✅ Model bundle written to {bundle_dir}")
+
+if __name__ == "__main__":
+    args = sys.argv[1:] + [MODEL_PATH, VOCAB_PATH, BUNDLE_PATH][len(sys.argv[1:]):]
+    build_bundle(*args[:3])
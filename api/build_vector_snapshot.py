@@ -0,0 +1,47 @@
+import sys
+import asyncio
+from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+from api.db import async_session
+import api.cruds.item as item_crud
+import api.cruds.model_version as model_version_crud
+from api.utils.vector_snapshot import (
+    Snapshot, async_builder_lock, load_snapshot, rows_to_arrays, snapshot_root, write_snapshot
+)
+
+# ---------------------------------------------------------
+# item_vectors のスナップショットを作り直す (定期ジョブ用。torch は読み込まない)
+#   python -m api.build_vector_snapshot [モデルバージョン (省略時は稼働中のバージョン)]
+# ---------------------------------------------------------
+
+async def build_vector_snapshot(version: str, if_older_than: datetime | None = None) -> Snapshot | None:
+    """
+    DB にある指定バージョンの全ベクトルからスナップショットを書く
+    if_older_than より新しいスナップショットがロック待ちの間に作られていれば、それをそのまま返す
+    """
+    root = snapshot_root(version)
+    # ファイルの読み書きと配列の組み立てはスレッドで行い、稼働中のワーカーのイベントループを止めない
+    async with async_builder_lock(root):
+        current = await run_in_threadpool(load_snapshot, root)
+        if current is not None and if_older_than is not None and current.watermark >= if_older_than:
+            return current
+
+        watermark = datetime.now()
+        async with async_session() as db:
+            rows = await item_crud.get_all_vectors(db, version)
+        await run_in_threadpool(write_rows, root, rows, watermark)
+    return await run_in_threadpool(load_snapshot, root)
+
+def write_rows(root: str, rows: list, watermark: datetime) -> None:
+    item_ids, matrix, attrs = rows_to_arrays(rows)
+    write_snapshot(root, item_ids, matrix, attrs, watermark)
+
+async def main(version: str | None = None) -> None:
+    if version is None:
+        async with async_session() as db:
+            version = (await model_version_crud.get_active_version(db)).version
+    snapshot = await build_vector_snapshot(version)
+    print(f"✅ Vector snapshot {snapshot.name} written ({len(snapshot)} vectors, model {version})")
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else None))
@@ -0,0 +1,38 @@
+import sys
+import pickle
+from api.utils.vocab import save_vocab
+
+# ---------------------------------------------------------
+# 学習時に書き出した encoders.pkl (SafeLabelEncoder の pickle) を vocab.json に変換する (1回だけ)
+#   python -m api.convert_encoders <encoders.pkl> <vocab.json>
+# numpy のスカラー以外のクラスは復元しない
+# ---------------------------------------------------------
+
+class LegacyLabelEncoder:
+    """SafeLabelEncoder の属性 (vocab, unknown_idx, num_classes) を受け取るだけの入れ物"""
+
+class LegacyUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if name == "SafeLabelEncoder":
+            return LegacyLabelEncoder
+        if module.split(".")[0] == "numpy" and name in ("scalar", "dtype", "_reconstruct", "ndarray"):
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError(f"refusing to load {module}.{name}")
+
+def convert(encoders_path: str, vocab_path: str) -> None:
+    with open(encoders_path, "rb") as f:
+        data_pack = LegacyUnpickler(f).load()
+
+    vocabs = {}
+    for name, encoder in data_pack["encoders"].items():
+        # 行番号が「ソート順の位置 + 1」になっていることを確かめてからキーだけを残す
+        keys = sorted(encoder.vocab, key=encoder.vocab.get)
+        if [encoder.vocab[k] for k in keys] != list(range(1, len(keys) + 1)) or keys != sorted(keys):
+            raise ValueError(f"{name}: vocabulary is not sorted-rank encoded")
+        vocabs[name] = [str(k) for k in keys]
+
+    save_vocab(vocab_path, vocabs, data_pack["dims"])
+    print(f"✅ Wrote {vocab_path} ({', '.join(f'{n}={len(k)}' for n, k in vocabs.items())})")
+
+if __name__ == "__main__":
+    convert(sys.argv[1], sys.argv[2])
@@ -1 +1,3 @@
-search_engine = None
\ No newline at end of file
+search_engine = None
+# ローカルに検索エンジンを持つプロセスだけが持つ (api.search_loader.SearchReloader)
+search_reloader = None
\ No newline at end of file
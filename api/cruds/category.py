@@ -1,8 +1,15 @@
+import os
+import hashlib
 from sqlalchemy import select, or_, case
 from sqlalchemy.orm import selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from api.models import Category as CategoryModel
+from api.utils.cache import LRUCache
+
+# カテゴリツリーのバージョン (全カテゴリの id・親・名前のハッシュ) をこの秒数だけ使い回す
+CATEGORY_TREE_TTL = float(os.getenv("CATEGORY_TREE_TTL", 300))
+_tree_version = LRUCache(1, CATEGORY_TREE_TTL)
 
 async def get_category(
     db: AsyncSession, 
@@ -14,6 +21,24 @@ async def get_category(
     )
     return result.scalars().all()
 
+async def get_tree_version(db: AsyncSession) -> str:
+    """カテゴリが追加・変更されると変わる値 (GET /categories の ETag に使う)"""
+    version = _tree_version.get("tree")
+    if version is None:
+        result = await db.execute(
+            select(CategoryModel.id, CategoryModel.parent_id, CategoryModel.name, CategoryModel.depth)
+            .order_by(CategoryModel.id)
+        )
+        version = hashlib.sha256(repr([tuple(row) for row in result.all()]).encode("utf-8")).hexdigest()[:16]
+        _tree_version.set("tree", version)
+    return version
+
+async def get_category_edges(db: AsyncSession):
+    result = await db.execute(
+        select(CategoryModel.id, CategoryModel.parent_id)
+    )
+    return result.all()
+
 async def find_category_id(
         db: AsyncSession,
         keyword: str,
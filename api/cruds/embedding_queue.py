@@ -0,0 +1,154 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import List
+from sqlalchemy import select, update, delete, func, tuple_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from api.models.pending_embedding import PendingEmbedding
+
+# ---------------------------------------------------------
+# ベクトル化待ちのキュー (pending_embeddings テーブル)
+# 出品・更新は推論を待たずにコミットし、ワーカー (api.embedding_worker) がまとめてエンコードする
+# ---------------------------------------------------------
+EMBEDDING_MAX_ATTEMPTS = int(os.getenv("EMBEDDING_MAX_ATTEMPTS", 5))
+EMBEDDING_RETRY_BASE_SECONDS = float(os.getenv("EMBEDDING_RETRY_BASE_SECONDS", 5))
+# 取り出した行はこの秒数だけ他のワーカーから見えなくなる (処理中に落ちたらその後で再び取り出される)
+EMBEDDING_LEASE_SECONDS = int(os.getenv("EMBEDDING_LEASE_SECONDS", 120))
+
+# 同じプロセスのワーカーを起こす (他のプロセスのワーカーはポーリングで拾う)
+_wakeup = asyncio.Event()
+
+def notify() -> None:
+    _wakeup.set()
+
+async def wait_for_work(timeout: float) -> None:
+    try:
+        await asyncio.wait_for(_wakeup.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    _wakeup.clear()
+
+async def enqueue(db: AsyncSession, item_id: str) -> None:
+    """
+    商品の書き込みと同じトランザクションでキューに積む (commit は呼び出し側)
+    積み済みなら generation を上げ、リトライ回数を戻してすぐ取り出せるようにする
+    """
+    now = datetime.now()
+    # 新規出品は items の行を先に INSERT しておく (外部キー)
+    await db.flush()
+    stmt = mysql_insert(PendingEmbedding).values(
+        item_id=item_id, status="pending", generation=1, attempts=0, enqueued_at=now, available_at=now,
+    )
+    stmt = stmt.on_duplicate_key_update(
+        status="pending",
+        generation=PendingEmbedding.__table__.c.generation + 1,
+        attempts=0,
+        last_error=None,
+        enqueued_at=now,
+        available_at=now,
+    )
+    await db.execute(stmt)
+
+async def claim(db: AsyncSession, limit: int) -> list:
+    """
+    取り出せる行を最大 limit 件ロックして取り、リース期間だけ他のワーカーから隠す
+    (SKIP LOCKED なので複数のワーカーが同じ行を取り合わない)
+    """
+    now = datetime.now()
+    result = await db.execute(
+        select(PendingEmbedding.item_id, PendingEmbedding.generation, PendingEmbedding.attempts)
+        .filter(PendingEmbedding.status == "pending", PendingEmbedding.available_at <= now)
+        .order_by(PendingEmbedding.available_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    rows = result.all()
+    if rows:
+        await db.execute(
+            update(PendingEmbedding)
+            .where(PendingEmbedding.item_id.in_([row.item_id for row in rows]))
+            .values(available_at=now + timedelta(seconds=EMBEDDING_LEASE_SECONDS))
+        )
+    await db.commit()
+    return rows
+
+async def complete(db: AsyncSession, claimed: list) -> None:
+    """
+    処理済みの行を消す (commit は呼び出し側。ベクトルの保存と同じトランザクションにする)
+    取り出した後に再度積まれた行 (generation が変わった行) は残す
+    """
+    if not claimed:
+        return
+    await db.execute(
+        delete(PendingEmbedding)
+        .where(tuple_(PendingEmbedding.item_id, PendingEmbedding.generation).in_(
+            [(row.item_id, row.generation) for row in claimed]
+        ))
+    )
+
+async def fail(db: AsyncSession, claimed: list, errors: dict) -> None:
+    """
+    失敗した行を指数バックオフで再試行に回す。EMBEDDING_MAX_ATTEMPTS 回失敗したら failed にする
+    """
+    now = datetime.now()
+    for row in claimed:
+        attempts = row.attempts + 1
+        await db.execute(
+            update(PendingEmbedding)
+            .where(PendingEmbedding.item_id == row.item_id, PendingEmbedding.generation == row.generation)
+            .values(
+                attempts=attempts,
+                last_error=errors.get(row.item_id),
+                status="failed" if attempts >= EMBEDDING_MAX_ATTEMPTS else "pending",
+                available_at=now + timedelta(seconds=EMBEDDING_RETRY_BASE_SECONDS * 2 ** (attempts - 1)),
+            )
+        )
+    await db.commit()
+
+async def release(db: AsyncSession, claimed: list) -> None:
+    """推論が混んでいるなどで処理しなかった行を、試行回数を増やさずに戻す"""
+    if not claimed:
+        return
+    await db.execute(
+        update(PendingEmbedding)
+        .where(PendingEmbedding.item_id.in_([row.item_id for row in claimed]))
+        .values(available_at=datetime.now())
+    )
+    await db.commit()
+
+async def retry_failed(db: AsyncSession) -> int:
+    """failed になった行をすべて再試行に回す"""
+    now = datetime.now()
+    result = await db.execute(
+        update(PendingEmbedding)
+        .where(PendingEmbedding.status == "failed")
+        .values(status="pending", attempts=0, available_at=now)
+    )
+    await db.commit()
+    return result.rowcount
+
+async def get_task(db: AsyncSession, item_id: str) -> PendingEmbedding | None:
+    result = await db.execute(select(PendingEmbedding).filter(PendingEmbedding.item_id == item_id))
+    return result.scalars().first()
+
+async def get_failed_tasks(db: AsyncSession, limit: int = 100) -> List[PendingEmbedding]:
+    result = await db.execute(
+        select(PendingEmbedding)
+        .filter(PendingEmbedding.status == "failed")
+        .order_by(PendingEmbedding.enqueued_at)
+        .limit(limit)
+    )
+    return result.scalars().all()
+
+async def queue_stats(db: AsyncSession) -> dict:
+    result = await db.execute(
+        select(PendingEmbedding.status, func.count(), func.min(PendingEmbedding.enqueued_at))
+        .group_by(PendingEmbedding.status)
+    )
+    stats = {"pending": 0, "failed": 0, "oldest_pending_seconds": None}
+    for status, count, oldest in result.all():
+        stats[status] = count
+        if status == "pending" and oldest is not None:
+            stats["oldest_pending_seconds"] = round((datetime.now() - oldest).total_seconds(), 1)
+    return stats
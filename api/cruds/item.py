@@ -1,4 +1,5 @@
-from sqlalchemy import select, desc
+from sqlalchemy import select, desc, or_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 from typing import List
@@ -8,27 +9,67 @@ from api.models.category import Category as CategoryModel
 from api.schemas.item import ItemCreate, ItemResponse, ItemUpdate
 from api.models.item_image import ItemImage
 import api.core as core
+import api.cruds.embedding_queue as embedding_queue
+import api.cruds.item_cache as item_cache
 from api.models.embedding import ItemVector
+from api.models.item_change import ItemChange
+from api.utils.vector_codec import pack_vector, unpack_vector, DEFAULT_STORAGE_DTYPE
+from api.utils.fingerprint import title_state_key
+from api.utils.cursor import encode_cursor, decode_cursor
 from uuid import UUID
 import uuid
 from datetime import datetime
 
-async def get_items_list(db: AsyncSession, skip: int, limit: int):
-    result = await db.execute(
-        select(ItemModel)
-        .options(
-            selectinload(ItemModel.seller),
-            selectinload(ItemModel.category),
-            selectinload(ItemModel.brand),
-            selectinload(ItemModel.condition),
-            selectinload(ItemModel.images),
+def card_columns() -> tuple:
+    """
+    一覧・検索のカード (ItemCardResponse) に必要な列だけ。1枚目の画像は相関サブクエリで同じ SELECT に含める
+    (ORM オブジェクトを作らず、関連の selectinload も発行しない)
+    """
+    thumbnail = (
+        select(ItemImage.image_url)
+        .where(ItemImage.item_id == ItemModel.id)
+        .order_by(ItemImage.created_at, ItemImage.id)
+        .limit(1)
+        .correlate(ItemModel)
+        .scalar_subquery()
+    )
+    return (
+        ItemModel.id, ItemModel.title, ItemModel.price, ItemModel.status, ItemModel.updated_at,
+        thumbnail.label("thumbnail_url"),
+    )
+
+def _keyset_page(query, sort_col, id_col, cursor: str | None, limit: int):
+    """
+    (sort_col, id_col) の降順で cursor の次から limit + 1 件取るクエリにする (1件多く取って次ページの有無を判定)
+    (sort_col, id_col) < (sort_value, last_id) は、インデックスの範囲を sort_col <= sort_value で確定させ、
+    同じ時刻の行だけ id で絞る形にする (OR だけで書くと範囲が決まらず、深いページほど読む行が増える)
+    """
+    if cursor is not None:
+        sort_value, last_id = decode_cursor(cursor)
+        query = query.filter(
+            sort_col <= sort_value,
+            or_(sort_col < sort_value, id_col < last_id),
         )
-        .filter(ItemModel.status == "on_sale")
-        .order_by(desc(ItemModel.updated_at))
-        .offset(skip)
-        .limit(limit)
+    return query.order_by(desc(sort_col), desc(id_col)).limit(limit + 1)
+
+def _split_page(rows: list, limit: int, key) -> tuple:
+    """(ページの行, 次ページのカーソル or None)"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
+
+async def get_items_list(db: AsyncSession, limit: int, cursor: str | None = None, skip: int = 0):
+    """販売中の商品のカードを新しく更新された順に1ページ分返す -> (cards, next_cursor)"""
+    query = _keyset_page(
+        select(*card_columns()).filter(ItemModel.status == "on_sale"),
+        ItemModel.updated_at, ItemModel.id, cursor, limit,
     )
-    return result.scalars().all()
+    if cursor is None and skip:
+        # 旧クライアント向け (深いページほど遅いので、カーソルを使う)
+        query = query.offset(skip)
+    cards = (await db.execute(query)).all()
+    return _split_page(cards, limit, lambda card: (card.updated_at, card.id))
 
 async def get_item(db: AsyncSession, item_id: str) -> ItemModel | None:
     result = await db.execute(
@@ -44,47 +85,41 @@ async def get_item(db: AsyncSession, item_id: str) -> ItemModel | None:
     )
     return result.scalars().first()
 
-async def get_items_by_ids(db: AsyncSession, item_ids: List[str]) -> List[ItemModel]:
+async def get_items_by_ids(db: AsyncSession, item_ids: List[str]) -> list:
+    """検索結果の id 順に、販売中の商品のカードを返す"""
     if not item_ids:
         return []
 
     result = await db.execute(
-        select(ItemModel)
-        .options(
-            selectinload(ItemModel.seller),
-            selectinload(ItemModel.category),
-            selectinload(ItemModel.brand),
-            selectinload(ItemModel.condition),
-            selectinload(ItemModel.images)
-        )
+        select(*card_columns())
         .filter(ItemModel.status == "on_sale")
         .filter(ItemModel.id.in_(item_ids))
     )
-    items = result.scalars().all()
+    cards = result.all()
     
-    items_map = {item.id: item for item in items}
-    sorted_items = [items_map[id] for id in item_ids if id in items_map]
+    cards_map = {card.id: card for card in cards}
+    sorted_cards = [cards_map[id] for id in item_ids if id in cards_map]
     
-    return sorted_items
+    return sorted_cards
 
-async def get_items_by_user_id(db: AsyncSession, user_id: str) -> List[ItemModel]:
-    result = await db.execute(
-        select(ItemModel)
-        .options(
-            selectinload(ItemModel.seller),
-            selectinload(ItemModel.category),
-            selectinload(ItemModel.brand),
-            selectinload(ItemModel.condition),
-            selectinload(ItemModel.images),
-        )
-        .filter(ItemModel.seller_id == user_id)
-        .order_by(desc(ItemModel.updated_at))
+async def get_items_by_user_id(db: AsyncSession, user_id: str, limit: int, cursor: str | None = None):
+    """出品者の商品のカードを新しく更新された順に1ページ分返す -> (cards, next_cursor)"""
+    query = _keyset_page(
+        select(*card_columns()).filter(ItemModel.seller_id == user_id),
+        ItemModel.updated_at, ItemModel.id, cursor, limit,
     )
-    return result.scalars().all()
+    cards = (await db.execute(query)).all()
+    return _split_page(cards, limit, lambda card: (card.updated_at, card.id))
 
 async def delete_item(db: AsyncSession, original: ItemModel) -> None:
+    item_id = original.id
     await db.delete(original)
+    item_cache.record_change(db, item_id)
     await db.commit()
+    item_cache.invalidate(item_id)
+
+    if core.search_engine:
+        await core.search_engine.remove(item_id)
     return
 
 async def create_item(
@@ -116,110 +151,159 @@ async def create_item(
         )
         db.add(new_image)
 
-    embedding_list = None
-    if core.search_engine and core.search_engine.model:
-        try:
-            item_dict = {
-                "title": item_create.title,
-                "price": item_create.price,
-                "brand_id": item_create.brand_id,
-                "category_id": item_create.category_id,
-                "condition_id": item_create.condition_id
-            }
-            embedding_list = core.search_engine.encode_single_item(item_dict)
-        except Exception as e:
-            print(f"❌ ERROR in create_item (encoding): {e}")
-
-    if embedding_list:
-        new_vector = ItemVector(
-            item_id=new_uuid,
-            embedding=embedding_list
-        )
-        db.add(new_vector)
-    
     db.add(item)
+    # ベクトル化は推論を待たずにキューへ積む (商品と同じトランザクションでコミットされる)
+    await embedding_queue.enqueue(db, new_uuid)
     await db.commit()
-    await db.refresh(item)
+    embedding_queue.notify()
     return await get_item(db, new_uuid)
 
 async def update_item(
     db: AsyncSession, item_id: str, item_update: ItemUpdate
 ) -> ItemModel | None:
-    VECTOR_FIELDS = ["title", "description", "price", "category_id", "brand_id", "condition_id"]
     item = await get_item(db, item_id)
     if item is None:
         return None
 
     update_data = item_update.model_dump(exclude_unset=True)
-    vector_fields_modified = False
+    previous_input = encoder_input(item)
 
     for key, value in update_data.items():
-        if key in VECTOR_FIELDS and getattr(item, key) != value:
-            vector_fields_modified = True
         setattr(item, key, value)
 
     item.updated_at = datetime.now()
     
-    if vector_fields_modified and core.search_engine:
-        try:
-            item_dict = {
-                "title": item.title,
-                "price": item.price,
-                "brand_id": item.brand_id,
-                "category_id": item.category_id,
-                "condition_id": item.condition_id
-            }
-            new_embedding_list = core.search_engine.encode_single_item(item_dict)
-            
-            if new_embedding_list:
-                existing_vector = await db.execute(
-                    select(ItemVector).filter(ItemVector.item_id == item_id)
-                )
-                current_vector = existing_vector.scalars().first()
-                
-                if current_vector:
-                    current_vector.embedding = new_embedding_list
-                    db.add(current_vector)
-                else:
-                    new_vector = ItemVector(
-                        item_id=item_id, 
-                        embedding=new_embedding_list
-                    )
-                    db.add(new_vector)
-        except Exception:
-            pass
-
+    # エンコーダ入力が変わったときだけベクトル化をキューに積む (説明文・状態だけの編集では積まない)
+    # ワーカーがモデルバージョンごとの指紋を比べ、タイトルが同じなら projection だけ再計算する
+    reencode = encoder_input(item) != previous_input
     db.add(item)
+    if reencode:
+        await embedding_queue.enqueue(db, item_id)
+    item_cache.record_change(db, item_id)
     await db.commit()
+    item_cache.invalidate(item_id)
     await db.refresh(item)
+
+    if reencode:
+        embedding_queue.notify()
+    if core.search_engine:
+        # 新しいベクトルができるまでは旧ベクトルのまま、販売状況・価格などのフィルタ属性だけ先に反映する
+        await core.search_engine.update_attributes(item_id, item_attributes(item))
     return await get_item(db, item_id)
 
-async def get_purchased_items_by_user(db: AsyncSession, user_id: str) -> List[ItemModel]:
-    result = await db.execute(
-        select(ItemModel)
+async def get_purchased_items_by_user(db: AsyncSession, user_id: str, limit: int, cursor: str | None = None):
+    """購入した商品のカードを購入が新しい順に1ページ分返す (カーソルは取引の (created_at, id)) -> (cards, next_cursor)"""
+    query = _keyset_page(
+        select(*card_columns(), TransactionModel.created_at.label("purchased_at"), TransactionModel.id.label("transaction_id"))
         .join(TransactionModel, ItemModel.id == TransactionModel.item_id)
-        .filter(TransactionModel.buyer_id == user_id)
-        .options(
-            selectinload(ItemModel.seller),
-            selectinload(ItemModel.category),
-            selectinload(ItemModel.brand),
-            selectinload(ItemModel.condition),
-            selectinload(ItemModel.images),
+        .filter(TransactionModel.buyer_id == user_id),
+        TransactionModel.created_at, TransactionModel.id, cursor, limit,
+    )
+    cards = (await db.execute(query)).all()
+    return _split_page(cards, limit, lambda card: (card.purchased_at, card.transaction_id))
+
+async def get_all_vectors(db: AsyncSession, version: str, updated_since: datetime | None = None):
+    """
+    指定したモデルバージョンの全ベクトルと、検索フィルタに使う商品属性をまとめて取得する
+    updated_since を指定すると、その時刻より後に商品かベクトルが更新されたものだけ (スナップショットとの差分)
+    (ベクトル化待ちの商品は items.updated_at より後にベクトルが書かれるので、両方を見る)
+    """
+    query = (
+        select(
+            ItemVector.item_id, ItemVector.embedding, ItemVector.dtype,
+            ItemModel.status, ItemModel.category_id, ItemModel.brand_id,
+            ItemModel.condition_id, ItemModel.price,
         )
-        .order_by(desc(TransactionModel.created_at)) 
+        .join(ItemModel, ItemModel.id == ItemVector.item_id)
+        .filter(ItemVector.model_version == version)
     )
-    return result.scalars().all()
+    if updated_since is not None:
+        query = query.filter(or_(ItemModel.updated_at > updated_since, ItemVector.updated_at > updated_since))
+    result = await db.execute(query)
+    return result.all()
 
-async def get_all_vectors(db: AsyncSession):
-    result = await db.execute(select(ItemVector))
+async def get_removed_item_ids(db: AsyncSession, since: datetime) -> list:
+    """since より後に item_changes に積まれ、もう items に無い (削除された) 商品の id"""
+    result = await db.execute(
+        select(ItemChange.item_id).distinct()
+        .outerjoin(ItemModel, ItemModel.id == ItemChange.item_id)
+        .filter(ItemChange.changed_at > since, ItemModel.id.is_(None))
+    )
     return result.scalars().all()
 
-async def get_vector_by_id(db: AsyncSession, item_id: str):
+async def get_item_ids(db: AsyncSession) -> set:
+    result = await db.execute(select(ItemModel.id))
+    return set(result.scalars().all())
+
+def encoder_input(item: ItemModel) -> dict:
+    return {
+        "title": item.title,
+        "price": item.price,
+        "brand_id": item.brand_id,
+        "category_id": item.category_id,
+        "condition_id": item.condition_id
+    }
+
+def item_attributes(item: ItemModel) -> dict:
+    return {
+        "status": item.status,
+        "category_id": item.category_id,
+        "brand_id": item.brand_id,
+        "condition_id": item.condition_id,
+        "price": item.price,
+    }
+
+async def get_vector_meta(db: AsyncSession, item_ids: List[str], version: str) -> dict:
+    """
+    item_id -> (fingerprint, title_state, title_state_key) (ベクトル本体は読まない)
+    """
+    if not item_ids:
+        return {}
     result = await db.execute(
-        select(ItemVector)
-        .filter(ItemVector.item_id == item_id)
+        select(ItemVector.item_id, ItemVector.fingerprint, ItemVector.title_state, ItemVector.title_state_key)
+        .filter(ItemVector.item_id.in_(item_ids), ItemVector.model_version == version)
     )
-    return result.scalars().first()
+    return {row.item_id: row for row in result.all()}
+
+async def seed_title_state(title: str, stored, version: str) -> bool:
+    """保存済みの pooler 出力が現在のタイトル・バージョンのものならエンジンのキャッシュに戻す"""
+    if stored is None or stored.title_state is None or stored.title_state_key != title_state_key(title, version):
+        return False
+    await core.search_engine.seed_title_state(title, unpack_vector(stored.title_state), version=version)
+    return True
+
+async def title_state_columns(title: str, version: str) -> dict:
+    state = await core.search_engine.title_state(title, version=version) if core.search_engine else None
+    if state is None:
+        return {"title_state": None, "title_state_key": None}
+    return {"title_state": pack_vector(state, "float32"), "title_state_key": title_state_key(title, version)}
+
+async def vector_row(item_id: str, embedding_list: list, version: str, fingerprint: str, title: str) -> dict:
+    """upsert_vectors に渡す item_vectors の1行 (ベクトルはバイナリ形式)"""
+    return {
+        "item_id": item_id,
+        "model_version": version,
+        "embedding": pack_vector(embedding_list),
+        "dtype": DEFAULT_STORAGE_DTYPE,
+        "fingerprint": fingerprint,
+        **(await title_state_columns(title, version)),
+    }
+
+async def upsert_vectors(db: AsyncSession, rows: list) -> None:
+    """
+    ベクトルをまとめて保存する (commit は呼び出し側)
+    """
+    current_time = datetime.now()
+    stmt = mysql_insert(ItemVector).values([{**row, "updated_at": current_time} for row in rows])
+    stmt = stmt.on_duplicate_key_update(
+        updated_at=stmt.inserted.updated_at,
+        embedding=stmt.inserted.embedding,
+        dtype=stmt.inserted.dtype,
+        fingerprint=stmt.inserted.fingerprint,
+        title_state=stmt.inserted.title_state,
+        title_state_key=stmt.inserted.title_state_key,
+    )
+    await db.execute(stmt)
 
 async def purchase_item(
     db: AsyncSession, 
@@ -245,55 +329,11 @@ async def purchase_item(
 
     db.add(item)
     db.add(transaction)
+    item_cache.record_change(db, item_id)
     await db.commit()
+    item_cache.invalidate(item_id)
     await db.refresh(item)
-    return await get_item(db, item_id)
-
-async def sync_vectors(db: AsyncSession) -> int:
-    """
-    全アイテムのベクトルを再計算して保存する
-    """
-    if not core.search_engine:
-        print("Batch sync skipped: Search engine not loaded")
-        return 0
-
-    # 全アイテム取得
-    result = await db.execute(select(ItemModel))
-    items = result.scalars().all()
-    
-    count = 0
-    for item in items:
-        try:
-            item_dict = {
-                "title": item.title,
-                "price": item.price,
-                "brand_id": item.brand_id,
-                "category_id": item.category_id,
-                "condition_id": item.condition_id
-            }
-            # エンコード
-            embedding_list = core.search_engine.encode_single_item(item_dict)
-            
-            if embedding_list:
-                # 既存ベクトルを確認
-                vec_res = await db.execute(
-                    select(ItemVector).filter(ItemVector.item_id == item.id)
-                )
-                current_vector = vec_res.scalars().first()
-                
-                if current_vector:
-                    current_vector.embedding = embedding_list
-                    db.add(current_vector)
-                else:
-                    new_vector = ItemVector(
-                        item_id=item.id, 
-                        embedding=embedding_list
-                    )
-                    db.add(new_vector)
-                count += 1
-        except Exception as e:
-            print(f"❌ Failed to sync vector for item {item.id}: {e}")
-            continue
 
-    await db.commit()
-    return count
\ No newline at end of file
+    if core.search_engine:
+        await core.search_engine.update_attributes(item_id, item_attributes(item))
+    return await get_item(db, item_id)
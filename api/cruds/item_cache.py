@@ -0,0 +1,115 @@
+import os
+import asyncio
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, func, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from api.db import async_session
+from api.models.item_change import ItemChange
+from api.utils.cache import LRUCache
+from api.utils.search_client import SEARCH_INDEX_SYNC_INTERVAL
+
+# ---------------------------------------------------------
+# GET /item/{item_id} のレスポンス ((ETag, シリアライズ済みの ItemResponse)) をプロセス内にキャッシュする
+# 書き込んだワーカーはコミット直後に自分のキャッシュから外し、item_changes に積んだ行を
+# 他のワーカーが ITEM_CACHE_SYNC_INTERVAL 秒ごとに読んで外す
+# item_changes は検索インデックスの同期 (SEARCH_INDEX_SYNC_INTERVAL) でも削除の検出に使う
+# ---------------------------------------------------------
+ITEM_CACHE_SIZE = int(os.getenv("ITEM_CACHE_SIZE", 2048))
+ITEM_CACHE_TTL = float(os.getenv("ITEM_CACHE_TTL", 30))
+# 0 ならワーカー間の無効化をしない (他のワーカーの更新は TTL が切れるまで反映されない)
+ITEM_CACHE_SYNC_INTERVAL = float(os.getenv("ITEM_CACHE_SYNC_INTERVAL", 1))
+# version の採番順とコミット順が前後した行を取りこぼさないよう、この秒数以内の変更は毎回読み直す
+ITEM_CACHE_SYNC_LOOKBACK = float(os.getenv("ITEM_CACHE_SYNC_LOOKBACK", 5))
+ITEM_CACHE_CHANGE_RETENTION = float(os.getenv("ITEM_CACHE_CHANGE_RETENTION", 3600))
+
+_cache = LRUCache(ITEM_CACHE_SIZE, ITEM_CACHE_TTL)
+# 無効化のたびに進める。読み込み中に無効化された商品は、読んだ (古いかもしれない) 内容をキャッシュしない
+_generation = 0
+_invalidated = LRUCache(ITEM_CACHE_SIZE, 60)
+# 読み終えた item_changes.version (None の間は他のワーカーの更新を追えていないのでキャッシュに入れない)
+_synced_version = None
+_last_pruned = 0.0
+_task = None
+
+def get(item_id: str) -> tuple | None:
+    return _cache.get(item_id)
+
+def begin_load() -> int:
+    """DB から読む前に呼び、戻り値を put に渡す"""
+    return _generation
+
+def put(item_id: str, payload: tuple, started: int) -> None:
+    if ITEM_CACHE_SYNC_INTERVAL > 0 and _synced_version is None:
+        return
+    if _invalidated.get(item_id, -1) > started:
+        return
+    _cache.set(item_id, payload)
+
+def invalidate(item_id: str) -> None:
+    global _generation
+    _generation += 1
+    _invalidated.set(item_id, _generation)
+    _cache.pop(item_id)
+
+def record_change(db: AsyncSession, item_id: str) -> None:
+    """商品の書き込みと同じトランザクションで無効化ログを積む (commit は呼び出し側)"""
+    if ITEM_CACHE_SYNC_INTERVAL > 0 or SEARCH_INDEX_SYNC_INTERVAL > 0:
+        db.add(ItemChange(item_id=item_id, changed_at=datetime.now()))
+
+async def sync_once() -> int:
+    """他のワーカーの変更を読んでキャッシュから外す。外した件数を返す"""
+    global _synced_version
+    async with async_session() as db:
+        if _synced_version is None:
+            # 起動直後 (または同期の失敗後) はキャッシュが空なので、今の位置から追いかける
+            _cache.clear()
+            _synced_version = (await db.execute(select(func.max(ItemChange.version)))).scalar() or 0
+            return 0
+        since = datetime.now() - timedelta(seconds=ITEM_CACHE_SYNC_LOOKBACK)
+        rows = (await db.execute(
+            select(ItemChange.version, ItemChange.item_id)
+            .where(or_(ItemChange.version > _synced_version, ItemChange.changed_at >= since))
+        )).all()
+        await prune_changes(db)
+    for version, item_id in rows:
+        invalidate(item_id)
+    if rows:
+        _synced_version = max(_synced_version, max(version for version, _ in rows))
+    return len(rows)
+
+async def prune_changes(db: AsyncSession) -> None:
+    """ITEM_CACHE_CHANGE_RETENTION より古い item_changes を (ときどき) 消す"""
+    global _last_pruned
+    now = asyncio.get_running_loop().time()
+    if now - _last_pruned > ITEM_CACHE_CHANGE_RETENTION / 10:
+        _last_pruned = now
+        await db.execute(delete(ItemChange).where(
+            ItemChange.changed_at < datetime.now() - timedelta(seconds=ITEM_CACHE_CHANGE_RETENTION)
+        ))
+        await db.commit()
+
+async def run_sync() -> None:
+    global _synced_version
+    while True:
+        try:
+            await sync_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 他のワーカーの更新を追えない間はキャッシュを使わない
+            print(f"❌ Item cache sync failed: {e!r}")
+            _synced_version = None
+            _cache.clear()
+        await asyncio.sleep(ITEM_CACHE_SYNC_INTERVAL)
+
+def start_sync() -> None:
+    global _task
+    if ITEM_CACHE_SYNC_INTERVAL > 0 and (_task is None or _task.done()):
+        _task = asyncio.create_task(run_sync())
+
+def stop_sync() -> None:
+    global _task, _synced_version
+    if _task is not None:
+        _task.cancel()
+    _task = None
+    _synced_version = None
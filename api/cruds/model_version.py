@@ -0,0 +1,104 @@
+from datetime import datetime
+from typing import List
+from sqlalchemy import select, update, delete, desc
+from sqlalchemy.ext.asyncio import AsyncSession
+from api.models.model_version import ModelVersion
+from api.models.embedding import ItemVector
+
+async def get_version(db: AsyncSession, version: str) -> ModelVersion | None:
+    result = await db.execute(select(ModelVersion).filter(ModelVersion.version == version))
+    return result.scalars().first()
+
+async def get_active_version(db: AsyncSession) -> ModelVersion | None:
+    result = await db.execute(select(ModelVersion).filter(ModelVersion.status == "active"))
+    return result.scalars().first()
+
+async def get_versions(db: AsyncSession) -> List[ModelVersion]:
+    result = await db.execute(select(ModelVersion).order_by(desc(ModelVersion.created_at)))
+    return result.scalars().all()
+
+async def get_building_versions(db: AsyncSession) -> List[ModelVersion]:
+    result = await db.execute(select(ModelVersion).filter(ModelVersion.status == "building"))
+    return result.scalars().all()
+
+async def get_previous_version(db: AsyncSession) -> ModelVersion | None:
+    """ロールバック先 (直前まで稼働していた ready のバージョン)"""
+    result = await db.execute(
+        select(ModelVersion)
+        .filter(ModelVersion.status == "ready", ModelVersion.activated_at.isnot(None))
+        .order_by(desc(ModelVersion.activated_at))
+    )
+    return result.scalars().first()
+
+async def ensure_active_version(db: AsyncSession, version: str, model_path: str, vocab_path: str) -> ModelVersion:
+    """
+    稼働中のバージョンを返す。まだ1つも登録されていなければ (初回起動) 指定のモデルを稼働中として登録する
+    """
+    active = await get_active_version(db)
+    if active:
+        return active
+    current_time = datetime.now()
+    active = ModelVersion(
+        version=version,
+        model_path=model_path,
+        vocab_path=vocab_path,
+        status="active",
+        created_at=current_time,
+        activated_at=current_time,
+    )
+    db.add(active)
+    await db.commit()
+    await db.refresh(active)
+    return active
+
+async def register_version(db: AsyncSession, version: str, model_path: str, vocab_path: str) -> ModelVersion:
+    """新しいバージョンを building として登録する (削除済みのバージョン名は再利用できる)"""
+    model_version = await get_version(db, version)
+    if model_version is None:
+        model_version = ModelVersion(version=version, created_at=datetime.now())
+        db.add(model_version)
+    model_version.model_path = model_path
+    model_version.vocab_path = vocab_path
+    model_version.status = "building"
+    model_version.activated_at = None
+    await db.commit()
+    await db.refresh(model_version)
+    return model_version
+
+async def mark_ready(db: AsyncSession, version: str) -> None:
+    await db.execute(
+        update(ModelVersion)
+        .where(ModelVersion.version == version, ModelVersion.status == "building")
+        .values(status="ready")
+    )
+    await db.commit()
+
+async def activate_version(db: AsyncSession, version: str) -> bool:
+    """
+    1トランザクションで稼働中のバージョンを差し替える (旧バージョンは ready に戻り、ロールバック先になる)
+    """
+    result = await db.execute(
+        update(ModelVersion)
+        .where(ModelVersion.version == version, ModelVersion.status == "ready")
+        .values(status="active", activated_at=datetime.now())
+    )
+    if result.rowcount != 1:
+        await db.rollback()
+        return False
+    await db.execute(
+        update(ModelVersion)
+        .where(ModelVersion.version != version, ModelVersion.status == "active")
+        .values(status="ready")
+    )
+    await db.commit()
+    return True
+
+async def retire_version(db: AsyncSession, version: str) -> None:
+    """稼働中でないバージョンのベクトルを削除する"""
+    await db.execute(delete(ItemVector).where(ItemVector.model_version == version))
+    await db.execute(
+        update(ModelVersion)
+        .where(ModelVersion.version == version, ModelVersion.status != "active")
+        .values(status="retired")
+    )
+    await db.commit()
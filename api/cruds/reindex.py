@@ -0,0 +1,217 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from api.db import async_session
+from api.models.item import Item as ItemModel
+from api.models.reindex_job import ReindexJob
+from api.cruds.item import (
+    encoder_input, item_attributes, get_vector_meta, seed_title_state, vector_row, upsert_vectors
+)
+from api.utils.fingerprint import encoder_fingerprint
+from api.utils.inference import InferenceBusyError
+import api.cruds.model_version as model_version_crud
+import api.core as core
+
+REINDEX_CHUNK_SIZE = int(os.getenv("REINDEX_CHUNK_SIZE", 256))
+REINDEX_ENCODE_TIMEOUT = float(os.getenv("REINDEX_ENCODE_TIMEOUT", 60))
+# updated_at がこれより古い running ジョブはプロセスが落ちたとみなして再開する
+REINDEX_STALE_SECONDS = int(os.getenv("REINDEX_STALE_SECONDS", 120))
+
+# 実行中のタスクへの参照 (GC で消されないように保持する)
+_tasks = set()
+
+async def get_job(db: AsyncSession, job_id: str) -> ReindexJob | None:
+    result = await db.execute(select(ReindexJob).filter(ReindexJob.id == job_id))
+    return result.scalars().first()
+
+async def get_active_job(db: AsyncSession, model_version: str) -> ReindexJob | None:
+    result = await db.execute(
+        select(ReindexJob)
+        .filter(ReindexJob.status.in_(["pending", "running"]))
+        .filter(ReindexJob.model_version == model_version)
+        .order_by(ReindexJob.created_at)
+    )
+    return result.scalars().first()
+
+async def last_job_update(db: AsyncSession, model_version: str) -> datetime | None:
+    """
+    そのバージョンのベクトルを最後に書いたジョブの時刻
+    (ジョブはほぼ全件のベクトルを書き換えるので、差分に載せるよりスナップショットを作り直す)
+    """
+    result = await db.execute(
+        select(func.max(ReindexJob.updated_at))
+        .filter(ReindexJob.model_version == model_version, ReindexJob.processed > 0)
+    )
+    return result.scalar()
+
+async def create_job(db: AsyncSession, model_version: str, force: bool = False) -> ReindexJob:
+    """
+    指定したモデルバージョンの再インデックスジョブを登録する (そのバージョンの実行中のジョブがあればそれを返す)
+    """
+    active = await get_active_job(db, model_version)
+    if active:
+        return active
+
+    total = (await db.execute(select(func.count()).select_from(ItemModel))).scalar()
+    current_time = datetime.now()
+    job = ReindexJob(
+        id=str(uuid.uuid4()),
+        status="pending",
+        processed=0,
+        failed=0,
+        skipped=0,
+        force=force,
+        model_version=model_version,
+        total=total,
+        created_at=current_time,
+        updated_at=current_time,
+    )
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+async def claim_job(db: AsyncSession, job_id: str, updated_at: datetime) -> bool:
+    """
+    楽観ロックでジョブの実行権を取る (複数ワーカーが同じジョブを再開しないように)
+    """
+    result = await db.execute(
+        update(ReindexJob)
+        .where(ReindexJob.id == job_id, ReindexJob.updated_at == updated_at)
+        .values(status="running", updated_at=datetime.now())
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+async def cancel_jobs(db: AsyncSession, model_version: str) -> None:
+    """削除するバージョンのジョブを止める (run_job は次のチャンクで status を見て終了する)"""
+    await db.execute(
+        update(ReindexJob)
+        .where(ReindexJob.model_version == model_version, ReindexJob.status.in_(["pending", "running"]))
+        .values(status="cancelled", updated_at=datetime.now(), finished_at=datetime.now())
+    )
+    await db.commit()
+
+async def _encode_chunk(item_dicts: list, version: str, refresh: bool = False) -> list:
+    if not item_dicts:
+        return []
+    while True:
+        try:
+            return await core.search_engine.encode_items(
+                item_dicts, timeout=REINDEX_ENCODE_TIMEOUT, version=version, refresh=refresh
+            )
+        except InferenceBusyError:
+            # 検索リクエストを優先し、空くまで待つ
+            await asyncio.sleep(0.5)
+
+async def run_job(job_id: str) -> None:
+    """
+    items を id 順のキーセットページングで読み、チャンクごとに
+    バッチエンコード → ベクトルの一括 upsert → 進捗更新 を1トランザクションでコミットする
+    ベクトルはジョブのモデルバージョンの行にだけ書くので、新バージョンの作成中も稼働中のバージョンの検索は変わらない
+    """
+    try:
+        while True:
+            async with async_session() as db:
+                job = await get_job(db, job_id)
+                if job is None or job.status != "running":
+                    return
+                if job.model_version is None:
+                    # バージョン導入前に登録されたジョブは稼働中のバージョンのもの
+                    job.model_version = (await model_version_crud.get_active_version(db)).version
+                version = job.model_version
+
+                query = select(ItemModel).order_by(ItemModel.id).limit(REINDEX_CHUNK_SIZE)
+                if job.last_item_id:
+                    query = query.filter(ItemModel.id > job.last_item_id)
+                items = (await db.execute(query)).scalars().all()
+
+                if not items:
+                    processed, failed = job.processed, job.failed
+                    job.updated_at = job.finished_at = datetime.now()
+                    if failed:
+                        # ベクトルが欠けたまま切り替えると、その商品が検索から消えるので building のままにする
+                        # (POST /search/sync?version=... で欠けた分だけ作り直せる)
+                        job.status = "failed"
+                        job.error = f"{failed} item(s) failed to encode"
+                        await db.commit()
+                        print(f"❌ Reindex job {job_id} finished with {failed} failed item(s) (model {version})")
+                        return
+                    job.status = "completed"
+                    await db.commit()
+                    # 作成中のバージョンは全件そろったので切り替え可能になる
+                    await model_version_crud.mark_ready(db, version)
+                    print(f"✅ Reindex job {job_id} completed ({processed} items, model {version})")
+                    return
+
+                # 指紋が一致する商品はエンコードしない
+                # タイトルが変わっていない商品は保存済みの pooler 出力を使い、projection だけ再計算する
+                stored = await get_vector_meta(db, [item.id for item in items], version)
+                targets = []
+                for item in items:
+                    item_dict = encoder_input(item)
+                    fingerprint = encoder_fingerprint(item_dict, version)
+                    meta = stored.get(item.id)
+                    if not job.force and meta is not None and meta.fingerprint == fingerprint:
+                        job.skipped += 1
+                        continue
+                    if not job.force:
+                        await seed_title_state(item.title, meta, version)
+                    targets.append((item, item_dict, fingerprint))
+
+                # force のときはタイトルのキャッシュ (保存済みの pooler 出力を含む) も信用せず BERT にかけ直す
+                embeddings = await _encode_chunk([item_dict for _, item_dict, _ in targets], version, refresh=job.force)
+                rows = []
+                synced = []
+                for (item, _, fingerprint), embedding_list in zip(targets, embeddings):
+                    if not embedding_list:
+                        job.failed += 1
+                        continue
+                    rows.append(await vector_row(item.id, embedding_list, version, fingerprint, item.title))
+                    synced.append((item.id, embedding_list, item_attributes(item)))
+
+                if rows:
+                    await upsert_vectors(db, rows)
+                job.last_item_id = items[-1].id
+                job.processed += len(items)
+                job.updated_at = datetime.now()
+                await db.commit()
+
+            for item_id, embedding_list, attrs in synced:
+                await core.search_engine.upsert(item_id, embedding_list, attrs, version=version)
+            await asyncio.sleep(0)
+    except Exception as e:
+        print(f"❌ Reindex job {job_id} failed: {e}")
+        async with async_session() as db:
+            job = await get_job(db, job_id)
+            if job and job.status == "running":
+                job.status = "failed"
+                job.error = str(e)
+                job.updated_at = job.finished_at = datetime.now()
+                await db.commit()
+
+def start_job(job_id: str) -> None:
+    task = asyncio.create_task(run_job(job_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+async def resume_stale_jobs(db: AsyncSession) -> int:
+    """
+    起動時に、途中で止まったジョブを最後のカーソルから再開する
+    """
+    threshold = datetime.now() - timedelta(seconds=REINDEX_STALE_SECONDS)
+    result = await db.execute(
+        select(ReindexJob)
+        .filter(ReindexJob.status.in_(["pending", "running"]))
+        .filter(ReindexJob.updated_at < threshold)
+    )
+    stale = [(job.id, job.updated_at) for job in result.scalars().all()]
+    resumed = 0
+    for job_id, updated_at in stale:
+        if await claim_job(db, job_id, updated_at):
+            start_job(job_id)
+            resumed += 1
+    return resumed
@@ -0,0 +1,119 @@
+import os
+import asyncio
+from sqlalchemy import select
+from api.db import async_session
+from api.models.item import Item as ItemModel
+import api.core as core
+import api.cruds.item as item_crud
+import api.cruds.embedding_queue as embedding_queue
+from api.utils.fingerprint import encoder_fingerprint
+from api.utils.inference import InferenceBusyError
+
+# ---------------------------------------------------------
+# pending_embeddings を読んでベクトル化するワーカー (lifespan で1プロセスに1つ起動する)
+# 読み込み済みのすべてのモデルバージョン (新バージョンを作成中なら新旧両方) のベクトルを作り、
+# ベクトルの保存とキューからの削除を1トランザクションでコミットしてからインデックスに反映する
+# ---------------------------------------------------------
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+EMBEDDING_POLL_SECONDS = float(os.getenv("EMBEDDING_POLL_SECONDS", 5))
+EMBEDDING_ENCODE_TIMEOUT = float(os.getenv("EMBEDDING_ENCODE_TIMEOUT", 30))
+
+_task = None
+counters = {"batches": 0, "embedded": 0, "failed": 0, "busy": 0}
+
+async def _encode_version(db, client, items: list, version: str, rows: list, synced: list, errors: dict) -> None:
+    """
+    1つのモデルバージョン分をバッチでエンコードする
+    指紋が保存済みのものと同じ商品は飛ばし、タイトルが同じなら保存済みの pooler 出力を使う
+    """
+    stored = await item_crud.get_vector_meta(db, [item.id for item in items], version)
+    targets = []
+    for item in items:
+        item_dict = item_crud.encoder_input(item)
+        fingerprint = encoder_fingerprint(item_dict, version)
+        meta = stored.get(item.id)
+        if meta is not None and meta.fingerprint == fingerprint:
+            continue
+        await item_crud.seed_title_state(item.title, meta, version)
+        targets.append((item, item_dict, fingerprint))
+    if not targets:
+        return
+
+    embeddings = await client.encode_items(
+        [item_dict for _, item_dict, _ in targets], timeout=EMBEDDING_ENCODE_TIMEOUT, version=version
+    )
+    for (item, _, fingerprint), embedding_list in zip(targets, embeddings):
+        if not embedding_list:
+            errors[item.id] = f"encode failed (model {version})"
+            continue
+        rows.append(await item_crud.vector_row(item.id, embedding_list, version, fingerprint, item.title))
+        synced.append((version, item.id, embedding_list, item_crud.item_attributes(item)))
+
+async def process_batch() -> int:
+    """キューから1バッチ取り出して処理する。処理した件数を返す (0 なら待つ)"""
+    client = core.search_engine
+    if client is None:
+        return 0
+
+    async with async_session() as db:
+        claimed = await embedding_queue.claim(db, EMBEDDING_BATCH_SIZE)
+        if not claimed:
+            return 0
+        item_ids = [row.item_id for row in claimed]
+        items = (await db.execute(select(ItemModel).filter(ItemModel.id.in_(item_ids)))).scalars().all()
+
+        rows, synced, errors = [], [], {}
+        try:
+            for version in (await client.versions())["loaded"]:
+                await _encode_version(db, client, items, version, rows, synced, errors)
+        except (InferenceBusyError, asyncio.TimeoutError):
+            # 検索リクエストを優先し、試行回数を増やさずに後で取り直す
+            counters["busy"] += 1
+            await embedding_queue.release(db, claimed)
+            return 0
+        except Exception as e:
+            print(f"❌ Embedding batch failed: {e!r}")
+            counters["failed"] += len(claimed)
+            await embedding_queue.fail(db, claimed, {item_id: repr(e) for item_id in item_ids})
+            return len(claimed)
+
+        # 一部のバージョンだけ成功した商品も、失敗扱いにして全バージョンをやり直す (成功分は指紋で飛ばされる)
+        if rows:
+            await item_crud.upsert_vectors(db, rows)
+        await embedding_queue.complete(db, [row for row in claimed if row.item_id not in errors])
+        await db.commit()
+        if errors:
+            counters["failed"] += len(errors)
+            await embedding_queue.fail(db, [row for row in claimed if row.item_id in errors], errors)
+
+    for version, item_id, embedding_list, attrs in synced:
+        await client.upsert(item_id, embedding_list, attrs, version=version)
+    counters["batches"] += 1
+    counters["embedded"] += len(claimed) - len(errors)
+    return len(claimed)
+
+async def run_worker() -> None:
+    while True:
+        try:
+            if await process_batch():
+                await asyncio.sleep(0)
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Embedding worker error: {e!r}")
+        await embedding_queue.wait_for_work(EMBEDDING_POLL_SECONDS)
+
+def start_worker() -> None:
+    global _task
+    if _task is None or _task.done():
+        _task = asyncio.create_task(run_worker())
+
+def stop_worker() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+    _task = None
+
+def worker_stats() -> dict:
+    return {"running": _task is not None and not _task.done(), **counters}
@@ -0,0 +1,138 @@
+import os
+import asyncio
+import numpy as np
+from api.search_loader import SearchReloader, load_local_search, local_readiness
+from api.utils.inference import InferenceBusyError
+from api.utils.search_client import INFERENCE_SOCKET, ModelVersionError, encode_frame, read_frame
+
+# ---------------------------------------------------------
+# モデル・インデックスを1プロセスだけに載せる推論サーバ
+# uvicorn の各ワーカーは INFERENCE_SOCKET 経由でここを呼ぶ (torch を読み込まない)
+#   python -m api.inference_server &
+#   INFERENCE_SOCKET=/tmp/mercari-inference.sock uvicorn api.main:app --workers 4
+# すべてのワーカーの検索クエリが同じ MicroBatcher に集まるので、ワーカーをまたいでバッチ推論される
+# ---------------------------------------------------------
+SOCKET_PATH = INFERENCE_SOCKET or "/tmp/mercari-inference.sock"
+
+def to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return value
+
+class InferenceServer:
+    def __init__(self, client):
+        self.client = client
+        self.connections = 0
+        self.requests = 0
+        # POST /search/reload (SidecarSearchClient.reload) で self.client を無停止で入れ替える
+        self.reloader = SearchReloader(self, "client")
+
+    async def dispatch(self, op: str, args: dict):
+        if op == "reload":
+            return self.reloader.start("admin")
+        if op == "reload_status":
+            return self.reloader.state()
+        if op == "readiness":
+            return await local_readiness(self.client, self.reloader)
+        # 差し替えられても、処理中の要求はここで掴んだ旧インスタンスで完了する
+        client = self.client
+        if client is None:
+            raise RuntimeError("search engine is not loaded")
+        version = args.get("version")
+        if op == "search_text":
+            return await client.search_text(args["query_text"], top_k=args["top_k"], filters=args["filters"], version=version)
+        if op == "search_vector":
+            return await client.search_vector(args["vector"], top_k=args["top_k"], filters=args["filters"], version=version)
+        if op == "search_item":
+            return await client.search_item(args["item_id"], top_k=args["top_k"], filters=args["filters"])
+        if op == "encode_items":
+            return await client.encode_items(
+                args["item_dicts"], timeout=args.get("encode_timeout"), version=version, refresh=args.get("refresh", False)
+            )
+        if op == "upsert":
+            return await client.upsert(args["item_id"], args["vector"], args.get("attrs"), version=version)
+        if op == "update_attributes":
+            return await client.update_attributes(args["item_id"], args["attrs"])
+        if op == "remove":
+            return await client.remove(args["item_id"])
+        if op == "title_state":
+            return await client.title_state(args["title"], version=version)
+        if op == "seed_title_state":
+            return await client.seed_title_state(args["title"], args["state"], version=version)
+        if op == "versions":
+            return await client.versions()
+        if op == "load_version":
+            return await client.load_version(version, args["model_path"], args["vocab_path"])
+        if op == "activate":
+            return await client.activate(version)
+        if op == "unload":
+            return await client.unload(version)
+        if op == "stats":
+            return {
+                **await client.stats(),
+                "inference_server": {"connections": self.connections, "requests": self.requests},
+            }
+        raise ValueError(f"unknown op: {op}")
+
+    async def respond(self, message: dict, writer: asyncio.StreamWriter, write_lock: asyncio.Lock) -> None:
+        response = {"id": message.get("id")}
+        try:
+            response["result"] = to_json(await self.dispatch(message.get("op"), message.get("args") or {}))
+        except InferenceBusyError:
+            response["error"] = "busy"
+        except asyncio.TimeoutError:
+            response["error"] = "timeout"
+        except ModelVersionError as e:
+            response["error"] = "version"
+            response["detail"] = str(e)
+        except Exception as e:
+            response["error"] = repr(e)
+        async with write_lock:
+            writer.write(encode_frame(response))
+            await writer.drain()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """要求ごとにタスクを立て、同じ接続の同時リクエストも並行に (= まとめてバッチで) 処理する"""
+        self.connections += 1
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                message = await read_frame(reader)
+                self.requests += 1
+                task = asyncio.create_task(self.respond(message, writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections -= 1
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+async def serve(path: str = SOCKET_PATH) -> None:
+    server = InferenceServer(None)
+    try:
+        server.client = await load_local_search()
+    except Exception as e:
+        # ソケットは開いておき、reload (またはファイル監視) で読み込み直せるようにする
+        server.reloader.record_failure("startup", repr(e))
+    server.reloader.watch()
+    server.reloader.sync()
+    if os.path.exists(path):
+        os.unlink(path)
+    unix_server = await asyncio.start_unix_server(server.handle, path=path)
+    print(f"✅ Inference server listening on {path}")
+    try:
+        async with unix_server:
+            await unix_server.serve_forever()
+    finally:
+        server.reloader.shutdown()
+        if server.client:
+            server.client.close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+if __name__ == "__main__":
+    asyncio.run(serve())
@@ -1,36 +1,93 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 import api.models
 import api.core as core
-from api.utils.searcher import VectorSearchEngine
-from api.routers import auth, item, me, search, comment, users, recommend,category,aiSearch, brand
-
-MODEL_PATH = "/code/api/data/mercari_twotower_model.pth"
-ENCODERS_PATH = "/code/api/data/encoders.pkl"
+from api.db import async_session
+import api.cruds.reindex as reindex_crud
+import api.embedding_worker as embedding_worker
+import api.cruds.item_cache as item_cache
+from api.search_loader import SearchReloader, load_local_search
+from api.utils.search_client import (
+    RemoteSearchClient, SidecarSearchClient, ModelVersionError, SERVING_ROLE, SEARCH_SERVICE_URL, SEARCH_SERVICE_TOKEN,
+    INFERENCE_SOCKET,
+)
+from api.utils.cursor import InvalidCursorError, NEXT_CURSOR_HEADER
+from api.routers import auth, item, me, search, comment, users, recommend,category,aiSearch, brand, internal_search, health
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    try:
-        engine = VectorSearchEngine(MODEL_PATH, ENCODERS_PATH)
-        core.search_engine = engine
-        print("✅ Search engine initialized")
-    except Exception:
-        core.search_engine = None
-        print("❌ Search engine initialization failed")
+    # SERVING_ROLE=api のレプリカは torch を読み込まず、検索は検索レプリカに委譲する (URL がなければ無効)
+    if SERVING_ROLE == "api":
+        if SEARCH_SERVICE_URL:
+            core.search_engine = RemoteSearchClient(SEARCH_SERVICE_URL)
+            print(f"✅ Search delegated to {SEARCH_SERVICE_URL}")
+        else:
+            print("ℹ️ Search is disabled on this replica (SERVING_ROLE=api)")
+    elif INFERENCE_SOCKET:
+        # モデルは推論サーバ (python -m api.inference_server) だけが持つ。接続は最初の呼び出しで張る
+        core.search_engine = SidecarSearchClient(INFERENCE_SOCKET)
+        print(f"✅ Search delegated to inference server at {INFERENCE_SOCKET}")
+    else:
+        # 起動に失敗してもプロセスは落とさず、POST /search/reload (またはファイル監視) で読み込み直せるようにする
+        core.search_reloader = SearchReloader(core, "search_engine")
+        try:
+            core.search_engine = await load_local_search()
+        except Exception as e:
+            core.search_engine = None
+            # GET /ready に理由が出る
+            core.search_reloader.record_failure("startup", repr(e))
+        core.search_reloader.watch()
+        # 他のワーカー・インスタンスでの出品・更新・削除をこのプロセスのインデックスに取り込む
+        core.search_reloader.sync()
+
+    if core.search_engine or core.search_reloader:
+        # 出品・更新で積まれたベクトル化待ちを処理する (エンジンが読み込まれるまでは待機する)
+        embedding_worker.start_worker()
+
+    # 他のワーカーでの商品の更新を読み、商品詳細のキャッシュから外す
+    item_cache.start_sync()
+
+    if core.search_engine:
+        try:
+            async with async_session() as db:
+                resumed = await reindex_crud.resume_stale_jobs(db)
+            if resumed:
+                print(f"🔁 Resumed {resumed} reindex job(s)")
+        except Exception as e:
+            print(f"❌ Failed to resume reindex jobs: {e}")
     
     yield
     
+    embedding_worker.stop_worker()
+    item_cache.stop_sync()
+    if core.search_reloader:
+        core.search_reloader.shutdown()
+    core.search_reloader = None
+    if core.search_engine:
+        core.search_engine.close()
     core.search_engine = None
 
 app = FastAPI(lifespan=lifespan)
 
+@app.exception_handler(ModelVersionError)
+async def model_version_error_handler(request: Request, exc: ModelVersionError):
+    # 読み込まれていない / 稼働中で外せないバージョンの指定 (RemoteSearchClient は 409 を ModelVersionError に戻す)
+    return JSONResponse(status_code=409, content={"detail": str(exc)})
+
+@app.exception_handler(InvalidCursorError)
+async def invalid_cursor_error_handler(request: Request, exc: InvalidCursorError):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # ブラウザから次ページのカーソルと ETag を読めるようにする
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
 app.include_router(auth.router)
@@ -43,4 +100,11 @@ app.include_router(recommend.router)
 app.include_router(category.router)
 app.include_router(aiSearch.router)
 app.include_router(brand.router)
+app.include_router(health.router)
+if SERVING_ROLE == "search":
+    if SEARCH_SERVICE_TOKEN:
+        app.include_router(internal_search.router)
+    else:
+        # トークンなしで内部 API (モデルの読み込みなど) を公開しない
+        print("❌ SEARCH_SERVICE_TOKEN is not set; internal search API is disabled")
 
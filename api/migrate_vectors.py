@@ -0,0 +1,137 @@
+import json
+import sys
+from sqlalchemy import text
+from api.migrate_db import engine
+from api.db import Base
+import api.models
+import api.models.users, api.models.item, api.models.item_image, api.models.embedding
+import api.models.comment, api.models.history, api.models.reindex_job, api.models.model_version
+import api.models.pending_embedding, api.models.item_change
+from api.utils.vector_codec import pack_vector
+from api.utils.fingerprint import ENCODER_VERSION
+
+# ---------------------------------------------------------
+# item_vectors.embedding を JSON 列からバイナリ列へ移行する
+#   python -m api.migrate_vectors [float32|float16]
+# ---------------------------------------------------------
+BATCH_SIZE = 1000
+
+# 既存テーブルに後から追加した列 (table, column, DDL)
+ADDED_COLUMNS = [
+    ("item_vectors", "fingerprint", "VARCHAR(64) NULL"),
+    ("item_vectors", "title_state", "BLOB NULL"),
+    ("item_vectors", "title_state_key", "VARCHAR(64) NULL"),
+    # 既存の行は今のモデル (ENCODER_VERSION) のベクトルとみなす
+    ("item_vectors", "model_version", f"VARCHAR(32) NOT NULL DEFAULT '{ENCODER_VERSION}'"),
+    ("reindex_jobs", "model_version", "VARCHAR(32) NULL"),
+    # 既存の行はスナップショットに載っている前提で NULL (差分には items.updated_at で載る)
+    ("item_vectors", "updated_at", "DATETIME NULL"),
+]
+
+# 後から NOT NULL にした列 (table, column, DDL, 既存の NULL を埋める値)
+NOT_NULL_COLUMNS = [
+    # 購入履歴のキーセットの列。日時の分からない古い取引は一番古い購入として扱う
+    ("transactions", "created_at", "DATETIME NOT NULL", "'1970-01-01 00:00:00'"),
+]
+
+# 既存テーブルに後から追加したインデックス (table, index, columns)
+ADDED_INDEXES = [
+    ("items", "ix_items_status_updated_at", "status, updated_at, id"),
+    ("items", "ix_items_seller_updated_at", "seller_id, updated_at, id"),
+    ("transactions", "ix_transactions_buyer_created_at", "buyer_id, created_at, id"),
+    ("item_images", "ix_item_images_item_created_at", "item_id, created_at, id"),
+    ("item_vectors", "ix_item_vectors_updated_at", "updated_at"),
+]
+
+def column_type(conn, column: str, table: str = "item_vectors") -> str | None:
+    row = conn.execute(text(
+        "SELECT DATA_TYPE FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND COLUMN_NAME = :col"
+    ), {"table": table, "col": column}).first()
+    return row[0].lower() if row else None
+
+def ensure_schema():
+    """新しいテーブルを作成し、既存テーブルに足りない列を追加する (既存データは消さない)"""
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            if column_type(conn, column, table) is None:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+                print(f"✅ {table}.{column} を追加しました")
+        ensure_vector_keys(conn)
+        for table, column, ddl, fill in NOT_NULL_COLUMNS:
+            if is_nullable(conn, table, column):
+                conn.execute(text(f"UPDATE {table} SET {column} = {fill} WHERE {column} IS NULL"))
+                conn.execute(text(f"ALTER TABLE {table} MODIFY COLUMN {column} {ddl}"))
+                print(f"✅ {table}.{column} を NOT NULL にしました")
+        for table, index, columns in ADDED_INDEXES:
+            if not has_index(conn, table, index):
+                conn.execute(text(f"CREATE INDEX {index} ON {table} ({columns})"))
+                print(f"✅ {table}.{index} を作成しました")
+
+def is_nullable(conn, table: str, column: str) -> bool:
+    row = conn.execute(text(
+        "SELECT IS_NULLABLE FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND COLUMN_NAME = :col"
+    ), {"table": table, "col": column}).first()
+    return row is not None and row[0] == "YES"
+
+def has_index(conn, table: str, index: str) -> bool:
+    return conn.execute(text(
+        "SELECT 1 FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND INDEX_NAME = :index"
+    ), {"table": table, "index": index}).first() is not None
+
+def ensure_vector_keys(conn):
+    """item_vectors の主キーを (item_id, model_version) にし、バージョンでの絞り込み用インデックスを張る"""
+    pk = [row[0] for row in conn.execute(text(
+        "SELECT COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'item_vectors' AND CONSTRAINT_NAME = 'PRIMARY' "
+        "ORDER BY ORDINAL_POSITION"
+    ))]
+    if pk == ["item_id"]:
+        conn.execute(text("ALTER TABLE item_vectors DROP PRIMARY KEY, ADD PRIMARY KEY (item_id, model_version)"))
+        print("✅ item_vectors の主キーを (item_id, model_version) に変更しました")
+    if not has_index(conn, "item_vectors", "ix_item_vectors_model_version"):
+        conn.execute(text("CREATE INDEX ix_item_vectors_model_version ON item_vectors (model_version)"))
+
+def migrate_vectors(dtype: str = "float32"):
+    with engine.begin() as conn:
+        legacy_type = column_type(conn, "embedding")
+        if legacy_type != "json" and column_type(conn, "embedding_bin") is None:
+            print("✅ item_vectors は既にバイナリ形式です")
+            return
+        if column_type(conn, "embedding_bin") is None:
+            conn.execute(text("ALTER TABLE item_vectors ADD COLUMN embedding_bin BLOB NULL"))
+        if column_type(conn, "dtype") is None:
+            conn.execute(text("ALTER TABLE item_vectors ADD COLUMN dtype VARCHAR(8) NOT NULL DEFAULT 'float32'"))
+
+    # バッチごとに変換してコミット (途中で止まっても再実行で続きから処理される)
+    converted = 0
+    while legacy_type == "json":
+        with engine.begin() as conn:
+            rows = conn.execute(text(
+                "SELECT item_id, embedding FROM item_vectors WHERE embedding_bin IS NULL LIMIT :n"
+            ), {"n": BATCH_SIZE}).all()
+            if not rows:
+                break
+            params = []
+            for item_id, embedding in rows:
+                if isinstance(embedding, str):
+                    embedding = json.loads(embedding)
+                params.append({"id": item_id, "bin": pack_vector(embedding, dtype), "dtype": dtype})
+            conn.execute(text(
+                "UPDATE item_vectors SET embedding_bin = :bin, dtype = :dtype WHERE item_id = :id"
+            ), params)
+            converted += len(rows)
+            print(f"... {converted} rows converted")
+
+    with engine.begin() as conn:
+        if legacy_type is not None:
+            conn.execute(text("ALTER TABLE item_vectors DROP COLUMN embedding"))
+        conn.execute(text("ALTER TABLE item_vectors CHANGE COLUMN embedding_bin embedding BLOB NOT NULL"))
+    print(f"✅ {converted} 件のベクトルを {dtype} バイナリに変換しました！")
+
+if __name__ == "__main__":
+    migrate_vectors(sys.argv[1] if len(sys.argv) > 1 else "float32")
+    ensure_schema()
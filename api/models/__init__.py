@@ -1,4 +1,8 @@
 from .category import Category
 from .brand import Brand
 from .condition import ItemCondition
-from .transaction import Transaction
\ No newline at end of file
+from .transaction import Transaction
+from .reindex_job import ReindexJob
+from .model_version import ModelVersion
+from .pending_embedding import PendingEmbedding
+from .item_change import ItemChange
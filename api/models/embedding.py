@@ -1,12 +1,28 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, ForeignKey, LargeBinary, DateTime
 from sqlalchemy.orm import relationship
 from api.db import Base
+from api.utils.vector_codec import unpack_vector
+from api.utils.fingerprint import ENCODER_VERSION
 
 class ItemVector(Base):
     __tablename__ = "item_vectors"
 
     item_id = Column(String(36), ForeignKey("items.id"), primary_key=True)
+    # どのモデルでエンコードしたベクトルか (新モデルは旧モデルの行を上書きせずに裏で作る)
+    model_version = Column(String(32), primary_key=True, index=True, default=ENCODER_VERSION)
     
-    embedding = Column(JSON, nullable=False)
+    # リトルエンディアンの生 float32 / float16 (JSONより約5倍小さい)
+    embedding = Column(LargeBinary, nullable=False)
+    dtype = Column(String(8), nullable=False, default="float32")
+    # エンコーダ入力 + エンコーダバージョンのハッシュ (一致すれば再エンコード不要)
+    fingerprint = Column(String(64), nullable=True)
+    # タイトルの BERT pooler 出力 (float32) とそのキー。タイトルが同じなら BERT を再実行しなくてよい
+    title_state = Column(LargeBinary, nullable=True)
+    title_state_key = Column(String(64), nullable=True)
+    # ベクトルを書いた時刻 (ワーカーは items.updated_at より後に書くので、スナップショットの差分はこちらでも拾う)
+    updated_at = Column(DateTime, nullable=True, index=True)
 
-    item = relationship("Item", back_populates="vector")
\ No newline at end of file
+    item = relationship("Item", back_populates="vectors")
+
+    def to_array(self):
+        return unpack_vector(self.embedding, self.dtype)
@@ -1,10 +1,15 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Index
 from sqlalchemy.orm import relationship
 
 from api.db import Base
 
 class Item(Base):
     __tablename__ = "items"
+    # 一覧のキーセットページング用 (updated_at, id の降順)
+    __table_args__ = (
+        Index("ix_items_status_updated_at", "status", "updated_at", "id"),
+        Index("ix_items_seller_updated_at", "seller_id", "updated_at", "id"),
+    )
 
     id = Column(String(36), primary_key=True)
 
@@ -28,4 +33,6 @@ class Item(Base):
     condition = relationship("ItemCondition", back_populates="items")
     comments = relationship("Comment", back_populates="item", cascade="all, delete")
     images = relationship("ItemImage", back_populates="item", cascade="all, delete")
-    vector = relationship("ItemVector", back_populates="item", uselist=False, cascade="all, delete-orphan")
\ No newline at end of file
+    # モデルバージョンごとに1行
+    vectors = relationship("ItemVector", back_populates="item", cascade="all, delete-orphan")
+    pending_embedding = relationship("PendingEmbedding", back_populates="item", uselist=False, cascade="all, delete-orphan")
\ No newline at end of file
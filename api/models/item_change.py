@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from api.db import Base
+
+class ItemChange(Base):
+    """
+    商品詳細キャッシュの無効化ログ (商品の書き込みと同じトランザクションで1行積む)
+    version は単調増加のカウンタで、各ワーカーは読み終えた version より後の行を読んで自分のキャッシュから外す
+    商品の削除後も残すので items への外部キーは張らない
+    """
+    __tablename__ = "item_changes"
+
+    version = Column(Integer, primary_key=True, autoincrement=True)
+    item_id = Column(String(36), nullable=False)
+    changed_at = Column(DateTime, nullable=False, index=True)
@@ -1,9 +1,13 @@
-from sqlalchemy import Column, String, ForeignKey, DateTime
+from sqlalchemy import Column, String, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from api.db import Base
 
 class ItemImage(Base):
     __tablename__ = "item_images"
+    # 一覧のカードで1枚目の画像を引く
+    __table_args__ = (
+        Index("ix_item_images_item_created_at", "item_id", "created_at", "id"),
+    )
 
     id = Column(String(36), primary_key=True)
     item_id = Column(String(36), ForeignKey("items.id"), nullable=False)
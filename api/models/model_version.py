@@ -0,0 +1,14 @@
+from sqlalchemy import Column, String, DateTime
+from api.db import Base
+
+class ModelVersion(Base):
+    __tablename__ = "model_versions"
+
+    version = Column(String(32), primary_key=True)
+    model_path = Column(String(255), nullable=False)  # モデルバンドルのディレクトリ or .pth
+    vocab_path = Column(String(255), nullable=False)
+    # building: 裏でベクトルを作成中 / ready: 切り替え可能 / active: 検索に使用中 (常に1つ) / retired: 削除済み
+    status = Column(String(16), nullable=False, default="building")
+
+    created_at = Column(DateTime, nullable=False)
+    activated_at = Column(DateTime, nullable=True)
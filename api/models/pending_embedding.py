@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey
+from sqlalchemy.orm import relationship
+from api.db import Base
+
+class PendingEmbedding(Base):
+    """
+    ベクトル化待ちの商品 (出品・更新と同じトランザクションで積むので、プロセスが落ちても失われない)
+    商品ごとに1行。処理中に再度更新されたら generation が増え、ワーカーは古い結果で行を消さない
+    """
+    __tablename__ = "pending_embeddings"
+
+    item_id = Column(String(36), ForeignKey("items.id", ondelete="CASCADE"), primary_key=True)
+    status = Column(String(20), nullable=False, default="pending")  # pending | failed (リトライ上限に達した)
+    generation = Column(Integer, nullable=False, default=1)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+
+    enqueued_at = Column(DateTime, nullable=False)
+    # この時刻を過ぎたら取り出せる (リトライのバックオフ / 処理中のリース)
+    available_at = Column(DateTime, nullable=False, index=True)
+
+    item = relationship("Item", back_populates="pending_embedding")
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean
+from api.db import Base
+
+class ReindexJob(Base):
+    __tablename__ = "reindex_jobs"
+
+    id = Column(String(36), primary_key=True)
+    status = Column(String(20), nullable=False, default="pending")  # pending | running | completed | failed
+
+    # キーセットページングのカーソル (処理済みの最後の items.id)。再開時はここから続ける
+    last_item_id = Column(String(36), nullable=True)
+    processed = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0)  # 指紋が一致して再エンコード不要だった件数
+    force = Column(Boolean, nullable=False, default=False)  # True なら指紋に関係なく全件エンコードする
+    model_version = Column(String(32), nullable=True)  # どのモデルのベクトルを作るか (None は稼働中のモデル)
+    total = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
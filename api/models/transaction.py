@@ -1,10 +1,14 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from api.db import Base
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    # 購入履歴のキーセットページング用
+    __table_args__ = (
+        Index("ix_transactions_buyer_created_at", "buyer_id", "created_at", "id"),
+    )
 
     id = Column(String(36), primary_key=True)
     
@@ -13,7 +17,8 @@ class Transaction(Base):
     seller_id = Column(String(36), ForeignKey("user.id"), nullable=False)
     
     transaction_price = Column(Integer, nullable=False)
-    created_at = Column(DateTime, default=func.now())
+    # 購入履歴のキーセット (created_at, id) に使うので NULL を許さない
+    created_at = Column(DateTime, nullable=False, default=func.now())
 
     item = relationship("Item")
     buyer = relationship("User", foreign_keys=[buyer_id])
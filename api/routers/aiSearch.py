@@ -10,10 +10,15 @@ from api.schemas.predict import PredictRequest, PredictResponse
 import api.core as core
 from openai import OpenAI
 import json
+import asyncio
+from api.utils.inference import InferenceBusyError
 
 client = OpenAI()
 router = APIRouter()
 
+# 「〜円くらい」の予算に対して許容する価格の上振れ
+BUDGET_TOLERANCE = 1.2
+
 SYSTEM_PROMPT = """
 あなたはフリマアプリの専門家です。
 1. ユーザーの要望から「商品名」「予算」「状態」を読み取ってください。
@@ -25,8 +30,11 @@ SYSTEM_PROMPT = """
    - 商品名からブランド名が分かる場合、そのブランド名（英語）で検索してください。
 4. 商品検索（search_similar_items）を行う際：
    - 価格(price)が「〜円くらい」と言われたらその数値を指定してください。
-   - 状態(condition)が「新品」なら 1、「中古」や「気にしない」なら 3 程度を割り当ててください。
-   - 明確な指定がないパラメータは、デフォルト値（price=0, condition_id=1）を使用してください。
+   - 状態(condition_id)はユーザーが明示したときだけ指定してください。
+     「新品」なら 1、「新品同様」「未使用に近い」なら 2、「目立った傷や汚れなし」なら 3 のように、中古でも程度を言われたらその番号にします。
+   - 「気にしない」「中古でいい」など状態を問わない場合や、状態に触れていない場合は condition_id を省略してください（全ての状態が対象になります）。
+   - 明確な指定がないパラメータは、デフォルト値（price=0）を使用してください。
+   - price と condition_id は絞り込み条件にもなります（予算の約1.2倍まで、指定した状態以上）。
 """
 
 async def search_similar_items(
@@ -34,7 +42,7 @@ async def search_similar_items(
     category_id: int,
     name: str,
     price: float =0.0,
-    condition_id: int = 1
+    condition_id: int | None = None
 ):
     
     item_data = {
@@ -42,21 +50,28 @@ async def search_similar_items(
         "price": price,
         "category_id": category_id,
         "brand_id": 0,
-        "condition_id": condition_id
+        "condition_id": condition_id or 1
     }
 
-    target_vectors = await item_crud.get_all_vectors(db)
-    
-    if not target_vectors:
+    if not core.search_engine:
         return []
 
-    query_vector = core.search_engine.encode_single_item(item_data)
-
-    top_item_ids = core.search_engine.sort_by_similarity(
-        query_vector, 
-        target_vectors, 
-        top_k=3
+    # カテゴリ(配下含む)・予算・状態で絞り込んでから上位3件を取る
+    # 状態は明示されたときだけ「その状態以上」に絞る (省略 = 気にしない なら全ての状態)
+    filters = dict(
+        category_id=category_id,
+        condition_ids=set(range(1, condition_id + 1)) if condition_id else None,
+        max_price=int(price * BUDGET_TOLERANCE) if price else None,
     )
+    try:
+        query_vector = await core.search_engine.encode_item(item_data)
+        if not query_vector:
+            return []
+        top_item_ids = await core.search_engine.search_vector(query_vector, top_k=3, filters=filters)
+    except (InferenceBusyError, asyncio.TimeoutError) as e:
+        # 推論が混んでいるときは会話を止めず、該当なしとしてツールに返す
+        print(f"⚠️ aiSearch: similar item search skipped: {e!r}")
+        return []
     return await item_crud.get_items_by_ids(db, top_item_ids)
 
 @router.post("/aiSearch", response_model=AiSearchResponse)
@@ -1,8 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Header, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from api.db import get_db
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Annotated
+from typing import Annotated, Optional
 import api.schemas.users as UserSchema
 from api.schemas.token import Token, TokenData
 import api.cruds.users as user_crud
@@ -10,6 +10,7 @@ import jwt
 from jwt.exceptions import InvalidTokenError
 from pwdlib import PasswordHash
 from datetime import datetime, timedelta, timezone
+import hmac
 import os
 
 
@@ -19,6 +20,13 @@ password_hash = PasswordHash.recommended()
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 SECRET_KEY = os.getenv("SECRET_KEY", "temporary_secret_key_for_dev") 
 ALGORITHM = os.getenv("ALGORITHM", "HS256") 
+# 管理用 API (モデルの登録・切り替え、検索エンジンの再読み込みなど) に X-Admin-Token で渡すトークン
+# 未設定なら管理用 API はすべて拒否する
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_API_TOKEN or not hmac.compare_digest(x_admin_token or "", ADMIN_API_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin token required")
 
 def verify_password(plain_password, hashed_password):
     return password_hash.verify(plain_password, hashed_password)
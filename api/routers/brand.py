@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from api.db import get_db
 from api.cruds.brand import find_brands
 from api.schemas.brand import Brand
+from api.utils.etag import make_etag, is_not_modified, not_modified, set_cache_headers, CACHE_STATIC
 
 router = APIRouter()
 
 @router.get("/brands/search", response_model=List[Brand], operation_id="searchBrands", tags=["brand"])
-async def search_brands(keyword: str, db: AsyncSession = Depends(get_db)):
-    return await find_brands(db, keyword=keyword)
+async def search_brands(keyword: str, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    brands = await find_brands(db, keyword=keyword)
+    etag = make_etag(*((brand.id, brand.name) for brand in brands))
+    if is_not_modified(request, etag):
+        return not_modified(etag, CACHE_STATIC)
+    set_cache_headers(response, etag, CACHE_STATIC)
+    return brands
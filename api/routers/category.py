@@ -1,14 +1,20 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request, Response
 from api.db import get_db
 from typing import List
 from sqlalchemy.ext.asyncio import AsyncSession
-from api.cruds.category import get_category,find_category_id
+from api.cruds.category import get_category,find_category_id,get_tree_version
+from api.utils.etag import make_etag, is_not_modified, not_modified, set_cache_headers, CACHE_STATIC
 import api.schemas.item as category_schema
 
 router = APIRouter()
 
 @router.get("/categories",response_model=List[category_schema.Category],operation_id="getCategories", tags=["category"])
-async def get_categories(parent_id: int = None, db: AsyncSession = Depends(get_db)):
+async def get_categories(request: Request, response: Response, parent_id: int = None, db: AsyncSession = Depends(get_db)):
+    # ツリーのバージョンが同じなら子カテゴリも同じなので、一覧を引かずに 304
+    etag = make_etag("categories", await get_tree_version(db), parent_id)
+    if is_not_modified(request, etag):
+        return not_modified(etag, CACHE_STATIC)
+    set_cache_headers(response, etag, CACHE_STATIC)
     return await get_category(db,parent_id=parent_id)
 
 @router.get("/categories/search",response_model=List[category_schema.CategorySearchResponse],operation_id="searchCategories", tags=["category"])
@@ -0,0 +1,27 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+import api.core as core
+from api.search_loader import local_readiness
+from api.utils.search_client import SERVING_ROLE
+
+router = APIRouter()
+
+@router.get("/ready", operation_id="readiness", tags=["Health"])
+async def readiness():
+    """
+    readiness probe 用
+    検索エンジンをこのプロセスに持つ場合は、読み込み・ウォームアップが終わるまで (または失敗したら) 503 を返す
+    検索を他のプロセスに委譲している場合は委譲先の状態を載せるが、このレプリカ自体は 200 (商品 API などは動く)
+    """
+    if core.search_reloader:
+        state = await local_readiness(core.search_engine, core.search_reloader)
+        return JSONResponse(status_code=200 if state["ready"] else 503, content={"role": SERVING_ROLE, **state})
+
+    if core.search_engine:
+        try:
+            search = await core.search_engine.readiness()
+        except Exception as e:
+            search = {"ready": False, "state": "unreachable", "error": repr(e)}
+    else:
+        search = {"ready": False, "state": "disabled"}
+    return {"ready": True, "role": SERVING_ROLE, "state": "delegated", "search": search}
@@ -0,0 +1,104 @@
+import asyncio
+import hmac
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException
+import api.core as core
+import api.schemas.search as search_schema
+from api.utils.inference import InferenceBusyError
+from api.search_loader import local_readiness
+from api.utils.search_client import SEARCH_SERVICE_TOKEN
+
+# ---------------------------------------------------------
+# SERVING_ROLE=search のときだけ登録する内部 API
+# SERVING_ROLE=api のレプリカが RemoteSearchClient 経由で呼ぶ
+# SEARCH_SERVICE_TOKEN が未設定なら登録しない (登録されていてもすべて拒否する)
+# ---------------------------------------------------------
+
+def verify_token(x_search_token: Optional[str] = Header(None)):
+    if not SEARCH_SERVICE_TOKEN or not hmac.compare_digest(x_search_token or "", SEARCH_SERVICE_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid search token")
+
+def get_client():
+    if not core.search_engine:
+        raise HTTPException(status_code=503, detail="Search engine not loaded")
+    return core.search_engine
+
+router = APIRouter(prefix="/internal/search", tags=["Internal"], dependencies=[Depends(verify_token)])
+
+@router.post("/text", response_model=search_schema.SearchResult)
+async def search_text(payload: search_schema.TextSearchRequest, client=Depends(get_client)):
+    try:
+        item_ids = await client.search_text(payload.q, top_k=payload.top_k, filters=payload.filters, version=payload.version)
+    except (InferenceBusyError, asyncio.TimeoutError):
+        raise HTTPException(status_code=503, detail="Search is busy", headers={"Retry-After": "1"})
+    return {"item_ids": item_ids}
+
+@router.post("/vector", response_model=search_schema.SearchResult)
+async def search_vector(payload: search_schema.VectorSearchRequest, client=Depends(get_client)):
+    item_ids = await client.search_vector(payload.vector, top_k=payload.top_k, filters=payload.filters, version=payload.version)
+    return {"item_ids": item_ids}
+
+@router.post("/item", response_model=search_schema.SearchResult)
+async def search_item(payload: search_schema.ItemSearchRequest, client=Depends(get_client)):
+    item_ids = await client.search_item(payload.item_id, top_k=payload.top_k, filters=payload.filters)
+    return {"item_ids": item_ids}
+
+@router.post("/encode", response_model=search_schema.EncodeResponse)
+async def encode_items(payload: search_schema.EncodeRequest, client=Depends(get_client)):
+    try:
+        vectors = await client.encode_items(
+            payload.items, timeout=payload.timeout, version=payload.version, refresh=payload.refresh
+        )
+    except (InferenceBusyError, asyncio.TimeoutError):
+        raise HTTPException(status_code=503, detail="Inference is busy", headers={"Retry-After": "1"})
+    return {"vectors": vectors}
+
+@router.post("/index/upsert", status_code=204)
+async def upsert_vector(payload: search_schema.IndexUpsertRequest, client=Depends(get_client)):
+    await client.upsert(payload.item_id, payload.vector, payload.attrs, version=payload.version)
+
+@router.post("/index/attributes", status_code=204)
+async def update_attributes(payload: search_schema.IndexAttributesRequest, client=Depends(get_client)):
+    await client.update_attributes(payload.item_id, payload.attrs)
+
+@router.post("/index/remove", status_code=204)
+async def remove_vector(payload: search_schema.IndexRemoveRequest, client=Depends(get_client)):
+    await client.remove(payload.item_id)
+
+@router.get("/models")
+async def versions(client=Depends(get_client)):
+    return await client.versions()
+
+@router.post("/models/load", status_code=204)
+async def load_version(payload: search_schema.ModelLoadRequest, client=Depends(get_client)):
+    await client.load_version(payload.version, payload.model_path, payload.vocab_path)
+
+@router.post("/models/activate", status_code=204)
+async def activate(payload: search_schema.ModelVersionRequest, client=Depends(get_client)):
+    await client.activate(payload.version)
+
+@router.post("/models/unload", status_code=204)
+async def unload(payload: search_schema.ModelVersionRequest, client=Depends(get_client)):
+    await client.unload(payload.version)
+
+def get_reloader():
+    if not core.search_reloader:
+        raise HTTPException(status_code=503, detail="Search engine is not hosted here")
+    return core.search_reloader
+
+# 起動に失敗してエンジンが無くても呼べるように get_client には依存しない
+@router.post("/reload", status_code=202)
+async def reload(reloader=Depends(get_reloader)):
+    return reloader.start("admin")
+
+@router.get("/reload")
+async def reload_status(reloader=Depends(get_reloader)):
+    return reloader.state()
+
+@router.get("/ready")
+async def readiness(reloader=Depends(get_reloader)):
+    return await local_readiness(core.search_engine, reloader)
+
+@router.get("/stats")
+async def stats(client=Depends(get_client)):
+    return await client.stats()
@@ -1,16 +1,19 @@
 import os
 import asyncio
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form
+from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form, Query, Request, Response
 from starlette.concurrency import run_in_threadpool
 from typing import Annotated, List, Optional
 import api.schemas.item as item_schema
 import api.cruds.item as item_crud
+import api.cruds.item_cache as item_cache
 import api.schemas.users as users_schema
 from api.routers.auth import get_current_user
 import uuid
 from uuid import UUID
 from datetime import datetime
 from api.db import get_db
+from api.utils.cursor import PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, NEXT_CURSOR_HEADER
+from api.utils.etag import make_etag, is_not_modified, not_modified, set_cache_headers, CACHE_REVALIDATE
 from sqlalchemy.ext.asyncio import AsyncSession
 from google.cloud import storage
 
@@ -82,26 +85,49 @@ async def update_item(
     
     return updated_item
 
-@router.get("/item", response_model=List[item_schema.ItemResponse], operation_id="getItemsList", tags=["Item"])
+@router.get("/item", response_model=List[item_schema.ItemCardResponse], operation_id="getItemsList", tags=["Item"])
 async def get_items_list(
-    skip: int = 0,
-    limit: int = 20,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = Query(None, description="前のページの X-Next-Cursor"),
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    skip: int = Query(0, ge=0, deprecated=True, description="cursor を使う (cursor 指定時は無視)"),
     db: AsyncSession = Depends(get_db)
     ):
-    item = await item_crud.get_items_list(db, skip, limit)
-    
-    return item
+    items, next_cursor = await item_crud.get_items_list(db, limit, cursor=cursor, skip=skip)
+    cursor_headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+    # カードの列 (updated_at を含む) と次ページの有無が同じなら、シリアライズせずに 304
+    etag = make_etag(next_cursor, *(tuple(card) for card in items))
+    if is_not_modified(request, etag):
+        return not_modified(etag, CACHE_REVALIDATE, cursor_headers)
+    response.headers.update(cursor_headers)
+    set_cache_headers(response, etag, CACHE_REVALIDATE)
+    return items
 
 @router.get("/item/{item_id}", response_model=item_schema.ItemResponse, operation_id="getItemDetail", tags=["Item"])
 async def get_item_detail(
     item_id: UUID,
+    request: Request,
     db: AsyncSession = Depends(get_db)
     ):
-    item = await item_crud.get_item(db, str(item_id))
-    
-    if item is None:
-        raise HTTPException(status_code=404, detail="Item not found")
-    return item
+    # よく見られる商品は MySQL に問い合わせず、シリアライズ済みのレスポンスと ETag をそのまま使う
+    cached = item_cache.get(str(item_id))
+    if cached is None:
+        started = item_cache.begin_load()
+        item = await item_crud.get_item(db, str(item_id))
+
+        if item is None:
+            raise HTTPException(status_code=404, detail="Item not found")
+        payload = item_schema.ItemResponse.model_validate(item).model_dump_json().encode("utf-8")
+        cached = (make_etag(payload), payload)
+        item_cache.put(str(item_id), cached, started)
+    etag, payload = cached
+    if is_not_modified(request, etag):
+        return not_modified(etag, CACHE_REVALIDATE)
+    return Response(
+        content=payload, media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": CACHE_REVALIDATE},
+    )
 
 @router.delete("/item/{item_id}", response_model=None, operation_id="deleteItem", tags=["Item"])
 async def delete_item(
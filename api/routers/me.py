@@ -1,7 +1,8 @@
-from fastapi import Depends, APIRouter
+from fastapi import Depends, APIRouter, Query, Response
 from api.db import get_db
+from api.utils.cursor import PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, NEXT_CURSOR_HEADER
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Optional
 import api.schemas.users as users_schema
 import api.schemas.item as item_schema
 import api.schemas.history as history_schema
@@ -21,19 +22,31 @@ async def get_my_profile(
 ): 
     return current_user
 
-@router.get("/users/me/items", response_model=List[item_schema.ItemResponse], operation_id="getMyListing", tags=["Me"])
+@router.get("/users/me/items", response_model=List[item_schema.ItemCardResponse], operation_id="getMyListing", tags=["Me"])
 async def get_my_listings(
     current_user: Annotated[users_schema.UserResponse, Depends(get_current_user)],
+    response: Response,
+    cursor: Optional[str] = Query(None, description="前のページの X-Next-Cursor"),
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
     db: AsyncSession = Depends(get_db),
 ):
-    return await item_crud.get_items_by_user_id(db, str(current_user.id))
+    items, next_cursor = await item_crud.get_items_by_user_id(db, str(current_user.id), limit, cursor=cursor)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return items
 
-@router.get("/users/me/purchased", response_model=list[item_schema.ItemResponse], operation_id="getPurchasedItems", tags=["Me"])
+@router.get("/users/me/purchased", response_model=list[item_schema.ItemCardResponse], operation_id="getPurchasedItems", tags=["Me"])
 async def get_purchased_items(
     current_user: Annotated[users_schema.UserResponse, Depends(get_current_user)],
+    response: Response,
+    cursor: Optional[str] = Query(None, description="前のページの X-Next-Cursor"),
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
     db: AsyncSession = Depends(get_db),
 ):
-    return await item_crud.get_purchased_items_by_user(db, user_id=str(current_user.id))
+    items, next_cursor = await item_crud.get_purchased_items_by_user(db, str(current_user.id), limit, cursor=cursor)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return items
 
 @router.get("/users/me/history", response_model=List[history_schema.HistoryResponse], operation_id="getHistory", tags=["Me"])
 async def get_browsing_history(
@@ -1,17 +1,34 @@
 from fastapi import APIRouter, Depends, Query, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Optional
+from uuid import UUID
 
 from api.db import get_db
 import api.schemas.item as item_schema
 import api.cruds.item as item_crud
+import api.cruds.reindex as reindex_crud
+import api.schemas.reindex as reindex_schema
+import api.cruds.model_version as model_version_crud
+import api.cruds.embedding_queue as embedding_queue
+import api.embedding_worker as embedding_worker
+import api.schemas.embedding as embedding_schema
+import api.schemas.model_version as model_version_schema
 import api.core as core
+import asyncio
+from api.utils.inference import InferenceBusyError
+from api.utils.search_client import InvalidModelPathError, check_model_path
+from api.routers.auth import require_admin
 
 router = APIRouter()
 
-@router.get("/search", response_model=List[item_schema.ItemResponse],operation_id="search", tags=["Search"])
+@router.get("/search", response_model=List[item_schema.ItemCardResponse],operation_id="search", tags=["Search"])
 async def search_items(
     q: str = Query(..., min_length=1, max_length=100, description="検索キーワード"),
+    category_id: Optional[int] = Query(None, description="カテゴリ (配下のサブカテゴリを含む)"),
+    brand_id: Optional[int] = Query(None),
+    condition_id: Optional[int] = Query(None),
+    min_price: Optional[int] = Query(None, ge=0),
+    max_price: Optional[int] = Query(None, ge=0),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -23,17 +40,21 @@ async def search_items(
         print("⚠️ Search engine is not loaded.")
         return []
 
-    # 2. キーワードをベクトルに変換 (Pythonリスト)
-    query_vector = core.search_engine.encode_query(q)
-    
-    if not query_vector:
-        return []
-
-    # 3. MySQLからベクトル検索を実行 (CRUD呼び出し)
-    # ここで「全件スキャン＆類似度計算」が走ります
-    all_vectors = await item_crud.get_all_vectors(db)
+    # 2. 販売中・指定条件を満たす商品だけを採点するので、20件きちんと返る
+    filters = dict(
+        category_id=category_id,
+        brand_id=brand_id,
+        condition_ids={condition_id} if condition_id else None,
+        min_price=min_price,
+        max_price=max_price,
+    )
 
-    top_item_ids = core.search_engine.sort_by_similarity(query_vector, all_vectors)
+    # 3. キーワードをベクトル化して常駐インデックスで類似度上位を取得
+    # (推論は専用スレッドで実行、人気クエリはキャッシュから返る)
+    try:
+        top_item_ids = await core.search_engine.search_text(q, filters=filters)
+    except (InferenceBusyError, asyncio.TimeoutError):
+        raise HTTPException(status_code=503, detail="Search is busy", headers={"Retry-After": "1"})
 
     if not top_item_ids:
         return []
@@ -42,13 +63,212 @@ async def search_items(
 
     return items
 
-@router.post("/search/sync", operation_id="sync_vectors", tags=["Search"])
-async def sync_vectors(db: AsyncSession = Depends(get_db)):
+@router.post("/search/sync", response_model=reindex_schema.ReindexJobResponse, status_code=202, dependencies=[Depends(require_admin)], operation_id="sync_vectors", tags=["Search"])
+async def sync_vectors(
+    force: bool = Query(False, description="入力が変わっていない商品も再エンコードする"),
+    version: Optional[str] = Query(None, description="対象のモデルバージョン (省略時は稼働中のバージョン)"),
+    db: AsyncSession = Depends(get_db)
+):
     """
-    【管理用】既存アイテムのベクトルを強制的に再生成する
+    【管理用】既存アイテムのベクトルを再生成するジョブをバックグラウンドで開始する
+    (実行中のジョブがあればそれを返す。進捗は GET /search/sync/{job_id} で確認)
+    作成中のバージョンを指定すると、失敗して欠けた商品のベクトルだけを作り直す (全件そろえば ready になる)
     """
     if not core.search_engine:
         raise HTTPException(status_code=503, detail="Search engine not loaded")
-    
-    count = await item_crud.sync_vectors(db)
-    return {"message": f"Successfully synced {count} items."}
\ No newline at end of file
+
+    loaded = await core.search_engine.versions()
+    version = version or loaded["active"]
+    if version not in loaded["loaded"]:
+        raise HTTPException(status_code=404, detail=f"Model version {version} is not loaded")
+    return await start_reindex(db, version, force=force)
+
+async def start_reindex(db: AsyncSession, model_version: str, force: bool = False):
+    job = await reindex_crud.create_job(db, model_version, force=force)
+    job_id = job.id
+    if job.status == "pending" and await reindex_crud.claim_job(db, job_id, job.updated_at):
+        reindex_crud.start_job(job_id)
+    return await reindex_crud.get_job(db, job_id)
+
+@router.get("/search/sync/{job_id}", response_model=reindex_schema.ReindexJobResponse, operation_id="get_sync_job", tags=["Search"])
+async def get_sync_job(job_id: UUID, db: AsyncSession = Depends(get_db)):
+    job = await reindex_crud.get_job(db, str(job_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/search/stats", operation_id="search_stats", tags=["Search"])
+async def search_stats(db: AsyncSession = Depends(get_db)):
+    """
+    【管理用】検索エンジンの稼働状況 (推論キュー・バッチサイズ・ベクトル化待ちの件数など)
+    """
+    if not core.search_engine:
+        raise HTTPException(status_code=503, detail="Search engine not loaded")
+    return {
+        **await core.search_engine.stats(),
+        "embedding_queue": {**await embedding_queue.queue_stats(db), "worker": embedding_worker.worker_stats()},
+    }
+
+@router.get("/search/embeddings/{item_id}", response_model=embedding_schema.EmbeddingStatusResponse, operation_id="get_embedding_status", tags=["Search"])
+async def get_embedding_status(item_id: UUID, db: AsyncSession = Depends(get_db)):
+    """
+    商品が検索に反映されているか (pending: ベクトル化待ち / failed: リトライ上限 / indexed: 反映済み)
+    """
+    item_id = str(item_id)
+    task = await embedding_queue.get_task(db, item_id)
+    if task is not None:
+        return {
+            "item_id": item_id,
+            "state": task.status,
+            "attempts": task.attempts,
+            "last_error": task.last_error,
+            "enqueued_at": task.enqueued_at,
+        }
+    if core.search_engine:
+        active_version = (await core.search_engine.versions())["active"]
+        if await item_crud.get_vector_meta(db, [item_id], active_version):
+            return {"item_id": item_id, "state": "indexed"}
+    return {"item_id": item_id, "state": "missing"}
+
+@router.post("/search/embeddings/retry", dependencies=[Depends(require_admin)], operation_id="retry_embeddings", tags=["Search"])
+async def retry_embeddings(db: AsyncSession = Depends(get_db)):
+    """
+    【管理用】リトライ上限に達した (failed の) ベクトル化をやり直す
+    """
+    retried = await embedding_queue.retry_failed(db)
+    embedding_queue.notify()
+    return {"retried": retried}
+
+
+@router.post("/search/reload", status_code=202, dependencies=[Depends(require_admin)], operation_id="reload_search_engine", tags=["Search"])
+async def reload_search_engine():
+    """
+    【管理用】検索エンジン (モデル + 語彙 + インデックス) を裏で読み込み直し、スモーククエリが通ったら差し替える
+    起動時に読み込みに失敗していても使える。処理中のリクエストは旧インスタンスで完了する (状態は GET で確認)
+    """
+    if core.search_reloader:
+        return core.search_reloader.start("admin")
+    if core.search_engine:
+        # 検索レプリカ / 推論サーバ側で読み込み直す
+        return await core.search_engine.reload()
+    raise HTTPException(status_code=503, detail="Search engine not loaded")
+
+@router.get("/search/reload", operation_id="get_search_reload", tags=["Search"])
+async def get_search_reload():
+    if core.search_reloader:
+        return core.search_reloader.state()
+    if core.search_engine:
+        return await core.search_engine.reload_status()
+    raise HTTPException(status_code=503, detail="Search engine not loaded")
+
+# ---------------------------------------------------------
+# モデルバージョンの管理
+#   1. POST /search/models で新バージョンを登録 → 検索エンジンに読み込み、裏でそのバージョンのベクトルを作る
+#      (稼働中のバージョンの item_vectors 行・インデックスには触れないので、作成中も検索結果は変わらない)
+#   2. ジョブが完了すると ready になり、POST /search/models/{version}/activate で一度に切り替える
+#   3. POST /search/models/rollback で直前のバージョンに戻す (旧バージョンのベクトルは残っている)
+# ---------------------------------------------------------
+
+def require_search_engine():
+    if not core.search_engine:
+        raise HTTPException(status_code=503, detail="Search engine not loaded")
+    return core.search_engine
+
+async def model_version_list(db: AsyncSession, client) -> dict:
+    loaded = await client.versions()
+    versions = await model_version_crud.get_versions(db)
+    return {
+        "active_version": loaded["active"],
+        "versions": [
+            {**model_version_schema.ModelVersionResponse.model_validate(v).model_dump(), "loaded": v.version in loaded["loaded"]}
+            for v in versions
+        ],
+    }
+
+async def activate_model_version(db: AsyncSession, client, model_version) -> dict:
+    version = model_version.version
+    if model_version.status != "ready":
+        raise HTTPException(status_code=409, detail=f"Model version {version} is {model_version.status}")
+
+    # 読み込まれていなければ (削除後のロールバックや再起動後) モデルとベクトルを読み込んでから切り替える
+    if version not in (await client.versions())["loaded"]:
+        await client.load_version(version, model_version.model_path, model_version.vocab_path)
+    if not await model_version_crud.activate_version(db, version):
+        raise HTTPException(status_code=409, detail=f"Model version {version} could not be activated")
+    await client.activate(version)
+    print(f"🔀 Activated model version {version}")
+
+    # 読み込んでいなかった間に更新された商品のベクトルを指紋の差分で補う
+    await start_reindex(db, version)
+    return await model_version_list(db, client)
+
+@router.get("/search/models", response_model=model_version_schema.ModelVersionListResponse, dependencies=[Depends(require_admin)], operation_id="list_model_versions", tags=["Search"])
+async def list_model_versions(db: AsyncSession = Depends(get_db), client=Depends(require_search_engine)):
+    """
+    【管理用】登録済みのモデルバージョンと、検索に使われているバージョン
+    """
+    return await model_version_list(db, client)
+
+@router.post("/search/models", response_model=reindex_schema.ReindexJobResponse, status_code=202, dependencies=[Depends(require_admin)], operation_id="create_model_version", tags=["Search"])
+async def create_model_version(
+    payload: model_version_schema.ModelVersionCreate,
+    db: AsyncSession = Depends(get_db),
+    client=Depends(require_search_engine),
+):
+    """
+    【管理用】新しいモデルバージョンを登録し、そのバージョンのベクトルを作るジョブをバックグラウンドで開始する
+    (稼働中のバージョンはそのまま検索に使われる。進捗は GET /search/sync/{job_id} で確認)
+    """
+    existing = await model_version_crud.get_version(db, payload.version)
+    if existing and existing.status != "retired":
+        raise HTTPException(status_code=409, detail=f"Model version {payload.version} already exists")
+    try:
+        check_model_path(payload.model_path)
+        check_model_path(payload.vocab_path)
+    except InvalidModelPathError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    await model_version_crud.register_version(db, payload.version, payload.model_path, payload.vocab_path)
+    try:
+        await client.load_version(payload.version, payload.model_path, payload.vocab_path)
+    except Exception as e:
+        await model_version_crud.retire_version(db, payload.version)
+        raise HTTPException(status_code=400, detail=f"Failed to load model version {payload.version}: {e}")
+    return await start_reindex(db, payload.version, force=True)
+
+@router.post("/search/models/rollback", response_model=model_version_schema.ModelVersionListResponse, dependencies=[Depends(require_admin)], operation_id="rollback_model_version", tags=["Search"])
+async def rollback_model_version(db: AsyncSession = Depends(get_db), client=Depends(require_search_engine)):
+    """
+    【管理用】直前まで稼働していたバージョンに戻す
+    """
+    previous = await model_version_crud.get_previous_version(db)
+    if previous is None:
+        raise HTTPException(status_code=404, detail="No model version to roll back to")
+    return await activate_model_version(db, client, previous)
+
+@router.post("/search/models/{version}/activate", response_model=model_version_schema.ModelVersionListResponse, dependencies=[Depends(require_admin)], operation_id="activate_model_version", tags=["Search"])
+async def activate_model_version_endpoint(version: str, db: AsyncSession = Depends(get_db), client=Depends(require_search_engine)):
+    """
+    【管理用】ベクトルの作成が完了した (ready の) バージョンに検索を切り替える
+    """
+    model_version = await model_version_crud.get_version(db, version)
+    if model_version is None:
+        raise HTTPException(status_code=404, detail="Model version not found")
+    if model_version.status == "active":
+        return await model_version_list(db, client)
+    return await activate_model_version(db, client, model_version)
+
+@router.delete("/search/models/{version}", status_code=204, dependencies=[Depends(require_admin)], operation_id="delete_model_version", tags=["Search"])
+async def delete_model_version(version: str, db: AsyncSession = Depends(get_db), client=Depends(require_search_engine)):
+    """
+    【管理用】稼働中でないバージョンをアンロードし、そのベクトルを削除する
+    """
+    model_version = await model_version_crud.get_version(db, version)
+    if model_version is None:
+        raise HTTPException(status_code=404, detail="Model version not found")
+    if model_version.status == "active":
+        raise HTTPException(status_code=409, detail="Cannot delete the active model version")
+
+    await reindex_crud.cancel_jobs(db, version)
+    await client.unload(version)
+    await model_version_crud.retire_version(db, version)
@@ -1,11 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Optional
 import api.schemas.users as users_schema
 import api.schemas.item as item_schema
 import api.cruds.users as user_crud 
 import api.cruds.item as item_crud
 from api.db import get_db
+from api.utils.cursor import PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, NEXT_CURSOR_HEADER
 import uuid
 from uuid import UUID
 from datetime import datetime
@@ -26,10 +27,15 @@ async def get_user_profile(
         )
     return user
 
-@router.get("/users/{user_id}/items",response_model=List[item_schema.ItemResponse],operation_id="getListing", tags=["User"])
+@router.get("/users/{user_id}/items",response_model=List[item_schema.ItemCardResponse],operation_id="getListing", tags=["User"])
 async def get_users_listings(
     user_id: UUID,
+    response: Response,
+    cursor: Optional[str] = Query(None, description="前のページの X-Next-Cursor"),
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
     db: AsyncSession = Depends(get_db)
     ):
-    items = await item_crud.get_items_by_user_id(db, str(user_id))
+    items, next_cursor = await item_crud.get_items_by_user_id(db, str(user_id), limit, cursor=cursor)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return items
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from typing import List, Optional
-from api.schemas.item import ItemResponse 
+from api.schemas.item import ItemCardResponse
 
 class ChatMessage(BaseModel):
     role: str 
@@ -15,7 +15,7 @@ class AiSearchRequest(BaseModel):
 class AiSearchResponse(BaseModel):
     reply: str
     history: List[ChatMessage]
-    items: Optional[List[ItemResponse]] = []
+    items: Optional[List[ItemCardResponse]] = []
 
 class AiPredictRequest(BaseModel):
     title: str
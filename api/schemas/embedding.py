@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional
+
+class EmbeddingStatusResponse(BaseModel):
+    item_id: str
+    state: str  # pending | failed | indexed | missing
+    attempts: int = 0
+    last_error: Optional[str] = None
+    enqueued_at: Optional[datetime] = None
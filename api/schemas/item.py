@@ -74,6 +74,18 @@ class ItemResponse(ItemBase):
     class Config:
         from_attributes = True
 
+class ItemCardResponse(BaseModel):
+    """一覧・検索結果のカード (説明文・出品者・画像一覧などは詳細 API で取る)"""
+    id: UUID
+    title: str
+    price: int
+    status: ItemStatus
+    thumbnail_url: Optional[str] = None
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
 class ItemSimpleResponse(BaseModel):
     id: UUID
     seller_id: UUID
@@ -0,0 +1,24 @@
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import Optional, List
+
+class ModelVersionCreate(BaseModel):
+    version: str = Field(..., min_length=1, max_length=32)
+    model_path: str  # モデルバンドルのディレクトリ or .pth (検索レプリカから見えるパス)
+    vocab_path: str
+
+class ModelVersionResponse(BaseModel):
+    version: str
+    model_path: str
+    vocab_path: str
+    status: str
+    loaded: bool = False  # 検索エンジンに読み込まれているか
+    created_at: datetime
+    activated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class ModelVersionListResponse(BaseModel):
+    active_version: Optional[str] = None
+    versions: List[ModelVersionResponse]
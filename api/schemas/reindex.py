@@ -0,0 +1,22 @@
+from pydantic import BaseModel
+from datetime import datetime
+from uuid import UUID
+from typing import Optional
+
+class ReindexJobResponse(BaseModel):
+    id: UUID
+    status: str
+    last_item_id: Optional[str] = None
+    processed: int
+    failed: int
+    skipped: int
+    force: bool
+    model_version: Optional[str] = None
+    total: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
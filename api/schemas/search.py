@@ -0,0 +1,55 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+# SERVING_ROLE=search のレプリカが公開する内部 API (/internal/search/*) 用
+
+class TextSearchRequest(BaseModel):
+    q: str
+    top_k: int = 20
+    filters: dict = {}
+    version: Optional[str] = None
+
+class VectorSearchRequest(BaseModel):
+    vector: List[float]
+    top_k: int = 20
+    filters: dict = {}
+    version: Optional[str] = None
+
+class ItemSearchRequest(BaseModel):
+    item_id: str
+    top_k: int = 20
+    filters: dict = {}
+
+class SearchResult(BaseModel):
+    item_ids: List[str]
+
+class EncodeRequest(BaseModel):
+    items: List[dict]
+    timeout: Optional[float] = None
+    version: Optional[str] = None
+    # タイトルのキャッシュを使わずにエンコードする (強制の再インデックス)
+    refresh: bool = False
+
+class EncodeResponse(BaseModel):
+    vectors: List[List[float]]
+
+class IndexUpsertRequest(BaseModel):
+    item_id: str
+    vector: List[float]
+    attrs: Optional[dict] = None
+    version: Optional[str] = None
+
+class IndexAttributesRequest(BaseModel):
+    item_id: str
+    attrs: dict
+
+class IndexRemoveRequest(BaseModel):
+    item_id: str
+
+class ModelLoadRequest(BaseModel):
+    version: str
+    model_path: str
+    vocab_path: str
+
+class ModelVersionRequest(BaseModel):
+    version: str
@@ -0,0 +1,359 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+from api.db import async_session
+import api.cruds.item as item_crud
+import api.cruds.category as category_crud
+import api.cruds.reindex as reindex_crud
+import api.cruds.model_version as model_version_crud
+import api.cruds.item_cache as item_cache
+from api.build_vector_snapshot import build_vector_snapshot
+from api.utils.fingerprint import ENCODER_VERSION
+from api.utils.vector_index import EMBEDDING_DIM
+from api.utils.vector_snapshot import (
+    VECTOR_SNAPSHOT_DIR, VECTOR_SNAPSHOT_MAX_DELTA, async_builder_lock, load_snapshot, snapshot_root, write_snapshot
+)
+from api.utils.search_client import LocalSearchClient, SEARCH_INDEX_SYNC_INTERVAL
+
+# ---------------------------------------------------------
+# 同じプロセスに検索エンジン (モデル + 語彙 + インデックス) を組み立てる
+# lifespan と推論サーバ (api.inference_server) が使う
+# SearchReloader は新しいインスタンスを裏で組み立て、スモーククエリが通ってから差し替える
+# ---------------------------------------------------------
+# モデルバンドル (python -m api.build_model_bundle で作成) があれば hub に触れずに起動する
+MODEL_BUNDLE_PATH = os.getenv("MODEL_BUNDLE_PATH", "/code/api/data/model_bundle")
+LEGACY_MODEL_PATH = "/code/api/data/mercari_twotower_model.pth"
+MODEL_PATH = MODEL_BUNDLE_PATH if os.path.isdir(MODEL_BUNDLE_PATH) else LEGACY_MODEL_PATH
+VOCAB_PATH = "/code/api/data/vocab.json"
+# 稼働させる前のウォームアップで流すバッチサイズ (空なら行わない)
+SEARCH_WARMUP_BATCH_SIZES = [int(n) for n in os.getenv("SEARCH_WARMUP_BATCH_SIZES", "1,8,32").split(",") if n.strip()]
+SEARCH_WARMUP_TIMEOUT = float(os.getenv("SEARCH_WARMUP_TIMEOUT", 120))
+# 採番とコミットの順が前後した更新を取りこぼさないよう、同期のたびにこの秒数だけさかのぼって読み直す
+SEARCH_INDEX_SYNC_LOOKBACK = float(os.getenv("SEARCH_INDEX_SYNC_LOOKBACK", 5))
+
+async def load_vectors(engine) -> int:
+    """
+    エンジンのモデルバージョンのベクトルを読み込む
+    スナップショット (mmap) をベースにし、それ以降に商品かベクトルが更新されたものだけを DB から読んでデルタに載せる
+    スナップショットがなければ作ってから使う (VECTOR_SNAPSHOT_DIR が空なら従来どおり全件をメモリへ)
+    ファイルの読み書き・IVF の学習・インデックスへの投入はスレッドで行い、DB の読み込みだけをイベントループで待つ
+    (再読み込みやモデルの追加中も、稼働中のエンジンへのリクエストは止まらない)
+    """
+    version = engine.version
+    if not VECTOR_SNAPSHOT_DIR:
+        engine.synced_at = datetime.now()
+        with engine.timed("db"):
+            async with async_session() as db:
+                vectors = await item_crud.get_all_vectors(db, version)
+        with engine.timed("index"):
+            return await run_in_threadpool(engine.load_index, vectors)
+
+    root = snapshot_root(version)
+    with engine.timed("snapshot"):
+        async with async_session() as db:
+            reindexed_at = await reindex_crud.last_job_update(db, version)
+        snapshot = await run_in_threadpool(load_snapshot, root)
+        # 再インデックスジョブが書いたベクトルは差分読み込みで拾えないので、ジョブより古ければ作り直す
+        if snapshot is None or (reindexed_at is not None and snapshot.watermark < reindexed_at):
+            snapshot = await build_vector_snapshot(version, if_older_than=reindexed_at or datetime.now())
+        await run_in_threadpool(engine.attach_snapshot, snapshot)
+
+    delta_since = engine.synced_at = datetime.now()
+    with engine.timed("db"):
+        async with async_session() as db:
+            vectors = await item_crud.get_all_vectors(db, version, updated_since=snapshot.watermark)
+            live_ids = await item_crud.get_item_ids(db)
+    with engine.timed("index"):
+        delta = await run_in_threadpool(engine.apply_delta, vectors, live_ids)
+
+    if delta > VECTOR_SNAPSHOT_MAX_DELTA:
+        with engine.timed("snapshot_rebuild"):
+            async with async_builder_lock(root):
+                await run_in_threadpool(rebuild_snapshot, engine, root, snapshot, delta_since)
+    return len(engine.index)
+
+def rebuild_snapshot(engine, root: str, loaded, watermark: datetime) -> None:
+    """
+    デルタが育ちすぎたら、今のインデックスの内容でスナップショットを作り直す (async_builder_lock の中で呼ぶ)
+    待っている間に他のワーカーが作り直していれば何もしない
+    """
+    latest = load_snapshot(root)
+    if latest is None or latest.name == loaded.name:
+        write_snapshot(root, *engine.index.export(), watermark)
+        engine.attach_snapshot(load_snapshot(root))
+
+async def prepare_engine(engine) -> None:
+    """読み込んだモデルバージョンのエンジンにカテゴリとベクトルを載せる (LocalSearchClient の loader)"""
+    started = time.perf_counter()
+    async with async_session() as db:
+        categories = await category_crud.get_category_edges(db)
+    engine.load_categories(categories)
+    count = await load_vectors(engine)
+    engine.startup_timings["vectors_total"] = time.perf_counter() - started
+    timings = ", ".join(f"{phase}={sec:.2f}s" for phase, sec in engine.startup_timings.items())
+    print(f"✅ Model version {engine.version} loaded ({count} vectors indexed; {timings})")
+
+async def load_local_search() -> LocalSearchClient:
+    """
+    稼働中のモデルバージョン (初回は MODEL_PATH を ENCODER_VERSION として登録) と、
+    裏でベクトルを作成中のバージョンを読み込む
+    """
+    started = time.perf_counter()
+    async with async_session() as db:
+        active = await model_version_crud.ensure_active_version(db, ENCODER_VERSION, MODEL_PATH, VOCAB_PATH)
+        building = await model_version_crud.get_building_versions(db)
+
+    client = LocalSearchClient(loader=prepare_engine, warmer=warm_up)
+    await client.load_version(active.version, active.model_path, active.vocab_path)
+    await client.activate(active.version)
+    client.engine.startup_timings["total"] = time.perf_counter() - started
+
+    for model_version in building:
+        try:
+            await client.load_version(model_version.version, model_version.model_path, model_version.vocab_path)
+        except Exception as e:
+            print(f"❌ Failed to load model version {model_version.version}: {e!r}")
+    print(f"✅ Search engine initialized (active model {active.version})")
+    return client
+
+async def warm_up(engine) -> None:
+    """
+    稼働させるエンジンを SEARCH_WARMUP_BATCH_SIZES のダミー入力で温める (LocalSearchClient の warmer)
+    推論スレッドで実行するので、他のバージョンの推論とは直列になる
+    """
+    if SEARCH_WARMUP_BATCH_SIZES:
+        with engine.timed("warmup"):
+            timings = await engine.executor.run(engine.warm_up, SEARCH_WARMUP_BATCH_SIZES, timeout=SEARCH_WARMUP_TIMEOUT)
+        details = ", ".join(f"{phase}={sec * 1000:.0f}ms" for phase, sec in timings.items())
+        print(f"🔥 Model version {engine.version} warmed up ({details})")
+    engine.warmed_up_at = datetime.now()
+
+async def local_readiness(client, reloader) -> dict:
+    """このプロセスが持つエンジンの状態 (読み込み中 / 失敗 / ready)"""
+    if client is None:
+        state = "loading" if reloader.running else "failed"
+        return {"ready": False, "state": state, "error": reloader.status.get("error"), "reload": reloader.state()}
+    return {**await client.readiness(), "reload": reloader.state()}
+
+# 差し替え後、旧インスタンスを閉じるまでの猶予 (処理中のリクエストはこの間に旧インスタンスで完了する)
+SEARCH_RELOAD_DRAIN_SECONDS = float(os.getenv("SEARCH_RELOAD_DRAIN_SECONDS", 30))
+# 0 より大きければこの間隔で稼働中のモデルのファイルと DB の稼働バージョンを監視し、変わったら読み込み直す
+SEARCH_RELOAD_WATCH_INTERVAL = float(os.getenv("SEARCH_RELOAD_WATCH_INTERVAL", 0))
+SEARCH_SMOKE_QUERY = os.getenv("SEARCH_SMOKE_QUERY", "スニーカー")
+SEARCH_SMOKE_TIMEOUT = float(os.getenv("SEARCH_SMOKE_TIMEOUT", 30))
+
+async def smoke_test(client: LocalSearchClient) -> dict:
+    """
+    切り替える前に新しいインスタンスで実際にエンコード・検索してみる
+    ベクトルの次元がおかしい / NaN を含む / 例外が出る ときは差し替えない
+    """
+    started = time.perf_counter()
+    vector = (await client.encode_items([{"title": SEARCH_SMOKE_QUERY}], timeout=SEARCH_SMOKE_TIMEOUT))[0]
+    if len(vector) != EMBEDDING_DIM:
+        raise RuntimeError(f"smoke query produced a vector of dim {len(vector)} (expected {EMBEDDING_DIM})")
+    if not np.all(np.isfinite(vector)):
+        raise RuntimeError("smoke query produced a non-finite vector")
+    item_ids = await client.search_vector(vector, top_k=5)
+    return {
+        "query": SEARCH_SMOKE_QUERY,
+        "hits": len(item_ids),
+        "index_size": len(client.engine.index),
+        "ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+async def replay_delta(client: LocalSearchClient, since: datetime) -> int:
+    """
+    読み込み中に (旧インスタンスへ) 書かれた更新と削除を新しいインスタンスの全バージョンに反映する
+    DB が正なので、差し替え後に新インスタンスへ直接届いた更新と重なっても結果は同じ
+    """
+    replayed = 0
+    async with async_session() as db:
+        synced_at = datetime.now()
+        live_ids = await item_crud.get_item_ids(db)
+        for version, engine in list(client.engines.items()):
+            vectors = await item_crud.get_all_vectors(db, version, updated_since=since)
+            replayed += await run_in_threadpool(engine.apply_delta, vectors, live_ids)
+            engine.synced_at = synced_at
+    return replayed
+
+async def sync_index(client: LocalSearchClient) -> int:
+    """
+    他のワーカー・インスタンスが書いたベクトルと商品属性 (価格・販売状況など) の更新、削除をインデックスに反映する
+    削除は item_changes に積まれた商品のうち items から消えたものを見る。反映した行数を返す
+    """
+    applied = 0
+    async with async_session() as db:
+        for version, engine in list(client.engines.items()):
+            if engine.synced_at is None:
+                continue
+            started = datetime.now()
+            since = engine.synced_at - timedelta(seconds=SEARCH_INDEX_SYNC_LOOKBACK)
+            vectors = await item_crud.get_all_vectors(db, version, updated_since=since)
+            removed = await item_crud.get_removed_item_ids(db, since)
+            if vectors or removed:
+                applied += await run_in_threadpool(engine.apply_delta, vectors, None, removed)
+            engine.synced_at = started
+        await item_cache.prune_changes(db)
+    return applied
+
+def path_mtime(path: str) -> float | None:
+    """ファイルの更新時刻 (ディレクトリ = モデルバンドルなら中のファイルの最新)。無ければ None"""
+    try:
+        if os.path.isdir(path):
+            return max((entry.stat().st_mtime for entry in os.scandir(path) if entry.is_file()), default=None)
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+class SearchReloader:
+    """
+    holder.<attr> (core.search_engine など) の LocalSearchClient を無停止で入れ替える
+    新しいインスタンスを裏で組み立て、スモーククエリが通ったら参照を差し替える
+    読み込み・スモーククエリに失敗したら旧インスタンス (起動に失敗していれば None) のまま
+    組み立て中は新旧2つ分のメモリを使う
+    """
+    def __init__(self, holder, attr: str = "search_engine"):
+        self.holder = holder
+        self.attr = attr
+        self.reloads = 0
+        self.failures = 0
+        self.status = {"state": "idle"}
+        self._task = None
+        self._watch_task = None
+        self._sync_task = None
+        self._draining = {}  # 閉じるのを待っている旧インスタンス -> タスク
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def state(self) -> dict:
+        return {**self.status, "reloads": self.reloads, "failures": self.failures, "draining": len(self._draining)}
+
+    def start(self, reason: str) -> dict:
+        """バックグラウンドで読み込みを始める (実行中ならそれの状態を返す)"""
+        if not self.running:
+            self.status = {"state": "running", "reason": reason, "started_at": datetime.now().isoformat()}
+            self._task = asyncio.create_task(self.reload(reason))
+        return self.state()
+
+    async def reload(self, reason: str) -> bool:
+        started = time.perf_counter()
+        # 読み込み中の更新は旧インスタンスにしか届かないので、差し替え後にこの時刻以降の分を流し直す
+        load_started = datetime.now()
+        try:
+            client = await load_local_search()
+        except Exception as e:
+            return self.record_failure(reason, f"load failed: {e!r}")
+        try:
+            smoke = await smoke_test(client)
+        except Exception as e:
+            client.close()
+            return self.record_failure(reason, f"smoke query failed: {e!r}")
+
+        # 参照の差し替えだけなので、処理中のリクエストは掴んでいる旧インスタンスでそのまま完了する
+        old = getattr(self.holder, self.attr)
+        setattr(self.holder, self.attr, client)
+        try:
+            replayed = await replay_delta(client, load_started)
+        except Exception as e:
+            # 取りこぼした分は次の再インデックス / 再読み込みで埋まる
+            replayed = None
+            print(f"❌ Failed to replay updates made during reload: {e!r}")
+        if old is not None:
+            self._close_later(old)
+
+        self.reloads += 1
+        self.status = {
+            "state": "succeeded",
+            "reason": reason,
+            "finished_at": datetime.now().isoformat(),
+            "seconds": round(time.perf_counter() - started, 2),
+            "active_version": client.active_version,
+            "smoke": smoke,
+            "replayed": replayed,
+        }
+        print(f"🔄 Search engine reloaded ({reason}; active model {client.active_version}, {smoke['index_size']} vectors)")
+        return True
+
+    def record_failure(self, reason: str, error: str) -> bool:
+        self.failures += 1
+        self.status = {
+            "state": "failed",
+            "reason": reason,
+            "finished_at": datetime.now().isoformat(),
+            "error": error,
+        }
+        print(f"❌ Search engine load failed ({reason}): {error}")
+        return False
+
+    def _close_later(self, client) -> None:
+        async def close():
+            await asyncio.sleep(SEARCH_RELOAD_DRAIN_SECONDS)
+            self._draining.pop(client, None)
+            client.close()
+        self._draining[client] = asyncio.create_task(close())
+
+    async def _watch_state(self):
+        async with async_session() as db:
+            active = await model_version_crud.get_active_version(db)
+        if active is None:
+            return None
+        return (active.version, path_mtime(active.model_path), path_mtime(active.vocab_path))
+
+    async def _watch_loop(self, interval: float) -> None:
+        """
+        稼働中のバージョン (別のワーカーでの切り替え) とモデル・語彙ファイルの更新時刻を監視する
+        コピー途中のファイルを読まないよう、同じ状態が2回続いてから読み込み直す
+        エンジンが無い (起動に失敗した) 間は毎回読み込みを試みる
+        """
+        seen = pending = None
+        while True:
+            try:
+                current = await self._watch_state()
+                if seen is None:
+                    seen = pending = current
+                elif getattr(self.holder, self.attr) is None and not self.running:
+                    self.start("watch: retry")
+                elif current is not None and current != seen:
+                    if current == pending and not self.running:
+                        reason = "active version changed" if current[0] != seen[0] else "model files changed"
+                        seen = current
+                        self.start(f"watch: {reason}")
+                    pending = current
+            except Exception as e:
+                print(f"❌ Search reload watch failed: {e!r}")
+            await asyncio.sleep(interval)
+
+    def watch(self, interval: float = SEARCH_RELOAD_WATCH_INTERVAL) -> None:
+        if interval > 0 and self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch_loop(interval))
+            print(f"👀 Watching model files every {interval:g}s")
+
+    async def _sync_loop(self, interval: float) -> None:
+        """holder の現在のクライアントに DB の更新を取り込み続ける (再読み込み後は新しいインスタンスが対象)"""
+        while True:
+            await asyncio.sleep(interval)
+            client = getattr(self.holder, self.attr)
+            if client is None:
+                continue
+            try:
+                await sync_index(client)
+            except Exception as e:
+                print(f"❌ Search index sync failed: {e!r}")
+
+    def sync(self, interval: float = SEARCH_INDEX_SYNC_INTERVAL) -> None:
+        if interval > 0 and self._sync_task is None:
+            self._sync_task = asyncio.create_task(self._sync_loop(interval))
+
+    def shutdown(self) -> None:
+        for task in (self._watch_task, self._sync_task, self._task):
+            if task is not None:
+                task.cancel()
+        for client, task in list(self._draining.items()):
+            task.cancel()
+            client.close()
+        self._draining = {}
@@ -0,0 +1,82 @@
+import os
+import asyncio
+
+# 同時に届いた検索クエリのエンコードをまとめる設定
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", 3))
+QUERY_MAX_BATCH = int(os.getenv("QUERY_MAX_BATCH", 16))
+
+class MicroBatcher:
+    """
+    window_ms 以内 (または max_batch 件) に届いた要求を1回の run_batch 呼び出しにまとめ、
+    各呼び出し元の Future に自分の結果だけを返す
+    run_batch は「入力リスト -> 同じ順序の結果リスト」を返すコルーチン関数
+    """
+    def __init__(self, run_batch, window_ms: float = QUERY_BATCH_WINDOW_MS, max_batch: int = QUERY_MAX_BATCH):
+        self.run_batch = run_batch
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+        # メトリクス
+        self.batches = 0
+        self.items = 0
+        self.max_seen = 0
+        self.size_histogram = {}
+
+    async def submit(self, value):
+        if self.window <= 0 or self.max_batch <= 1:
+            return (await self._call([value]))[0]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((value, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _call(self, values: list) -> list:
+        size = len(values)
+        self.batches += 1
+        self.items += size
+        self.max_seen = max(self.max_seen, size)
+        self.size_histogram[size] = self.size_histogram.get(size, 0) + 1
+        return await self.run_batch(values)
+
+    async def _run(self, batch: list) -> None:
+        try:
+            results = await self._call([value for value, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size": self.max_seen,
+            "batch_size_histogram": dict(sorted(self.size_histogram.items())),
+        }
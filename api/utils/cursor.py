@@ -0,0 +1,29 @@
+import os
+import json
+import base64
+from datetime import datetime
+
+# ---------------------------------------------------------
+# 一覧 API のキーセットページング用カーソル
+# 最後に返した行の (並び替えの時刻, id) を不透明な文字列にして X-Next-Cursor で返す
+# ---------------------------------------------------------
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", 20))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", 100))
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+class InvalidCursorError(ValueError):
+    pass
+
+def encode_cursor(sort_value: datetime, row_id: str) -> str:
+    payload = json.dumps([sort_value.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    """(datetime, id) を返す。壊れたカーソルは InvalidCursorError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(sort_value), str(row_id)
+    except Exception as e:
+        raise InvalidCursorError("Invalid cursor") from e
@@ -0,0 +1,33 @@
+import os
+import hashlib
+from fastapi import Request, Response
+
+# ---------------------------------------------------------
+# 条件付き GET (ETag / If-None-Match) と Cache-Control
+# ETag はレスポンスを作る前に分かる値 (行の中身・バージョン) から作り、一致したら 304 を本文なしで返す
+# ---------------------------------------------------------
+# 商品は価格・販売状況が変わるので、保存はしてよいが毎回 ETag で確認させる
+CACHE_REVALIDATE = "public, no-cache"
+# カテゴリ・ブランドはほとんど変わらないので、この秒数は確認なしで使わせる
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", 300))
+CACHE_STATIC = f"public, max-age={STATIC_MAX_AGE}"
+
+def make_etag(*parts) -> str:
+    """parts (行のタプル・バージョンなど repr が安定する値) から強い ETag を作る"""
+    return '"' + hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()[:32] + '"'
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """If-None-Match が etag に一致するか (GET なので W/ は無視して比べる)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+def not_modified(etag: str, cache_control: str, headers: dict | None = None) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control, **(headers or {})})
+
+def set_cache_headers(response: Response, etag: str, cache_control: str) -> None:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
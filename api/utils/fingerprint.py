@@ -0,0 +1,31 @@
+import os
+import math
+import hashlib
+
+# モデル・前処理を変えたら上げる (指紋が変わり、全件が再エンコード対象になる)
+ENCODER_VERSION = os.getenv("ENCODER_VERSION", "twotower-v1")
+# 推論バックエンド (torch を読み込まないプロセスからも保存済みの pooler 出力のキーを作れるようここに置く)
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "fp32")  # fp32 | int8 | torchscript | int8-torchscript
+
+def encoder_fingerprint(item_dict: dict, version: str = ENCODER_VERSION) -> str:
+    """
+    エンコーダが実際に読む入力 (タイトル・log価格・ブランド・カテゴリ・状態) とバージョンのハッシュ
+    説明文などエンコーダが使わない項目の変更では値が変わらない
+    """
+    def safe_str_id(val): return '0' if val is None else str(val)
+    parts = [
+        version,
+        item_dict.get('title', '') or '',
+        f"{math.log1p(float(item_dict.get('price', 0) or 0)):.9g}",
+        safe_str_id(item_dict.get('brand_id')),
+        safe_str_id(item_dict.get('category_id')),
+        safe_str_id(item_dict.get('condition_id')),
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+def title_state_key(title: str, version: str = ENCODER_VERSION, backend: str = ENCODER_BACKEND) -> str:
+    """
+    保存済みの BERT pooler 出力がどのタイトル・バージョン・バックエンドのものかを示すキー
+    (int8 / torchscript の出力を別のバックエンドのエンジンのキャッシュに戻さない)
+    """
+    return hashlib.sha256(f"{version}\x1f{backend}\x1f{title or ''}".encode("utf-8")).hexdigest()
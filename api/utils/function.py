@@ -50,7 +50,7 @@ TOOLS = [
                     "brand_id": {"type": "integer", "description": "ID obtained from find_brand_id"},
                     "condition_id": {
                         "type": "integer",
-                        "description": "Item condition. 1:New, 2:Like New, 3:No visible scratches, 4:Slightly scratched, 5:Scratched/Dirty"
+                        "description": "Worst acceptable item condition, only when the user states one (results are this condition or better). 1:New, 2:Like New, 3:No visible scratches, 4:Slightly scratched, 5:Scratched/Dirty. Omit if the user does not care about the condition."
                     }
                 },
                 "required": ["category_id", "name"]
@@ -0,0 +1,70 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 推論専用スレッドプールの設定
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", 1))
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", 32))
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", 5.0))
+
+class InferenceBusyError(Exception):
+    """待ち行列が上限に達していて推論を受け付けられない"""
+
+class InferenceExecutor:
+    """
+    torch の推論をイベントループの外 (専用スレッドプール) で実行する
+    実行中 + 待機中のジョブ数が max_queue を超えたら即座に InferenceBusyError を返す
+    """
+    def __init__(
+        self,
+        workers: int = INFERENCE_WORKERS,
+        max_queue: int = INFERENCE_MAX_QUEUE,
+        timeout: float = INFERENCE_TIMEOUT,
+    ):
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn, *args, timeout: float | None = None):
+        with self._lock:
+            if self._pending >= self.max_queue:
+                self.rejected += 1
+                raise InferenceBusyError(f"inference queue is full ({self._pending})")
+            self._pending += 1
+
+        # スレッド側の処理が終わるまで枠を解放しない (タイムアウトしても実行中の分は数える)
+        try:
+            future = self._pool.submit(fn, *args)
+        except RuntimeError:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._pending,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
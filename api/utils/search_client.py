@@ -0,0 +1,474 @@
+import os
+import json
+import asyncio
+import itertools
+import socket
+import struct
+import urllib.request
+import urllib.error
+from starlette.concurrency import run_in_threadpool
+from api.utils.inference import InferenceBusyError, InferenceExecutor
+
+# ---------------------------------------------------------
+# 検索エンジンへのインターフェース
+#   LocalSearchClient : 同じプロセスの VectorSearchEngine を使う (torch を読み込む)
+#   RemoteSearchClient: SERVING_ROLE=search のレプリカへ HTTP で委譲する (torch 不要)
+#   SidecarSearchClient: 同じホストの推論サーバ (python -m api.inference_server) へ Unix ソケットで委譲する
+# フィルタは build_filter のキーワード引数の dict で渡す (リモートでもそのまま送れるように)
+# ---------------------------------------------------------
+SERVING_ROLE = os.getenv("SERVING_ROLE", "all")  # all | api | search
+SEARCH_SERVICE_URL = os.getenv("SEARCH_SERVICE_URL", "")
+SEARCH_SERVICE_TOKEN = os.getenv("SEARCH_SERVICE_TOKEN", "")
+SEARCH_SERVICE_TIMEOUT = float(os.getenv("SEARCH_SERVICE_TIMEOUT", 10))
+# 0 より大きければこの間隔で他のプロセスが書いたベクトル・属性・削除を DB から読み、常駐インデックスに反映する
+SEARCH_INDEX_SYNC_INTERVAL = float(os.getenv("SEARCH_INDEX_SYNC_INTERVAL", 2))
+# 新しいモデルバージョンの読み込み (モデル + ベクトル) を待つ時間
+MODEL_LOAD_TIMEOUT = float(os.getenv("MODEL_LOAD_TIMEOUT", 600))
+# 設定されていれば uvicorn の各ワーカーはモデルを読まず、このソケットの推論サーバを使う
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "")
+# モデル・語彙はこのディレクトリの下にあるものだけ読み込む (API から任意のファイルを torch.load させない)
+MODEL_DIR = os.getenv("MODEL_DIR", "/code/api/data")
+
+# Unix ソケット上のフレーム: 4 バイト (big endian) の長さ + JSON
+FRAME_HEADER = struct.Struct(">I")
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+def encode_frame(message: dict) -> bytes:
+    body = json.dumps(message).encode("utf-8")
+    return FRAME_HEADER.pack(len(body)) + body
+
+async def read_frame(reader: asyncio.StreamReader) -> dict:
+    (size,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"frame too large ({size} bytes)")
+    return json.loads(await reader.readexactly(size))
+
+def filter_payload(filters: dict | None) -> dict:
+    """set を JSON に載せられる list に変換する"""
+    return {
+        key: sorted(value) if isinstance(value, (set, frozenset)) else value
+        for key, value in (filters or {}).items()
+    }
+
+class ModelVersionError(Exception):
+    """指定したモデルバージョンが読み込まれていない / 切り替えられない"""
+
+class InvalidModelPathError(ValueError):
+    """MODEL_DIR の外のファイルを読み込もうとした"""
+
+def check_model_path(path: str) -> str:
+    """シンボリックリンクと .. を解決した上で MODEL_DIR の下にあるか確かめ、解決したパスを返す"""
+    root = os.path.realpath(MODEL_DIR)
+    resolved = os.path.realpath(path)
+    if os.path.commonpath([root, resolved]) != root:
+        raise InvalidModelPathError(f"{path} is outside of MODEL_DIR")
+    return resolved
+
+class LocalSearchClient:
+    """
+    モデルバージョンごとの VectorSearchEngine を保持する
+    検索は稼働中 (active) のバージョンで行い、新バージョンは裏でベクトルを作ってから activate で切り替える
+    version を省略した呼び出しは稼働中のバージョンが対象
+    """
+    remote = False
+
+    def __init__(self, loader=None, warmer=None):
+        # loader(engine): カテゴリ・ベクトルを DB から読み込む非同期関数
+        # warmer(engine): 稼働させる前にダミー入力で温める非同期関数
+        self.loader = loader
+        self.warmer = warmer
+        self.engines = {}
+        self.active_version = None
+        # 推論スレッドはすべてのバージョンで共有する (新旧モデルが CPU を取り合わないように)
+        self.executor = InferenceExecutor()
+
+    @property
+    def engine(self):
+        return self.engines[self.active_version]
+
+    def _engine(self, version: str | None = None):
+        engine = self.engines.get(version or self.active_version)
+        if engine is None:
+            raise ModelVersionError(f"model version {version} is not loaded")
+        return engine
+
+    def _filter(self, filters: dict | None, engine=None):
+        filters = dict(filters or {})
+        for key in ("condition_ids", "exclude_ids"):
+            if filters.get(key) is not None:
+                filters[key] = set(filters[key])
+        return (engine or self.engine).build_filter(**filters)
+
+    async def search_text(self, query_text: str, top_k: int = 20, filters: dict | None = None, version: str | None = None) -> list:
+        engine = self._engine(version)
+        return await engine.search_text(query_text, top_k=top_k, filters=self._filter(filters, engine))
+
+    async def search_vector(self, vector, top_k: int = 20, filters: dict | None = None, version: str | None = None) -> list:
+        engine = self._engine(version)
+        return engine.search(vector, top_k=top_k, filters=self._filter(filters, engine))
+
+    async def search_item(self, item_id: str, top_k: int = 20, filters: dict | None = None) -> list:
+        engine = self._engine()
+        return engine.search_item(item_id, top_k=top_k, filters=self._filter(filters, engine))
+
+    async def encode_item(self, item_dict: dict, version: str | None = None) -> list:
+        return await self._engine(version).aencode_single_item(item_dict)
+
+    async def encode_items(
+        self, item_dicts: list, timeout: float | None = None, version: str | None = None, refresh: bool = False,
+    ) -> list:
+        return await self._engine(version).aencode_items(item_dicts, timeout=timeout, refresh=refresh)
+
+    async def upsert(self, item_id: str, vector: list, attrs: dict | None = None, version: str | None = None) -> None:
+        self._engine(version).add_vector(item_id, vector, attrs)
+
+    async def update_attributes(self, item_id: str, attrs: dict) -> None:
+        # 属性 (販売状況など) はモデルに依存しないので、読み込み済みのすべてのバージョンに反映する
+        for engine in self.engines.values():
+            engine.update_attributes(item_id, attrs)
+
+    async def remove(self, item_id: str) -> None:
+        for engine in self.engines.values():
+            engine.remove_vector(item_id)
+
+    async def title_state(self, title: str, version: str | None = None):
+        return self._engine(version).title_state(title)
+
+    async def seed_title_state(self, title: str, state, version: str | None = None) -> None:
+        self._engine(version).seed_title_state(title, state)
+
+    async def versions(self) -> dict:
+        return {"active": self.active_version, "loaded": list(self.engines)}
+
+    async def load_version(self, version: str, model_path: str, vocab_path: str) -> None:
+        """
+        モデルを読み込み (スレッドプールで行うので検索は止まらない)、loader でベクトルを載せてから登録する
+        読み込み中も稼働中のバージョンはそのまま検索に使われる
+        """
+        if version in self.engines:
+            return
+        model_path, vocab_path = check_model_path(model_path), check_model_path(vocab_path)
+        # torch / transformers はここで初めて import する
+        from api.utils.searcher import VectorSearchEngine
+        engine = await run_in_threadpool(
+            VectorSearchEngine, model_path, vocab_path, version=version, executor=self.executor
+        )
+        try:
+            if self.loader:
+                await self.loader(engine)
+        except Exception:
+            engine.close()
+            raise
+        self.engines[version] = engine
+
+    async def activate(self, version: str) -> None:
+        """稼働中のバージョンを切り替える (参照の差し替えだけなので、処理中の検索は旧バージョンで完了する)"""
+        engine = self._engine(version)
+        if self.warmer and engine.warmed_up_at is None:
+            await self.warmer(engine)
+        self.active_version = version
+
+    async def unload(self, version: str) -> None:
+        if version == self.active_version:
+            raise ModelVersionError(f"model version {version} is active")
+        engine = self.engines.pop(version, None)
+        if engine is not None:
+            engine.close()
+
+    async def readiness(self) -> dict:
+        engine = self.engine
+        return {
+            "ready": True,
+            "state": "ready",
+            "active_version": self.active_version,
+            "loaded_versions": list(self.engines),
+            "index_size": len(engine.index),
+            "index_refreshed_at": engine.index_refreshed_at.isoformat() if engine.index_refreshed_at else None,
+            "warmed_up_at": engine.warmed_up_at.isoformat() if engine.warmed_up_at else None,
+        }
+
+    async def stats(self) -> dict:
+        return {
+            "role": SERVING_ROLE,
+            "active_version": self.active_version,
+            "loaded_versions": list(self.engines),
+            **self.engine.stats(),
+        }
+
+    def close(self) -> None:
+        for engine in self.engines.values():
+            engine.close()
+        self.engines = {}
+        self.executor.shutdown()
+
+class RemoteSearchClient:
+    """
+    検索レプリカの /internal/search/* を呼ぶ (urllib はブロッキングなのでスレッドプールで実行する)
+    推論が混んでいる (503) ときは InferenceBusyError、時間切れは asyncio.TimeoutError を投げる
+    """
+    remote = True
+
+    def __init__(self, base_url: str, token: str = SEARCH_SERVICE_TOKEN, timeout: float = SEARCH_SERVICE_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, payload: dict | None = None, timeout: float | None = None):
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["X-Search-Token"] = self.token
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=timeout or self.timeout) as res:
+                body = res.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 503:
+                raise InferenceBusyError(f"search service is busy ({path})")
+            if e.code == 409:
+                raise ModelVersionError(json.loads(e.read() or b"{}").get("detail", path))
+            raise
+        except (socket.timeout, TimeoutError):
+            raise asyncio.TimeoutError(f"search service timed out ({path})")
+        return json.loads(body) if body else None
+
+    async def _call(self, method: str, path: str, payload: dict | None = None, timeout: float | None = None):
+        return await run_in_threadpool(self._request, method, path, payload, timeout)
+
+    async def search_text(self, query_text: str, top_k: int = 20, filters: dict | None = None, version: str | None = None) -> list:
+        result = await self._call("POST", "/internal/search/text", {
+            "q": query_text, "top_k": top_k, "filters": filter_payload(filters), "version": version,
+        })
+        return result["item_ids"]
+
+    async def search_vector(self, vector, top_k: int = 20, filters: dict | None = None, version: str | None = None) -> list:
+        result = await self._call("POST", "/internal/search/vector", {
+            "vector": [float(v) for v in vector], "top_k": top_k, "filters": filter_payload(filters), "version": version,
+        })
+        return result["item_ids"]
+
+    async def search_item(self, item_id: str, top_k: int = 20, filters: dict | None = None) -> list:
+        result = await self._call("POST", "/internal/search/item", {
+            "item_id": item_id, "top_k": top_k, "filters": filter_payload(filters),
+        })
+        return result["item_ids"]
+
+    async def encode_item(self, item_dict: dict, version: str | None = None) -> list:
+        return (await self.encode_items([item_dict], version=version))[0]
+
+    async def encode_items(
+        self, item_dicts: list, timeout: float | None = None, version: str | None = None, refresh: bool = False,
+    ) -> list:
+        # 通信分の余裕を持たせて待つ
+        result = await self._call(
+            "POST", "/internal/search/encode",
+            {"items": item_dicts, "timeout": timeout, "version": version, "refresh": refresh},
+            timeout=(timeout or self.timeout) + self.timeout,
+        )
+        return result["vectors"]
+
+    async def _notify(self, path: str, payload: dict) -> None:
+        # 商品の更新自体は DB にコミット済みなので、インデックスへの反映に失敗しても例外にしない
+        # (取りこぼしは POST /search/sync の再インデックスで埋まる)
+        try:
+            await self._call("POST", path, payload)
+        except Exception as e:
+            print(f"❌ Failed to update remote index ({path}): {e}")
+
+    async def upsert(self, item_id: str, vector: list, attrs: dict | None = None, version: str | None = None) -> None:
+        await self._notify("/internal/search/index/upsert", {
+            "item_id": item_id, "vector": [float(v) for v in vector], "attrs": attrs, "version": version,
+        })
+
+    async def update_attributes(self, item_id: str, attrs: dict) -> None:
+        await self._notify("/internal/search/index/attributes", {"item_id": item_id, "attrs": attrs})
+
+    async def remove(self, item_id: str) -> None:
+        await self._notify("/internal/search/index/remove", {"item_id": item_id})
+
+    async def title_state(self, title: str, version: str | None = None):
+        # BERT の中間出力はリモート側にしかないので保存しない
+        return None
+
+    async def seed_title_state(self, title: str, state, version: str | None = None) -> None:
+        return None
+
+    async def versions(self) -> dict:
+        return await self._call("GET", "/internal/search/models")
+
+    async def load_version(self, version: str, model_path: str, vocab_path: str) -> None:
+        # モデルとベクトルの読み込みには時間がかかるので、タイムアウトを長めに取る
+        await self._call("POST", "/internal/search/models/load", {
+            "version": version, "model_path": model_path, "vocab_path": vocab_path,
+        }, timeout=MODEL_LOAD_TIMEOUT)
+
+    async def activate(self, version: str) -> None:
+        await self._call("POST", "/internal/search/models/activate", {"version": version})
+
+    async def unload(self, version: str) -> None:
+        await self._call("POST", "/internal/search/models/unload", {"version": version})
+
+    async def readiness(self) -> dict:
+        return await self._call("GET", "/internal/search/ready")
+
+    async def reload(self) -> dict:
+        """検索レプリカのエンジンを読み込み直させる (完了は待たない)"""
+        return await self._call("POST", "/internal/search/reload")
+
+    async def reload_status(self) -> dict:
+        return await self._call("GET", "/internal/search/reload")
+
+    async def stats(self) -> dict:
+        remote_stats = await self._call("GET", "/internal/search/stats")
+        return {**remote_stats, "role": SERVING_ROLE, "search_service": self.base_url}
+
+    def close(self) -> None:
+        return None
+
+class SidecarSearchClient:
+    """
+    推論サーバへの薄い非同期クライアント
+    1本の接続に要求 id 付きで多重化するので、同じワーカーの同時リクエストもサーバ側でまとめてバッチ推論される
+    """
+    remote = True
+
+    def __init__(self, path: str = INFERENCE_SOCKET, timeout: float = SEARCH_SERVICE_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._writer = None
+        self._reader_task = None
+        # 接続の張り直しと要求の送信はこのロックの中で行う (張り直し中の writer を他の呼び出しが触らない)
+        self._lock = asyncio.Lock()
+        # 今の接続で応答を待っている要求 id -> future (接続ごとに作り直す)
+        self._pending = {}
+        self._ids = itertools.count(1)
+
+    async def _connect(self) -> tuple:
+        """今の接続の (writer, pending) を返す。切れていれば張り直す (self._lock を取って呼ぶこと)"""
+        if self._writer is None or self._writer.is_closing():
+            reader, writer = await asyncio.open_unix_connection(self.path)
+            self._writer, self._pending = writer, {}
+            self._reader_task = asyncio.create_task(self._read_loop(reader, writer, self._pending))
+        return self._writer, self._pending
+
+    async def _read_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, pending: dict) -> None:
+        try:
+            while True:
+                message = await read_frame(reader)
+                future = pending.pop(message.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+        except Exception as e:
+            # 接続が切れたら、この接続で待っている要求をすべて失敗させ、次の呼び出しで張り直す
+            writer.close()
+            if self._writer is writer:
+                self._writer = None
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"inference server disconnected: {e!r}"))
+            pending.clear()
+
+    async def _call(self, op: str, timeout: float | None = None, **args):
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        pending = None
+        try:
+            async with self._lock:
+                writer, pending = await self._connect()
+                pending[request_id] = future
+                writer.write(encode_frame({"id": request_id, "op": op, "args": args}))
+                await writer.drain()
+            message = await asyncio.wait_for(future, timeout or self.timeout)
+        finally:
+            if pending is not None:
+                pending.pop(request_id, None)
+
+        error = message.get("error")
+        if error == "busy":
+            raise InferenceBusyError(f"inference server is busy ({op})")
+        if error == "timeout":
+            raise asyncio.TimeoutError(f"inference server timed out ({op})")
+        if error == "version":
+            raise ModelVersionError(message.get("detail"))
+        if error:
+            raise RuntimeError(f"inference server error ({op}): {error}")
+        return message.get("result")
+
+    async def search_text(self, query_text: str, top_k: int = 20, filters: dict | None = None, version: str | None = None) -> list:
+        return await self._call(
+            "search_text", query_text=query_text, top_k=top_k, filters=filter_payload(filters), version=version
+        )
+
+    async def search_vector(self, vector, top_k: int = 20, filters: dict | None = None, version: str | None = None) -> list:
+        return await self._call(
+            "search_vector", vector=[float(v) for v in vector], top_k=top_k, filters=filter_payload(filters), version=version
+        )
+
+    async def search_item(self, item_id: str, top_k: int = 20, filters: dict | None = None) -> list:
+        return await self._call("search_item", item_id=item_id, top_k=top_k, filters=filter_payload(filters))
+
+    async def encode_item(self, item_dict: dict, version: str | None = None) -> list:
+        return (await self.encode_items([item_dict], version=version))[0]
+
+    async def encode_items(
+        self, item_dicts: list, timeout: float | None = None, version: str | None = None, refresh: bool = False,
+    ) -> list:
+        return await self._call(
+            "encode_items", timeout=(timeout or self.timeout) + self.timeout,
+            item_dicts=item_dicts, encode_timeout=timeout, version=version, refresh=refresh,
+        )
+
+    async def _notify(self, op: str, **args) -> None:
+        # RemoteSearchClient._notify と同じく、DB にコミット済みの更新をインデックスへ反映できなくても例外にしない
+        try:
+            await self._call(op, **args)
+        except Exception as e:
+            print(f"❌ Failed to update inference server index ({op}): {e!r}")
+
+    async def upsert(self, item_id: str, vector: list, attrs: dict | None = None, version: str | None = None) -> None:
+        await self._notify("upsert", item_id=item_id, vector=[float(v) for v in vector], attrs=attrs, version=version)
+
+    async def update_attributes(self, item_id: str, attrs: dict) -> None:
+        await self._notify("update_attributes", item_id=item_id, attrs=attrs)
+
+    async def remove(self, item_id: str) -> None:
+        await self._notify("remove", item_id=item_id)
+
+    async def title_state(self, title: str, version: str | None = None):
+        return await self._call("title_state", title=title, version=version)
+
+    async def seed_title_state(self, title: str, state, version: str | None = None) -> None:
+        # キャッシュを温めるだけなので失敗しても困らない
+        await self._notify("seed_title_state", title=title, state=[float(v) for v in state], version=version)
+
+    async def versions(self) -> dict:
+        return await self._call("versions")
+
+    async def load_version(self, version: str, model_path: str, vocab_path: str) -> None:
+        await self._call(
+            "load_version", timeout=MODEL_LOAD_TIMEOUT, version=version, model_path=model_path, vocab_path=vocab_path
+        )
+
+    async def activate(self, version: str) -> None:
+        await self._call("activate", version=version)
+
+    async def unload(self, version: str) -> None:
+        await self._call("unload", version=version)
+
+    async def readiness(self) -> dict:
+        return await self._call("readiness")
+
+    async def reload(self) -> dict:
+        """推論サーバのエンジンを読み込み直させる (完了は待たない)"""
+        return await self._call("reload")
+
+    async def reload_status(self) -> dict:
+        return await self._call("reload_status")
+
+    async def stats(self) -> dict:
+        return {**await self._call("stats"), "role": SERVING_ROLE, "inference_socket": self.path}
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
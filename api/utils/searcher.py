@@ -1,135 +1,423 @@
+import os
+import time
+import unicodedata
+from datetime import datetime
+from contextlib import contextmanager
 import torch
 import numpy as np
-import pickle
 from pathlib import Path
 from transformers import AutoTokenizer, AutoModel
 import torch.nn as nn
-from api.utils.two_tower_model import TwoTowerModel
-import json
+from api.utils.two_tower_model import (
+    TwoTowerModel, quantize_int8, trace_towers, is_bundle, load_bundle, load_state_dict_file
+)
+from api.utils.vector_index import SegmentedIndex, SearchFilter
+from api.utils.vector_snapshot import rows_to_arrays
+from api.utils.vocab import load_vocab
+from api.utils.inference import InferenceExecutor
+from api.utils.batcher import MicroBatcher
+from api.utils.cache import LRUCache
+from api.utils.fingerprint import ENCODER_BACKEND, ENCODER_VERSION
 
 COLLECTION_NAME = "mercari_items"
 EMBEDDING_DIM = 128
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 MODEL_NAME = 'prajjwal1/bert-tiny'
+SEARCH_INDEX = os.getenv("SEARCH_INDEX", "exact")  # exact | ivf
+MAX_LENGTH = 32
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", 64))
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", 0))  # 0 のときは torch の既定値
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 10000))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 3600))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 2000))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", 300))
+TITLE_CACHE_SIZE = int(os.getenv("TITLE_CACHE_SIZE", 20000))
 
-class SafeLabelEncoder:
-    def __init__(self):
-        self.vocab = {}
-        self.unknown_idx = 0
-
-    def fit(self, values):
-        unique_values = np.unique(values.astype(str))
-        self.vocab = {val: i + 1 for i, val in enumerate(unique_values)}
-        self.num_classes = len(self.vocab) + 1
-
-    def transform(self, values):
-        return np.array([self.vocab.get(str(v), self.unknown_idx) for v in values])
-    
-try:
-    import uvicorn.__main__
-    setattr(uvicorn.__main__, 'SafeLabelEncoder', SafeLabelEncoder)
-except (ImportError, AttributeError):
-    pass
-
-class CustomUnpickler(pickle.Unpickler):
-    def find_class(self, module, name):
-        if name == 'SafeLabelEncoder':
-            return SafeLabelEncoder
-        return super().find_class(module, name)
+def normalize_query(query_text: str) -> str:
+    """全角/半角・大文字小文字・空白の違いを吸収したキャッシュキー"""
+    return " ".join(unicodedata.normalize("NFKC", query_text).lower().split())
 
 class VectorSearchEngine:
-    def __init__(self, model_path: str, encoders_path: str):
+    def __init__(
+        self, model_path: str, vocab_path: str, backend: str = ENCODER_BACKEND,
+        version: str = ENCODER_VERSION, executor: InferenceExecutor | None = None,
+    ):
         self.client = None
+        # どのモデルバージョンのベクトルを扱うか (item_vectors.model_version)
+        self.version = version
         self.model = None
-        self.encoders = None
-        self.tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+        self.text_encoder = None
+        self.projector = None
+        self.backend = backend
+        self.vocabs = None
+        # ベース (スナップショットの mmap) + デルタ (起動後の追加・更新)
+        self.index = SegmentedIndex(SEARCH_INDEX, EMBEDDING_DIM)
+        self.category_children = {}
+        self._subtree_cache = {}
+        self.tokenizer = None
+        # 起動フェーズごとの所要時間 (秒)
+        self.startup_timings = {}
+        # インデックスをスナップショット / DB から最後に読み込んだ時刻と、ウォームアップが終わった時刻
+        self.index_refreshed_at = None
+        # DB の更新をどの時刻まで読んだか (これより後の分を SEARCH_INDEX_SYNC_INTERVAL ごとに読む)
+        self.synced_at = None
+        self.warmed_up_at = None
         
-        self._load_resources(model_path, encoders_path)
+        if TORCH_NUM_THREADS > 0:
+            torch.set_num_threads(TORCH_NUM_THREADS)
+        self._load_resources(model_path, vocab_path)
+        # executor を渡されたら共有する (所有者が shutdown する)
+        self._owns_executor = executor is None
+        self.executor = executor or InferenceExecutor()
+        # 同時に届いた検索クエリは1回のバッチ forward にまとめる
+        self.query_batcher = MicroBatcher(self.aencode_queries)
+        # 人気クエリは「ベクトル」と「ランキング結果」の両方をキャッシュする
+        # ランキング結果はインデックスが変わるたびに破棄する
+        self.query_cache = LRUCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+        self.result_cache = LRUCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+        # タイトル -> BERT pooler 出力。価格・ブランド・状態だけの変更は projection の再計算で済む
+        # エンジンごと (= バージョン・バックエンドごと) に持つので、別のバックエンドの出力は混ざらない
+        self.title_cache = LRUCache(TITLE_CACHE_SIZE)
 
-    def _load_resources(self, model_path, encoders_path):
-        with open(encoders_path, 'rb') as f:
-            data_pack = CustomUnpickler(f).load()
-            self.encoders = data_pack['encoders']
-            dims = data_pack['dims']
+    def close(self) -> None:
+        if self._owns_executor:
+            self.executor.shutdown()
 
-        self.model = TwoTowerModel(dims).to(DEVICE)
-        self.model.load_state_dict(torch.load(model_path, map_location=DEVICE))
-        self.model.eval()
+    @contextmanager
+    def timed(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup_timings[phase] = time.perf_counter() - start
 
-    def encode_single_item(self, item_dict: dict) -> list:
-        if not self.model: return []
+    def _load_resources(self, model_path, vocab_path):
+        """
+        model_path がモデルバンドルのディレクトリならネットワークに触れずに組み立てる
+        .pth ファイルなら旧来どおり hub から BERT と tokenizer を取得してから重みを上書きする
+        """
+        with self.timed("vocab"):
+            self.vocabs, dims = load_vocab(vocab_path)
+
+        if is_bundle(model_path):
+            with self.timed("model"):
+                self.model, self.tokenizer = load_bundle(model_path, dims, DEVICE)
+        else:
+            with self.timed("tokenizer"):
+                self.tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+            with self.timed("model"):
+                self.model = TwoTowerModel(dims).to(DEVICE)
+                self.model.load_state_dict(load_state_dict_file(model_path, DEVICE))
         self.model.eval()
+        with self.timed("backend"):
+            self._apply_backend()
+
+    def _apply_backend(self):
+        """
+        推論バックエンドを選ぶ (int8 は CPU 専用の動的量子化、torchscript は trace 済みグラフ)
+        """
+        if DEVICE.type == "cpu" and "int8" in self.backend:
+            self.model = quantize_int8(self.model)
+        self.text_encoder = self.model.encode_text
+        self.projector = self.model.project
+        if DEVICE.type == "cpu" and "torchscript" in self.backend:
+            self.text_encoder, self.projector = trace_towers(self.model, seq_len=MAX_LENGTH)
+
+    def _item_features(self, item_dict: dict) -> tuple:
+        # ID は整数のまま渡す (語彙は整数配列で引ける)。None は学習時と同じく '0' 扱い
+        def safe_id(val):
+            if val is None:
+                return 0
+            try:
+                return int(val)
+            except (TypeError, ValueError):
+                return str(val)
+        return (
+            item_dict.get('title', '') or '',
+            float(np.log1p(float(item_dict.get('price', 0) or 0))),
+            safe_id(item_dict.get('brand_id')),
+            safe_id(item_dict.get('category_id')),
+            safe_id(item_dict.get('condition_id')),
+        )
+
+    def _encode_titles(self, titles: list) -> np.ndarray:
+        """タイトルを BERT にかけて pooler 出力を返す (パディングはバッチ内の最長系列まで)"""
+        inputs = self.tokenizer(titles, padding='longest', truncation=True, max_length=MAX_LENGTH, return_tensors='pt').to(DEVICE)
+        with torch.no_grad():
+            states = self.text_encoder(inputs['input_ids'], inputs['attention_mask'])
+        return states.cpu().numpy()
+
+    def _title_states(self, titles: list, refresh: bool = False) -> np.ndarray:
+        """
+        タイトルごとの pooler 出力を返す。キャッシュにないタイトルだけを BERT にかける
+        refresh ならキャッシュを読まずにすべてかけ直し、結果でキャッシュを上書きする
+        """
+        states = {}
+        missing = []
+        for title in titles:
+            if title in states:
+                continue
+            state = None if refresh else self.title_cache.get(title)
+            if state is None:
+                missing.append(title)
+                states[title] = None
+            else:
+                states[title] = state
+        if missing:
+            for title, state in zip(missing, self._encode_titles(missing)):
+                self.title_cache.set(title, state)
+                states[title] = state
+        return np.stack([states[t] for t in titles])
+
+    def _forward(self, titles: list, prices: list, brand_vals, cat_vals, cond_vals, refresh: bool = False) -> np.ndarray:
+        """1バッチ分を forward する (BERT はキャッシュ済みのタイトルを飛ばす)"""
+        bert_out = torch.from_numpy(self._title_states(titles, refresh)).to(DEVICE)
+        price = torch.tensor(prices, dtype=torch.float).to(DEVICE)
+        brand = torch.as_tensor(brand_vals, dtype=torch.long).to(DEVICE)
+        cat = torch.as_tensor(cat_vals, dtype=torch.long).to(DEVICE)
+        cond = torch.as_tensor(cond_vals, dtype=torch.long).to(DEVICE)
         with torch.no_grad():
+            vectors = self.projector(bert_out, price, brand, cat, cond)
+        return vectors.cpu().numpy()
+
+    def _encode_rows(self, rows: list, refresh: bool = False) -> list:
+        """
+        (title, log_price, brand, category, condition) の行リストをバッチでエンコードする
+        バッチ全体が失敗した場合は1行ずつやり直し、失敗した行だけを [] にする
+        """
+        try:
+            brand_vals = self.vocabs['brand_id'].transform([r[2] for r in rows])
+            cat_vals = self.vocabs['c2_id'].transform([r[3] for r in rows])
+            cond_vals = self.vocabs['item_condition_id'].transform([r[4] for r in rows])
+            vectors = self._forward(
+                [r[0] for r in rows], [r[1] for r in rows],
+                brand_vals, cat_vals, cond_vals, refresh
+            )
+            return [v.tolist() for v in vectors]
+        except Exception as e:
+            if len(rows) == 1:
+                print(f"❌ encode error: {e}")
+                return [[]]
+            results = []
+            for row in rows:
+                results.extend(self._encode_rows([row], refresh))
+            return results
+
+    def warm_up(self, batch_sizes: list) -> dict:
+        """
+        ダミーの商品・クエリを典型的なバッチサイズで流し、最後に1回検索する
+        torch のカーネル初期化や tokenizer の初回コストを最初の /search ではなく起動時に払う
+        ダミーのタイトルはキャッシュに残さない。バッチサイズ -> 所要時間 (秒) を返す
+        """
+        timings = {}
+        for size in batch_sizes:
+            start = time.perf_counter()
+            # 長さの違うタイトルを混ぜ、パディング長の異なる形も一度通しておく
+            self.encode_items([
+                {"title": "warmup " * (1 + i % 8), "price": 1000 * (i + 1)} for i in range(size)
+            ])
+            self.encode_queries([f"warmup query {i}" for i in range(size)])
+            timings[f"batch_{size}"] = time.perf_counter() - start
+        start = time.perf_counter()
+        vector = self.encode_query("warmup")
+        if vector:
+            self.search(vector, top_k=20)
+        timings["search"] = time.perf_counter() - start
+        self.title_cache.clear()
+        return timings
+
+    def title_state(self, title: str) -> np.ndarray | None:
+        """キャッシュ済みの pooler 出力 (DB に保存する用)"""
+        return self.title_cache.get(title or '')
+
+    def seed_title_state(self, title: str, state) -> None:
+        """DB に保存してあった pooler 出力をキャッシュに戻す"""
+        self.title_cache.set(title or '', np.asarray(state, dtype=np.float32))
+
+    def _encode_batched(self, rows: list, batch_size: int, refresh: bool = False) -> list:
+        results = [[] for _ in rows]
+        valid = [i for i, r in enumerate(rows) if r is not None]
+        for start in range(0, len(valid), batch_size):
+            chunk = valid[start:start + batch_size]
+            for i, vec in zip(chunk, self._encode_rows([rows[i] for i in chunk], refresh)):
+                results[i] = vec
+        return results
+
+    def encode_items(self, item_dicts: list, batch_size: int = ENCODE_BATCH_SIZE, refresh: bool = False) -> list:
+        """
+        商品をまとめてエンコードする (入力と同じ順序、失敗した行は [])
+        refresh ならタイトルのキャッシュを使わない (強制の再インデックス用)
+        """
+        if not self.model: return [[] for _ in item_dicts]
+        rows = []
+        for item_dict in item_dicts:
             try:
-                def safe_str_id(val): return '0' if val is None else str(val)
-                b_id = safe_str_id(item_dict.get('brand_id'))
-                c_id = safe_str_id(item_dict.get('category_id'))
-                cond_id = safe_str_id(item_dict.get('condition_id'))
-
-                brand_val = self.encoders['brand_id'].transform([b_id])[0]
-                cat_val = self.encoders['c2_id'].transform([c_id])[0]
-                cond_val = self.encoders['item_condition_id'].transform([cond_id])[0]
-
-                price_val = float(item_dict.get('price', 0))
-                price = torch.tensor([np.log1p(price_val)], dtype=torch.float).to(DEVICE)
-                brand = torch.tensor([brand_val], dtype=torch.long).to(DEVICE)
-                cat = torch.tensor([cat_val], dtype=torch.long).to(DEVICE)
-                cond = torch.tensor([cond_val], dtype=torch.long).to(DEVICE)
-
-                inputs = self.tokenizer(item_dict.get('title', ''), padding='max_length', truncation=True, max_length=32, return_tensors='pt').to(DEVICE)
-
-                vector = self.model.forward_one_tower(
-                    inputs['input_ids'], inputs['attention_mask'],
-                    price, brand, cat, cond
-                )
-                return vector.cpu().numpy()[0].tolist()
+                rows.append(self._item_features(item_dict))
             except Exception:
-                return []
+                rows.append(None)
+        return self._encode_batched(rows, batch_size, refresh)
+
+    def encode_queries(self, query_texts: list, batch_size: int = ENCODE_BATCH_SIZE) -> list:
+        """
+        検索キーワードをまとめてエンコードする (価格・ID はダミー値)
+        """
+        if not self.model: return [[] for _ in query_texts]
+        dummy_price = float(np.log1p(3000.0))
+        # ID が None の列はどのエンコーダでも未知ID (0) になる
+        rows = [(q, dummy_price, None, None, None) for q in query_texts]
+        return self._encode_batched(rows, batch_size)
+
+    def encode_single_item(self, item_dict: dict) -> list:
+        return self.encode_items([item_dict])[0]
 
     def encode_query(self, query_text: str) -> list:
-        if not self.model: return []
-        self.model.eval()
-        with torch.no_grad():
-            try:
-                inputs = self.tokenizer(query_text, padding='max_length', truncation=True, max_length=32, return_tensors='pt').to(DEVICE)
-                dummy_price = torch.tensor([np.log1p(3000.0)], dtype=torch.float).to(DEVICE)
-                dummy_id = torch.tensor([0], dtype=torch.long).to(DEVICE)
-                vector = self.model.forward_one_tower(
-                    inputs['input_ids'], inputs['attention_mask'],
-                    dummy_price, dummy_id, dummy_id, dummy_id
-                )
-                return vector.cpu().numpy()[0].tolist()
-            except Exception as e:
-                print(f"❌ encode_query error: {e}")
-                import traceback
-                traceback.print_exc()
-                return []
-            
-    def sort_by_similarity(self, vector: list, all_vectors_data: list, top_k: int = 20) -> list:
-        if not all_vectors_data:
+        return self.encode_queries([query_text])[0]
+
+    # --- async API: 推論は専用スレッドで実行し、イベントループを止めない ---
+    # 待ち行列が満杯なら InferenceBusyError、時間切れなら asyncio.TimeoutError を送出する
+
+    async def aencode_items(self, item_dicts: list, timeout: float | None = None, refresh: bool = False) -> list:
+        return await self.executor.run(self.encode_items, item_dicts, ENCODE_BATCH_SIZE, refresh, timeout=timeout)
+
+    async def aencode_queries(self, query_texts: list, timeout: float | None = None) -> list:
+        return await self.executor.run(self.encode_queries, query_texts, timeout=timeout)
+
+    async def aencode_single_item(self, item_dict: dict) -> list:
+        return (await self.aencode_items([item_dict]))[0]
+
+    async def aencode_query(self, query_text: str) -> list:
+        key = normalize_query(query_text)
+        vector = self.query_cache.get(key)
+        if vector is None:
+            vector = await self.query_batcher.submit(key)
+            if vector:
+                self.query_cache.set(key, vector)
+        return vector
+
+    async def search_text(self, query_text: str, top_k: int = 20, filters: SearchFilter | None = None) -> list:
+        """
+        キーワード検索 (キャッシュ済みなら推論もスコア計算も行わない)
+        """
+        key = (normalize_query(query_text), top_k, filters.cache_key() if filters else None)
+        item_ids = self.result_cache.get(key)
+        if item_ids is not None:
+            return item_ids
+
+        query_vector = await self.aencode_query(query_text)
+        if not query_vector:
             return []
+        item_ids = self.search(query_vector, top_k=top_k, filters=filters)
+        self.result_cache.set(key, item_ids)
+        return item_ids
 
-        scores = []
-        query_vec_np = np.array(vector)
-        query_norm = np.linalg.norm(query_vec_np)
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "index_size": len(self.index),
+            "index": self.index.stats(),
+            "executor": self.executor.stats(),
+            "query_batcher": self.query_batcher.stats(),
+            "query_cache": self.query_cache.stats(),
+            "result_cache": self.result_cache.stats(),
+            "title_cache": self.title_cache.stats(),
+            "index_refreshed_at": self.index_refreshed_at.isoformat() if self.index_refreshed_at else None,
+            "warmed_up_at": self.warmed_up_at.isoformat() if self.warmed_up_at else None,
+            "startup_ms": {phase: round(sec * 1000, 1) for phase, sec in self.startup_timings.items()},
+        }
 
-        for v_obj in all_vectors_data:
-            try:
-                if isinstance(v_obj.embedding, str):
-                    vec = np.array(json.loads(v_obj.embedding))
-                else:
-                    vec = np.array(v_obj.embedding)
-                
-                vec_norm = np.linalg.norm(vec)
-                
-                if query_norm == 0 or vec_norm == 0:
-                    score = 0
-                else:
-                    score = np.dot(query_vec_np, vec) / (query_norm * vec_norm)
-                
-                scores.append((v_obj.item_id, score))
-            except Exception:
-                continue
+    def load_index(self, vector_rows: list) -> int:
+        """
+        item_vectors の全行 (+ 商品のフィルタ属性) を常駐インデックスへ一括ロードする（起動時に1回）
+        """
+        item_ids, matrix, attrs = rows_to_arrays(vector_rows, EMBEDDING_DIM)
+        self.index.build(item_ids, matrix, attrs)
+        self.result_cache.clear()
+        self.index_refreshed_at = datetime.now()
+        return len(item_ids)
 
-        scores.sort(key=lambda x: x[1], reverse=True)
-        return [item_id for item_id, score in scores[:top_k]]
\ No newline at end of file
+    def attach_snapshot(self, snapshot) -> int:
+        """mmap したスナップショットをベースセグメントにする (行列はコピーしない)"""
+        self.index.attach(snapshot.item_ids, snapshot.matrix, snapshot.attrs)
+        self.result_cache.clear()
+        self.index_refreshed_at = datetime.now()
+        return len(snapshot)
+
+    def apply_delta(self, vector_rows: list, live_ids: set | None = None, removed_ids=()) -> int:
+        """
+        スナップショット以降に更新・出品された商品をデルタセグメントへ載せ、
+        live_ids が与えられればそこに無い (削除済みの) 商品を、removed_ids の商品をインデックスから除く
+        """
+        item_ids, matrix, attrs = rows_to_arrays(vector_rows, EMBEDDING_DIM)
+        for item_id, vector, item_attrs in zip(item_ids, matrix, attrs):
+            self.index.upsert(item_id, vector, item_attrs)
+        if live_ids is not None:
+            removed_ids = set(removed_ids) | (self.index.ids() - live_ids)
+        for item_id in removed_ids:
+            self.index.remove(item_id)
+        self.result_cache.clear()
+        self.index_refreshed_at = datetime.now()
+        return len(item_ids)
+
+    def load_categories(self, category_rows: list) -> None:
+        """カテゴリの親子関係を保持する (サブツリー指定のフィルタ用)"""
+        children = {}
+        for row in category_rows:
+            children.setdefault(row.parent_id, []).append(row.id)
+        self.category_children = children
+        self._subtree_cache = {}
+
+    def category_subtree(self, category_id: int) -> set:
+        cached = self._subtree_cache.get(category_id)
+        if cached is not None:
+            return cached
+        subtree = {category_id}
+        stack = [category_id]
+        while stack:
+            for child in self.category_children.get(stack.pop(), []):
+                if child not in subtree:
+                    subtree.add(child)
+                    stack.append(child)
+        self._subtree_cache[category_id] = subtree
+        return subtree
+
+    def build_filter(
+        self,
+        category_id: int | None = None,
+        brand_id: int | None = None,
+        condition_ids: set | None = None,
+        min_price: int | None = None,
+        max_price: int | None = None,
+        exclude_ids: set | None = None,
+        on_sale_only: bool = True,
+    ) -> SearchFilter:
+        return SearchFilter(
+            on_sale_only=on_sale_only,
+            category_ids=self.category_subtree(category_id) if category_id else None,
+            brand_id=brand_id or None,
+            condition_ids=condition_ids,
+            min_price=min_price,
+            max_price=max_price,
+            exclude_ids=exclude_ids or set(),
+        )
+
+    def add_vector(self, item_id: str, vector: list, attrs: dict | None = None) -> None:
+        self.index.upsert(item_id, vector, attrs)
+        self.result_cache.clear()
+
+    def update_attributes(self, item_id: str, attrs: dict) -> None:
+        self.index.set_attributes(item_id, attrs)
+        self.result_cache.clear()
+
+    def remove_vector(self, item_id: str) -> None:
+        self.index.remove(item_id)
+        self.result_cache.clear()
+
+    def search(self, vector: list, top_k: int = 20, filters: SearchFilter | None = None) -> list:
+        return self.index.search(vector, top_k=top_k, filters=filters)
+
+    def search_item(self, item_id: str, top_k: int = 20, filters: SearchFilter | None = None) -> list:
+        """インデックス上の商品ベクトルで類似商品を探す (DB からベクトルを読まない)"""
+        vector = self.index.get(item_id)
+        if vector is None:
+            return []
+        return self.search(vector, top_k=top_k, filters=filters)
@@ -1,16 +1,23 @@
+import os
 import torch
 import numpy as np
 import pickle
 from pathlib import Path
-from transformers import AutoTokenizer, AutoModel
+from transformers import AutoTokenizer, AutoModel, AutoConfig
 import torch.nn as nn
 
 MODEL_NAME = 'prajjwal1/bert-tiny'
+# モデルバンドル (tokenizer + BERT config + 全重み) 内の重みファイル名
+BUNDLE_WEIGHTS = "twotower.pt"
 
 class TwoTowerModel(nn.Module):
-    def __init__(self, embedding_dims):
+    def __init__(self, embedding_dims, bert_config=None):
         super().__init__()
-        self.bert = AutoModel.from_pretrained(MODEL_NAME)
+        # config があればダウンロードせずに骨組みだけ作る (重みは後で state dict から読む)
+        if bert_config is not None:
+            self.bert = AutoModel.from_config(bert_config)
+        else:
+            self.bert = AutoModel.from_pretrained(MODEL_NAME)
         bert_out_dim = self.bert.config.hidden_size
         
         self.brand_emb = nn.Embedding(embedding_dims['brand_id'], 16)
@@ -25,8 +32,12 @@ class TwoTowerModel(nn.Module):
             nn.Linear(256, 128)
         )
 
-    def forward_one_tower(self, input_ids, mask, price, brand, category, condition):
-        bert_out = self.bert(input_ids=input_ids, attention_mask=mask).pooler_output
+    def encode_text(self, input_ids, mask):
+        """タイトルの BERT pooler 出力 (推論コストの大半はここ)"""
+        return self.bert(input_ids=input_ids, attention_mask=mask).pooler_output
+
+    def project(self, bert_out, price, brand, category, condition):
+        """pooler 出力と価格・ブランド・カテゴリ・状態を結合して projection にかける"""
         combined = torch.cat([
             bert_out, 
             self.brand_emb(brand), 
@@ -34,4 +45,85 @@ class TwoTowerModel(nn.Module):
             self.cond_emb(condition), 
             price.unsqueeze(1)
         ], dim=1)
-        return torch.nn.functional.normalize(self.projection(combined), p=2, dim=1)
\ No newline at end of file
+        return torch.nn.functional.normalize(self.projection(combined), p=2, dim=1)
+
+    def forward_one_tower(self, input_ids, mask, price, brand, category, condition):
+        return self.project(self.encode_text(input_ids, mask), price, brand, category, condition)
+
+
+class TextTower(nn.Module):
+    """encode_text を forward として公開するラッパー (TorchScript 化用)"""
+    def __init__(self, model: TwoTowerModel):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, mask):
+        return self.model.encode_text(input_ids, mask)
+
+
+class ProjectionHead(nn.Module):
+    """project を forward として公開するラッパー (TorchScript 化用)"""
+    def __init__(self, model: TwoTowerModel):
+        super().__init__()
+        self.model = model
+
+    def forward(self, bert_out, price, brand, category, condition):
+        return self.model.project(bert_out, price, brand, category, condition)
+
+
+def load_state_dict_file(path, device):
+    """重みを mmap で読む (ページキャッシュから遅延ロードされ、コピーが1回減る)"""
+    try:
+        return torch.load(path, map_location=device, mmap=True, weights_only=True)
+    except (RuntimeError, TypeError, ValueError):
+        # 旧形式 (zip 以外) で保存されたファイルは mmap できない (重み以外のオブジェクトは復元しない)
+        return torch.load(path, map_location=device, weights_only=True)
+
+
+def save_bundle(model: TwoTowerModel, tokenizer, bundle_dir: str) -> None:
+    """tokenizer ファイル・BERT config・全重みを1つのディレクトリに書き出す"""
+    os.makedirs(bundle_dir, exist_ok=True)
+    tokenizer.save_pretrained(bundle_dir)
+    model.bert.config.save_pretrained(bundle_dir)
+    torch.save(model.state_dict(), os.path.join(bundle_dir, BUNDLE_WEIGHTS))
+
+
+def load_bundle(bundle_dir: str, embedding_dims, device):
+    """
+    モデルバンドルからネットワークに触れずに (model, tokenizer) を組み立てる
+    """
+    tokenizer = AutoTokenizer.from_pretrained(bundle_dir, local_files_only=True)
+    config = AutoConfig.from_pretrained(bundle_dir, local_files_only=True)
+    model = TwoTowerModel(embedding_dims, bert_config=config)
+    state = load_state_dict_file(os.path.join(bundle_dir, BUNDLE_WEIGHTS), device)
+    model.load_state_dict(state, assign=True)
+    return model.to(device), tokenizer
+
+
+def is_bundle(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, BUNDLE_WEIGHTS))
+
+
+def quantize_int8(model: TwoTowerModel) -> TwoTowerModel:
+    """Linear 層 (BERT 内部 + projection) を int8 の動的量子化に置き換える (CPU 推論用)"""
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def trace_towers(model: TwoTowerModel, seq_len: int = 32, batch_size: int = 2):
+    """
+    encode_text と project をそれぞれ TorchScript グラフとして trace する (バッチ・系列長は可変のまま)
+    """
+    # パディングありのマスクで trace し、マスク処理の分岐がグラフに残るようにする
+    mask = torch.ones((batch_size, seq_len), dtype=torch.long)
+    mask[1:, seq_len // 2:] = 0
+    input_ids = torch.ones((batch_size, seq_len), dtype=torch.long)
+    ids = torch.zeros(batch_size, dtype=torch.long)
+    with torch.no_grad():
+        text = torch.jit.trace(TextTower(model).eval(), (input_ids, mask), strict=False, check_trace=False)
+        bert_out = model.encode_text(input_ids, mask)
+        head = torch.jit.trace(
+            ProjectionHead(model).eval(),
+            (bert_out, torch.zeros(batch_size, dtype=torch.float), ids, ids, ids),
+            check_trace=False,
+        )
+    return torch.jit.freeze(text.eval()), torch.jit.freeze(head.eval())
@@ -0,0 +1,23 @@
+import os
+import json
+import numpy as np
+
+# item_vectors.embedding の保存形式 (リトルエンディアンの生バイト列)
+STORAGE_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+}
+DEFAULT_STORAGE_DTYPE = os.getenv("VECTOR_STORAGE_DTYPE", "float32")
+
+def pack_vector(vector, dtype: str = DEFAULT_STORAGE_DTYPE) -> bytes:
+    return np.asarray(vector, dtype=STORAGE_DTYPES[dtype]).reshape(-1).tobytes()
+
+def unpack_vector(blob, dtype: str = "float32") -> np.ndarray:
+    """
+    BLOB を float32 配列に戻す (旧JSON形式の値もそのまま受け付ける)
+    """
+    if isinstance(blob, (bytes, bytearray, memoryview)):
+        return np.frombuffer(blob, dtype=STORAGE_DTYPES[dtype or "float32"]).astype(np.float32)
+    if isinstance(blob, str):
+        blob = json.loads(blob)
+    return np.asarray(blob, dtype=np.float32).reshape(-1)
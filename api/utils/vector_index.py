@@ -0,0 +1,539 @@
+import os
+import threading
+import json
+from dataclasses import dataclass, field
+import numpy as np
+
+EMBEDDING_DIM = 128
+INITIAL_CAPACITY = 1024
+
+# IVF (転置ファイル) インデックスの設定
+IVF_NLIST = int(os.getenv("IVF_NLIST", 0))           # 0 のときは件数から自動決定
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 8))
+IVF_MIN_TRAIN_SIZE = int(os.getenv("IVF_MIN_TRAIN_SIZE", 10000))
+IVF_TRAIN_SAMPLE = 50000
+IVF_TRAIN_ITERATIONS = 15
+
+# フィルタ用の属性テーブル (ベクトル行列と同じ行順で保持する)
+ATTR_DTYPE = np.dtype([
+    ("on_sale", "?"),
+    ("category_id", "<i4"),
+    ("brand_id", "<i4"),
+    ("condition_id", "<i4"),
+    ("price", "<i8"),
+])
+MISSING_ID = -1
+
+@dataclass
+class SearchFilter:
+    """
+    top-k の前に適用する構造化フィルタ (None の条件は無視する)
+    category_ids はカテゴリのサブツリーを展開済みの id 集合
+    """
+    on_sale_only: bool = True
+    category_ids: set | None = None
+    brand_id: int | None = None
+    condition_ids: set | None = None
+    min_price: int | None = None
+    max_price: int | None = None
+    exclude_ids: set = field(default_factory=set)
+
+    def cache_key(self) -> tuple:
+        def frozen(values): return None if values is None else frozenset(values)
+        return (
+            self.on_sale_only, frozen(self.category_ids), self.brand_id, frozen(self.condition_ids),
+            self.min_price, self.max_price, frozenset(self.exclude_ids),
+        )
+
+def to_attr_row(attrs: dict | None) -> tuple:
+    if isinstance(attrs, np.void):
+        # 別のセグメントの属性テーブルの行をそのまま移す
+        return attrs.item()
+    attrs = attrs or {}
+    def id_or_missing(val): return MISSING_ID if val is None else int(val)
+    return (
+        attrs.get("status", "on_sale") == "on_sale",
+        id_or_missing(attrs.get("category_id")),
+        id_or_missing(attrs.get("brand_id")),
+        id_or_missing(attrs.get("condition_id")),
+        int(attrs.get("price") or 0),
+    )
+
+def to_float32(vector) -> np.ndarray:
+    if isinstance(vector, str):
+        vector = json.loads(vector)
+    return np.asarray(vector, dtype=np.float32).reshape(-1)
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class ExactIndex:
+    """
+    正規化済みベクトルを連続した float32 行列として常駐させる総当たりインデックス
+    1クエリ = 行列ベクトル積1回 + argpartition
+    """
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((INITIAL_CAPACITY, dim), dtype=np.float32)
+        self._ids = np.empty(INITIAL_CAPACITY, dtype=object)
+        self._attrs = np.zeros(INITIAL_CAPACITY, dtype=ATTR_DTYPE)
+        self._positions = {}
+        self._size = 0
+        # 読み取り専用 (attach した) セグメントでは削除を墓標で表す
+        self._deleted = None
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    @property
+    def read_only(self) -> bool:
+        return self._deleted is not None
+
+    def ids(self) -> set:
+        return set(self._positions)
+
+    def attr_row(self, item_id: str):
+        pos = self._positions.get(item_id)
+        return None if pos is None else self._attrs[pos]
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._positions
+
+    def build(self, item_ids: list, vectors: np.ndarray, attrs: list | None = None) -> None:
+        """全件を一括でロードする（既存の内容は破棄）"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        n = len(item_ids)
+        capacity = max(INITIAL_CAPACITY, n * 2)
+
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:n] = normalize_rows(vectors)
+        ids = np.empty(capacity, dtype=object)
+        ids[:n] = item_ids
+        attr_table = np.zeros(capacity, dtype=ATTR_DTYPE)
+        if n:
+            attr_table[:n] = [to_attr_row(a) for a in (attrs or [None] * n)]
+
+        with self._lock:
+            self._matrix = matrix
+            self._ids = ids
+            self._attrs = attr_table
+            self._positions = {item_id: i for i, item_id in enumerate(item_ids)}
+            self._size = n
+            self._deleted = None
+
+    def attach(self, item_ids: list, matrix: np.ndarray, attr_table: np.ndarray) -> None:
+        """
+        正規化済みの行列をコピーせずに読み取り専用で載せる (スナップショットの mmap 用)
+        以後 upsert はできず、remove は墓標を立てるだけになる (属性の更新はできる)
+        """
+        n = len(item_ids)
+        ids = np.empty(n, dtype=object)
+        ids[:] = item_ids
+        with self._lock:
+            self._matrix = matrix
+            self._ids = ids
+            self._attrs = attr_table
+            self._positions = {item_id: i for i, item_id in enumerate(item_ids)}
+            self._size = n
+            self._deleted = np.zeros(n, dtype=bool)
+
+    def export(self) -> tuple:
+        """生きている行の (item_ids, 正規化済み行列, 属性テーブル) のコピー"""
+        with self._lock:
+            rows = np.fromiter(sorted(self._positions.values()), dtype=np.int64, count=len(self._positions))
+            return self._ids[rows].tolist(), np.array(self._matrix[rows]), self._attrs[rows].copy()
+
+    def _grow(self) -> None:
+        capacity = self._matrix.shape[0] * 2
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        ids = np.empty(capacity, dtype=object)
+        ids[:self._size] = self._ids[:self._size]
+        attr_table = np.zeros(capacity, dtype=ATTR_DTYPE)
+        attr_table[:self._size] = self._attrs[:self._size]
+        self._matrix = matrix
+        self._ids = ids
+        self._attrs = attr_table
+
+    def upsert(self, item_id: str, vector, attrs: dict | None = None) -> None:
+        vec = to_float32(vector)
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec = vec / norm
+
+        with self._lock:
+            if self.read_only:
+                raise RuntimeError("cannot upsert into a read-only segment")
+            pos = self._positions.get(item_id)
+            if pos is None:
+                if self._size == self._matrix.shape[0]:
+                    self._grow()
+                pos = self._size
+                self._ids[pos] = item_id
+                self._attrs[pos] = to_attr_row(attrs)
+                self._positions[item_id] = pos
+                self._size += 1
+            elif attrs is not None:
+                self._attrs[pos] = to_attr_row(attrs)
+            self._matrix[pos] = vec
+
+    def set_attributes(self, item_id: str, attrs: dict) -> None:
+        """ベクトルはそのままに、フィルタ用の属性だけを更新する (購入・価格変更など)"""
+        with self._lock:
+            pos = self._positions.get(item_id)
+            if pos is not None:
+                self._attrs[pos] = to_attr_row(attrs)
+
+    def remove(self, item_id: str) -> None:
+        with self._lock:
+            pos = self._positions.pop(item_id, None)
+            if pos is None:
+                return
+            if self.read_only:
+                self._deleted[pos] = True
+                return
+            last = self._size - 1
+            if pos != last:
+                # 末尾の行を空いた位置に詰める
+                moved_id = self._ids[last]
+                self._matrix[pos] = self._matrix[last]
+                self._ids[pos] = moved_id
+                self._attrs[pos] = self._attrs[last]
+                self._positions[moved_id] = pos
+            self._ids[last] = None
+            self._size = last
+
+    def get(self, item_id: str) -> np.ndarray | None:
+        with self._lock:
+            pos = self._positions.get(item_id)
+            if pos is None:
+                return None
+            return self._matrix[pos].copy()
+
+    def _top_k(self, scores: np.ndarray, rows: np.ndarray | None, top_k: int, with_scores: bool = False) -> list:
+        """
+        scores の上位 top_k 件の item_id を類似度の降順で返す (rows は scores に対応する行番号)
+        with_scores なら (item_id, score) の組を返す (セグメントをまたいでマージする用)
+        """
+        n = scores.shape[0]
+        if n == 0:
+            return []
+        k = min(top_k, n)
+        if k < n:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(n)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        top_scores = scores[top]
+        if rows is not None:
+            top = rows[top]
+        if with_scores:
+            return list(zip(self._ids[top].tolist(), top_scores.tolist()))
+        return self._ids[top].tolist()
+
+    def _normalize_query(self, vector) -> np.ndarray | None:
+        query = to_float32(vector)
+        query_norm = np.linalg.norm(query)
+        if query_norm == 0:
+            return None
+        return query / query_norm
+
+    def _filter_mask(self, filters: SearchFilter) -> np.ndarray:
+        """属性テーブルに対してフィルタを評価し、対象行の真偽マスクを返す"""
+        attrs = self._attrs[:self._size]
+        mask = np.ones(self._size, dtype=bool)
+        if filters.on_sale_only:
+            mask &= attrs["on_sale"]
+        if filters.category_ids is not None:
+            mask &= np.isin(attrs["category_id"], np.fromiter(filters.category_ids, dtype=np.int32))
+        if filters.brand_id is not None:
+            mask &= attrs["brand_id"] == filters.brand_id
+        if filters.condition_ids is not None:
+            mask &= np.isin(attrs["condition_id"], np.fromiter(filters.condition_ids, dtype=np.int32))
+        if filters.min_price is not None:
+            mask &= attrs["price"] >= filters.min_price
+        if filters.max_price is not None:
+            mask &= attrs["price"] <= filters.max_price
+        for item_id in filters.exclude_ids:
+            pos = self._positions.get(item_id)
+            if pos is not None:
+                mask[pos] = False
+        return mask
+
+    def _live_mask(self, filters: SearchFilter | None) -> np.ndarray | None:
+        """フィルタと墓標を合わせたマスク (どちらもなければ None = 全行)"""
+        mask = self._filter_mask(filters) if filters is not None else None
+        if self.read_only and self._deleted.any():
+            live = ~self._deleted[:self._size]
+            mask = live if mask is None else mask & live
+        return mask
+
+    def search(self, vector, top_k: int = 20, filters: SearchFilter | None = None, with_scores: bool = False) -> list:
+        query = self._normalize_query(vector)
+        if query is None or top_k <= 0:
+            return []
+
+        with self._lock:
+            n = self._size
+            if n == 0:
+                return []
+            mask = self._live_mask(filters)
+            if mask is None:
+                return self._top_k(self._matrix[:n] @ query, None, top_k, with_scores)
+            # 条件を満たす行だけをスコア計算する
+            rows = np.flatnonzero(mask)
+            return self._top_k(self._matrix[rows] @ query, rows, top_k, with_scores)
+
+
+def spherical_kmeans(vectors: np.ndarray, nlist: int, iterations: int = IVF_TRAIN_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """正規化済みベクトルをコサイン類似度でクラスタリングし、正規化済みの重心を返す"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(vectors.shape[0], nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # 空のクラスタはランダムな点で置き直す
+            sums[empty] = vectors[rng.choice(vectors.shape[0], int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex(ExactIndex):
+    """
+    IVF-flat 近似最近傍インデックス
+    k-means の重心でベクトルを nlist 個のリストに分け、クエリに近い nprobe 個のリストだけを総当たりする。
+    件数が IVF_MIN_TRAIN_SIZE 未満、または nprobe >= nlist のときは ExactIndex と同じ全件探索になる。
+    """
+    def __init__(self, dim: int = EMBEDDING_DIM, nlist: int = IVF_NLIST, nprobe: int = IVF_NPROBE,
+                 min_train_size: int = IVF_MIN_TRAIN_SIZE):
+        super().__init__(dim)
+        # 0 なら学習のたびにその時点の件数から決める (self.nlist は最後に学習したリスト数)
+        self._nlist_setting = nlist
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.centroids = None
+        self._lists = []
+        self._list_arrays = []
+        self._assign = {}
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def build(self, item_ids: list, vectors: np.ndarray, attrs: list | None = None) -> None:
+        super().build(item_ids, vectors, attrs)
+        with self._lock:
+            self.centroids = None
+            self._lists = []
+            self._list_arrays = []
+            self._assign = {}
+            if self._size >= self.min_train_size:
+                self.train()
+
+    def attach(self, item_ids: list, matrix: np.ndarray, attr_table: np.ndarray) -> None:
+        super().attach(item_ids, matrix, attr_table)
+        with self._lock:
+            self.centroids = None
+            self._lists = []
+            self._list_arrays = []
+            self._assign = {}
+            if self._size >= self.min_train_size:
+                self.train()
+
+    def train(self, nlist: int | None = None) -> None:
+        """現在のベクトルで重心を学習し直し、全件を割り当て直す"""
+        with self._lock:
+            n = self._size
+            if n == 0:
+                return
+            nlist = nlist or self._nlist_setting or max(1, int(4 * np.sqrt(n)))
+            nlist = min(nlist, n)
+            matrix = self._matrix[:n]
+            if n > IVF_TRAIN_SAMPLE:
+                sample = matrix[np.random.default_rng(0).choice(n, IVF_TRAIN_SAMPLE, replace=False)]
+            else:
+                sample = matrix
+            self.centroids = spherical_kmeans(sample, nlist)
+            self.nlist = nlist
+
+            assign = np.empty(n, dtype=np.int64)
+            for start in range(0, n, 65536):
+                block = matrix[start:start + 65536]
+                assign[start:start + 65536] = np.argmax(block @ self.centroids.T, axis=1)
+
+            self._lists = [[] for _ in range(nlist)]
+            for pos, list_no in enumerate(assign.tolist()):
+                self._lists[list_no].append(pos)
+            self._list_arrays = [None] * nlist
+            self._assign = dict(enumerate(assign.tolist()))
+
+    def _move(self, pos: int, list_no: int | None) -> None:
+        old = self._assign.pop(pos, None)
+        if old is not None:
+            self._lists[old].remove(pos)
+            self._list_arrays[old] = None
+        if list_no is not None:
+            self._assign[pos] = list_no
+            self._lists[list_no].append(pos)
+            self._list_arrays[list_no] = None
+
+    def upsert(self, item_id: str, vector, attrs: dict | None = None) -> None:
+        with self._lock:
+            super().upsert(item_id, vector, attrs)
+            if not self.trained:
+                if self._size >= self.min_train_size:
+                    self.train()
+                return
+            # 新規出品は最も近い重心のリストへ追加する (再学習は行わない)
+            pos = self._positions[item_id]
+            list_no = int(np.argmax(self.centroids @ self._matrix[pos]))
+            self._move(pos, list_no)
+
+    def remove(self, item_id: str) -> None:
+        with self._lock:
+            pos = self._positions.get(item_id)
+            if pos is None:
+                return
+            if not self.trained or self.read_only:
+                # 読み取り専用なら墓標だけ立てる (リストには残し、検索時にマスクで除く)
+                super().remove(item_id)
+                return
+            last = self._size - 1
+            self._move(pos, None)
+            if pos != last:
+                moved_list = self._assign[last]
+                self._move(last, None)
+                super().remove(item_id)
+                self._move(pos, moved_list)
+            else:
+                super().remove(item_id)
+
+    def _probe_rows(self, centroid_order: np.ndarray, start: int, stop: int) -> np.ndarray:
+        arrays = []
+        for list_no in centroid_order[start:stop]:
+            arr = self._list_arrays[list_no]
+            if arr is None:
+                arr = np.asarray(self._lists[list_no], dtype=np.int64)
+                self._list_arrays[list_no] = arr
+            arrays.append(arr)
+        return np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+
+    def search(self, vector, top_k: int = 20, filters: SearchFilter | None = None,
+               nprobe: int | None = None, exact: bool = False, with_scores: bool = False) -> list:
+        nprobe = nprobe or self.nprobe
+        if exact or not self.trained or nprobe >= self.nlist:
+            return super().search(vector, top_k, filters, with_scores)
+
+        query = self._normalize_query(vector)
+        if query is None or top_k <= 0:
+            return []
+
+        with self._lock:
+            centroid_order = np.argsort(-(self.centroids @ query))
+            mask = self._live_mask(filters)
+            if mask is not None and mask.sum() <= top_k:
+                return super().search(vector, top_k, filters, with_scores)
+
+            # フィルタ後の候補が top_k に満たなければ探索するリストを倍々に広げる
+            rows = np.empty(0, dtype=np.int64)
+            probed = 0
+            while probed < self.nlist:
+                stop = min(self.nlist, max(nprobe, probed * 2))
+                new_rows = self._probe_rows(centroid_order, probed, stop)
+                if mask is not None:
+                    new_rows = new_rows[mask[new_rows]]
+                rows = np.concatenate([rows, new_rows])
+                probed = stop
+                if rows.shape[0] >= top_k:
+                    break
+            return self._top_k(self._matrix[rows] @ query, rows, top_k, with_scores)
+
+
+class SegmentedIndex:
+    """
+    読み取り専用のベースセグメント (スナップショットを mmap した行列) + 書き込み可能なデルタセグメント
+    ベースにある商品を更新するときは、ベース側に墓標を立ててデルタへ追加する
+    検索は両方の上位 top_k をスコアでマージする
+    """
+    def __init__(self, kind: str = "exact", dim: int = EMBEDDING_DIM):
+        self.kind = kind
+        self.dim = dim
+        self.base = create_index(kind, dim)
+        self.delta = create_index(kind, dim)
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self.delta)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self.delta or item_id in self.base
+
+    def ids(self) -> set:
+        return self.base.ids() | self.delta.ids()
+
+    def build(self, item_ids: list, vectors: np.ndarray, attrs: list | None = None) -> None:
+        """スナップショットを使わずに全件をメモリへ載せる"""
+        delta = create_index(self.kind, self.dim)
+        delta.build(item_ids, vectors, attrs)
+        self.base, self.delta = create_index(self.kind, self.dim), delta
+
+    def attach(self, item_ids: list, matrix: np.ndarray, attr_table: np.ndarray) -> None:
+        base = create_index(self.kind, self.dim)
+        base.attach(item_ids, matrix, attr_table)
+        self.base, self.delta = base, create_index(self.kind, self.dim)
+
+    def export(self) -> tuple:
+        base_ids, base_matrix, base_attrs = self.base.export()
+        delta_ids, delta_matrix, delta_attrs = self.delta.export()
+        return (
+            base_ids + delta_ids,
+            np.concatenate([base_matrix, delta_matrix]),
+            np.concatenate([base_attrs, delta_attrs]),
+        )
+
+    def upsert(self, item_id: str, vector, attrs: dict | None = None) -> None:
+        if item_id in self.base:
+            if attrs is None:
+                attrs = self.base.attr_row(item_id)
+            self.base.remove(item_id)
+        self.delta.upsert(item_id, vector, attrs)
+
+    def set_attributes(self, item_id: str, attrs: dict) -> None:
+        if item_id in self.delta:
+            self.delta.set_attributes(item_id, attrs)
+        else:
+            self.base.set_attributes(item_id, attrs)
+
+    def remove(self, item_id: str) -> None:
+        self.delta.remove(item_id)
+        self.base.remove(item_id)
+
+    def get(self, item_id: str) -> np.ndarray | None:
+        vector = self.delta.get(item_id)
+        return vector if vector is not None else self.base.get(item_id)
+
+    def search(self, vector, top_k: int = 20, filters: SearchFilter | None = None, **kwargs) -> list:
+        if len(self.base) == 0:
+            return self.delta.search(vector, top_k, filters, **kwargs)
+        hits = (
+            self.base.search(vector, top_k, filters, with_scores=True, **kwargs)
+            + self.delta.search(vector, top_k, filters, with_scores=True, **kwargs)
+        )
+        hits.sort(key=lambda hit: -hit[1])
+        return [item_id for item_id, _ in hits[:top_k]]
+
+    def stats(self) -> dict:
+        return {"kind": self.kind, "base": len(self.base), "delta": len(self.delta)}
+
+
+def create_index(kind: str = "exact", dim: int = EMBEDDING_DIM) -> ExactIndex:
+    if kind == "ivf":
+        return IVFIndex(dim)
+    return ExactIndex(dim)
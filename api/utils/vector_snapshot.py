@@ -0,0 +1,160 @@
+import os
+import json
+import asyncio
+import uuid
+import shutil
+import fcntl
+import tempfile
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime
+import numpy as np
+from api.utils.vector_index import ATTR_DTYPE, EMBEDDING_DIM, normalize_rows, to_attr_row
+from api.utils.vector_codec import unpack_vector
+
+# ---------------------------------------------------------
+# item_vectors のスナップショット (正規化済み float32 行列 + id + 属性) をディスクに書き、
+# 各ワーカーは行列を読み取り専用で mmap する (ページキャッシュを共有するのでワーカー数に比例して増えない)
+#   <root>/CURRENT                 … 現在のスナップショット名 (os.replace で原子的に切り替える)
+#   <root>/snapshot-*/vectors.npy  … (件数, 次元) の float32 行列
+#   <root>/snapshot-*/attrs.npy    … ATTR_DTYPE の属性テーブル
+#   <root>/snapshot-*/ids.json, meta.json
+# スナップショット以降に更新・出品された商品は、起動時に DB から読んでデルタセグメントに載せる
+# モデルバージョンごとに別のディレクトリ (<VECTOR_SNAPSHOT_DIR>/<version>) を使う
+# ---------------------------------------------------------
+VECTOR_SNAPSHOT_DIR = os.getenv("VECTOR_SNAPSHOT_DIR", "/tmp/mercari-vectors")
+# デルタがこの件数を超えたら起動時にスナップショットを作り直す
+VECTOR_SNAPSHOT_MAX_DELTA = int(os.getenv("VECTOR_SNAPSHOT_MAX_DELTA", 20000))
+KEEP_SNAPSHOTS = 2
+
+def snapshot_root(version: str, base: str = VECTOR_SNAPSHOT_DIR) -> str:
+    return os.path.join(base, version)
+
+@dataclass
+class Snapshot:
+    name: str
+    item_ids: list
+    matrix: np.ndarray
+    attrs: np.ndarray
+    watermark: datetime
+
+    def __len__(self) -> int:
+        return len(self.item_ids)
+
+def rows_to_arrays(vector_rows: list, dim: int = EMBEDDING_DIM) -> tuple:
+    """
+    get_all_vectors の行を (item_ids, float32 行列, 属性 dict のリスト) に変換する (壊れた行は飛ばす)
+    """
+    item_ids = []
+    vectors = []
+    attrs = []
+    for v_obj in vector_rows:
+        try:
+            vec = unpack_vector(v_obj.embedding, v_obj.dtype)
+            if vec.shape[0] != dim:
+                continue
+            item_ids.append(v_obj.item_id)
+            vectors.append(vec)
+            attrs.append({
+                "status": v_obj.status,
+                "category_id": v_obj.category_id,
+                "brand_id": v_obj.brand_id,
+                "condition_id": v_obj.condition_id,
+                "price": v_obj.price,
+            })
+        except Exception:
+            continue
+    matrix = np.stack(vectors) if vectors else np.empty((0, dim), dtype=np.float32)
+    return item_ids, matrix, attrs
+
+def _save_npy(path: str, array: np.ndarray) -> None:
+    with open(path, "wb") as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+
+def _write_text(path: str, text: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+
+def write_snapshot(root: str, item_ids: list, matrix: np.ndarray, attrs, watermark: datetime) -> str:
+    """
+    一時ディレクトリに書いてから rename し、最後に CURRENT を差し替える (読み手は常に完成品だけを見る)
+    attrs は属性 dict のリストか ATTR_DTYPE の配列
+    呼び出し側で async_builder_lock を取ること
+    """
+    os.makedirs(root, exist_ok=True)
+    matrix = normalize_rows(np.asarray(matrix, dtype=np.float32).reshape(len(item_ids), -1))
+    if not isinstance(attrs, np.ndarray):
+        table = np.zeros(len(item_ids), dtype=ATTR_DTYPE)
+        if len(item_ids):
+            table[:] = [to_attr_row(a) for a in attrs]
+        attrs = table
+
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=root)
+    try:
+        _save_npy(os.path.join(tmp, "vectors.npy"), matrix)
+        _save_npy(os.path.join(tmp, "attrs.npy"), attrs)
+        _write_text(os.path.join(tmp, "ids.json"), json.dumps(item_ids))
+        _write_text(os.path.join(tmp, "meta.json"), json.dumps({
+            "count": len(item_ids),
+            "dim": int(matrix.shape[1]),
+            "watermark": watermark.isoformat(),
+            "created_at": datetime.now().isoformat(),
+        }))
+        name = f"snapshot-{watermark:%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+        os.rename(tmp, os.path.join(root, name))
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    current_tmp = os.path.join(root, f".CURRENT-{uuid.uuid4().hex[:8]}")
+    _write_text(current_tmp, name)
+    os.replace(current_tmp, os.path.join(root, "CURRENT"))
+    _prune(root, keep=name)
+    return name
+
+def _prune(root: str, keep: str) -> None:
+    # 古いスナップショットを mmap 中のプロセスがあっても、unlink 後もマッピングは有効なまま
+    names = sorted(n for n in os.listdir(root) if n.startswith("snapshot-") and n != keep)
+    for name in names[:max(0, len(names) - (KEEP_SNAPSHOTS - 1))]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+def load_snapshot(root: str) -> Snapshot | None:
+    """現在のスナップショットを読む。行列は mmap (読み取り専用)、属性はメモリにコピーする"""
+    try:
+        with open(os.path.join(root, "CURRENT"), encoding="utf-8") as f:
+            name = f.read().strip()
+        path = os.path.join(root, name)
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "ids.json"), encoding="utf-8") as f:
+            item_ids = json.load(f)
+        matrix = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        attrs = np.load(os.path.join(path, "attrs.npy"))
+    except (OSError, ValueError):
+        return None
+    if matrix.shape[0] != len(item_ids) or attrs.shape[0] != len(item_ids):
+        return None
+    return Snapshot(name, item_ids, matrix, attrs, datetime.fromisoformat(meta["watermark"]))
+
+@asynccontextmanager
+async def async_builder_lock(root: str, poll_interval: float = 0.1):
+    """
+    スナップショットを書くのは同時に1プロセスだけ (他のワーカーは書き終わるまで待つ)
+    ロックはポーリングで待ち、待っている間もイベントループを止めない
+    """
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, ".lock"), "w") as f:
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
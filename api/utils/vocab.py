@@ -0,0 +1,70 @@
+import json
+import numpy as np
+
+# ---------------------------------------------------------
+# ブランド・カテゴリ・状態の id -> 埋め込み行番号 の語彙 (pickle を使わない JSON 形式)
+# {"format": "twotower-vocab", "version": 1,
+#  "dims": {"brand_id": ..., "c2_id": ..., "item_condition_id": ...},
+#  "vocabs": {"brand_id": ["0", "1", "100", ...], ...}}   … キーは文字列の昇順
+# 行番号は「ソート済みキー内の位置 + 1」、未知の値は 0 (学習時の SafeLabelEncoder と同じ割り当て)
+# ---------------------------------------------------------
+VOCAB_FORMAT = "twotower-vocab"
+VOCAB_VERSION = 1
+
+class Vocabulary:
+    """
+    ソート済みのキー配列に対する searchsorted で、バッチ全体を1回で引く
+    キーがすべて整数なら整数配列でも引ける (文字列への変換を省く)
+    """
+    def __init__(self, keys):
+        self.keys = np.asarray(keys, dtype=str)
+        if self.keys.size > 1 and not np.all(self.keys[:-1] < self.keys[1:]):
+            raise ValueError("vocabulary keys must be sorted and unique")
+        self.num_classes = len(self.keys) + 1
+
+        self._int_keys = None
+        self._int_codes = None
+        try:
+            ints = np.array([int(k) for k in self.keys], dtype=np.int64)
+        except ValueError:
+            ints = None
+        if ints is not None and all(str(i) == k for i, k in zip(ints.tolist(), self.keys.tolist())):
+            order = np.argsort(ints, kind="stable")
+            self._int_keys = ints[order]
+            self._int_codes = order + 1
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def transform(self, values) -> np.ndarray:
+        """str(値) がキーにあれば行番号、なければ 0"""
+        values = np.asarray(values)
+        if self.keys.size == 0:
+            return np.zeros(values.shape, dtype=np.int64)
+        if self._int_keys is not None and values.dtype.kind in "iu":
+            pos = np.minimum(np.searchsorted(self._int_keys, values), self._int_keys.size - 1)
+            return np.where(self._int_keys[pos] == values, self._int_codes[pos], 0).astype(np.int64)
+
+        values = values.astype(str)
+        pos = np.searchsorted(self.keys, values)
+        found = self.keys[np.minimum(pos, self.keys.size - 1)] == values
+        return np.where(found, pos + 1, 0).astype(np.int64)
+
+def save_vocab(path: str, vocabs: dict, dims: dict) -> None:
+    payload = {
+        "format": VOCAB_FORMAT,
+        "version": VOCAB_VERSION,
+        "dims": {name: int(dim) for name, dim in dims.items()},
+        "vocabs": {name: sorted(str(k) for k in keys) for name, keys in vocabs.items()},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+
+def load_vocab(path: str) -> tuple:
+    """(名前 -> Vocabulary, 埋め込みの次元 dims) を返す"""
+    with open(path, encoding="utf-8") as f:
+        payload = json.load(f)
+    if payload.get("format") != VOCAB_FORMAT or payload.get("version") != VOCAB_VERSION:
+        raise ValueError(f"unsupported vocabulary file: {payload.get('format')} v{payload.get('version')}")
+    vocabs = {name: Vocabulary(keys) for name, keys in payload["vocabs"].items()}
+    return vocabs, payload["dims"]
@@ -0,0 +1,61 @@
+import sys
+import time
+import numpy as np
+from api.utils.vector_index import ExactIndex, IVFIndex, EMBEDDING_DIM, normalize_rows
+
+# ---------------------------------------------------------
+# IVF インデックスの recall@k とレイテンシを総当たり検索と比較する
+#   python -m benchmarks.ann_recall [件数]
+# ---------------------------------------------------------
+TOP_K = 20
+NUM_QUERIES = 200
+NPROBES = [1, 2, 4, 8, 16, 32, 64]
+
+def synthetic_vectors(n: int, dim: int = EMBEDDING_DIM, clusters: int = 500, seed: int = 0) -> np.ndarray:
+    """商品カテゴリのような塊を持つ正規化済みベクトルを生成する"""
+    rng = np.random.default_rng(seed)
+    centers = normalize_rows(rng.standard_normal((clusters, dim)).astype(np.float32))
+    labels = rng.integers(0, clusters, n)
+    noise = rng.standard_normal((n, dim)).astype(np.float32) * 0.08
+    return normalize_rows(centers[labels] + noise)
+
+def measure(index, queries: np.ndarray, **kwargs):
+    results = []
+    start = time.perf_counter()
+    for q in queries:
+        results.append(index.search(q, top_k=TOP_K, **kwargs))
+    elapsed = (time.perf_counter() - start) / len(queries) * 1000
+    return results, elapsed
+
+def recall(truth: list, approx: list) -> float:
+    hits = [len(set(t) & set(a)) / len(t) for t, a in zip(truth, approx) if t]
+    return float(np.mean(hits))
+
+def main(n: int = 200000):
+    vectors = synthetic_vectors(n)
+    item_ids = [f"item-{i}" for i in range(n)]
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(n, NUM_QUERIES, replace=False)]
+    queries = normalize_rows(queries + rng.standard_normal(queries.shape).astype(np.float32) * 0.05)
+
+    exact = ExactIndex()
+    exact.build(item_ids, vectors)
+    truth, exact_ms = measure(exact, queries)
+
+    start = time.perf_counter()
+    ivf = IVFIndex(min_train_size=0)
+    ivf.build(item_ids, vectors)
+    build_s = time.perf_counter() - start
+
+    print(f"N={n}  dim={EMBEDDING_DIM}  k={TOP_K}  queries={NUM_QUERIES}")
+    print(f"IVF build: nlist={ivf.nlist}  {build_s:.1f}s")
+    print(f"{'index':<16}{'recall@k':>10}{'ms/query':>10}{'speedup':>9}")
+    print(f"{'exact':<16}{1.0:>10.3f}{exact_ms:>10.2f}{1.0:>9.1f}")
+    for nprobe in NPROBES:
+        if nprobe > ivf.nlist:
+            break
+        approx, ivf_ms = measure(ivf, queries, nprobe=nprobe)
+        print(f"{'ivf nprobe=' + str(nprobe):<16}{recall(truth, approx):>10.3f}{ivf_ms:>10.2f}{exact_ms / ivf_ms:>9.1f}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
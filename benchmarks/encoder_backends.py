@@ -0,0 +1,40 @@
+import sys
+import time
+from api.utils.searcher import VectorSearchEngine
+
+# ---------------------------------------------------------
+# 推論バックエンド (fp32 / int8 / torchscript) の速度を比較する
+#   python -m benchmarks.encoder_backends <model.pth|モデルバンドル> <vocab.json>
+# fp32 との出力のずれは tests/test_encoder_parity.py で確認する
+# ---------------------------------------------------------
+BACKENDS = ["fp32", "int8", "torchscript", "int8-torchscript"]
+REPEAT = 50
+
+SAMPLE_TITLES = [
+    "Nintendo Switch", "iPhone 13 Pro 256GB", "スニーカー 27cm", "ナイキ エアマックス",
+    "MacBook Air M1", "Canon EOS Kiss", "ルイヴィトン 財布", "Pokemon cards",
+    "ユニクロ ダウンジャケット", "Sony WH-1000XM4", "LEGO Star Wars", "ディズニー ぬいぐるみ",
+]
+SAMPLE_ITEMS = [
+    {"title": t, "price": 1000 * (i + 1), "brand_id": i, "category_id": i * 3, "condition_id": i % 5 + 1}
+    for i, t in enumerate(SAMPLE_TITLES)
+]
+
+def latency_ms(fn, *args) -> float:
+    fn(*args)
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        fn(*args)
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+def main(model_path: str, vocab_path: str) -> None:
+    print(f"{'backend':<18}{'query ms':>10}{'batch ms':>10}")
+    for backend in BACKENDS:
+        engine = VectorSearchEngine(model_path, vocab_path, backend=backend)
+        query_ms = latency_ms(engine.encode_query, SAMPLE_TITLES[0])
+        batch_ms = latency_ms(engine.encode_items, SAMPLE_ITEMS)
+        print(f"{backend:<18}{query_ms:>10.2f}{batch_ms:>10.2f}")
+        engine.close()
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import asyncio
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+# api.db は import 時に本番 DB のエンジンを作る (未設定だと Cloud SQL のクライアント証明書を読みに行く)
+# ベンチマークは自前のエンジンを使うので、接続しない Cloud Run 用の設定で読み込ませる
+os.environ.setdefault("INSTANCE_CONNECTION_NAME", "benchmark")
+from api.db import Base
+import api.models
+import api.models.users, api.models.item, api.models.item_image, api.models.embedding
+import api.models.comment, api.models.history
+from api.models.users import User
+from api.models.category import Category
+from api.models.condition import ItemCondition
+from api.models.item import Item as ItemModel
+import api.cruds.item as item_crud
+
+# ---------------------------------------------------------
+# 商品一覧の OFFSET ページングとカーソル (キーセット) ページングの1ページあたりの時間を深さごとに比べる
+#   pip install -r requirements-dev.txt   (SQLite のドライバ aiosqlite)
+#   python -m benchmarks.list_pagination [件数] [DB URL]
+# DB URL を省略するとメモリ上の SQLite (本番と同じ複合インデックスを張る)
+# MySQL で測るときは mysql+aiomysql://... を渡す (MYSQL_* などの環境変数は不要)
+# ---------------------------------------------------------
+PAGE_SIZE = 20
+DEPTHS = [0, 10, 100, 1000, 5000]
+REPEAT = 5
+SELLER_ID = "00000000-0000-0000-0000-000000000001"
+
+async def seed(session_factory, n: int) -> None:
+    base_time = datetime(2024, 1, 1)
+    async with session_factory() as db:
+        await db.execute(insert(User), [{
+            "id": SELLER_ID, "username": "bench", "email": "bench@example.com",
+            "hashed_password": "x", "created_at": base_time,
+        }])
+        await db.execute(insert(Category), [{"id": 1, "name": "bench", "depth": 0}])
+        await db.execute(insert(ItemCondition), [{"id": 1, "name": "新品", "sort_order": 1}])
+        for start in range(0, n, 10000):
+            # 同じ秒に複数件を更新した状態にして id での順序付けも通す
+            await db.execute(insert(ItemModel), [{
+                "id": f"{i:08d}-0000-0000-0000-000000000000", "seller_id": SELLER_ID,
+                "title": f"item {i}", "price": 1000 + i % 5000, "category_id": 1, "condition_id": 1,
+                "status": "on_sale",
+                "created_at": base_time + timedelta(seconds=i // 10),
+                "updated_at": base_time + timedelta(seconds=i // 10),
+            } for i in range(start, min(start + 10000, n))])
+        await db.commit()
+
+async def timed(session_factory, fn, **kwargs) -> tuple:
+    """REPEAT 回の中央値 (ms) と結果"""
+    samples = []
+    for _ in range(REPEAT):
+        async with session_factory() as db:
+            start = time.perf_counter()
+            result = await fn(db, **kwargs)
+            samples.append((time.perf_counter() - start) * 1000)
+    return sorted(samples)[len(samples) // 2], result
+
+async def cursors_at(session_factory, fn, depths: list, **kwargs) -> dict:
+    """先頭からカーソルをたどり、各深さのページを開くカーソルを集める"""
+    cursors, cursor, page = {}, None, 0
+    async with session_factory() as db:
+        while page <= max(depths):
+            if page in depths:
+                cursors[page] = cursor
+            _, cursor = await fn(db, limit=PAGE_SIZE, cursor=cursor, **kwargs)
+            if cursor is None:
+                break
+            page += 1
+    return cursors
+
+async def run(n: int, db_url: str) -> None:
+    engine = create_async_engine(db_url)
+    session_factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await seed(session_factory, n)
+
+    endpoints = [
+        ("GET /item", item_crud.get_items_list, {}),
+        ("GET /users/{id}/items", item_crud.get_items_by_user_id, {"user_id": SELLER_ID}),
+    ]
+    depths = [d for d in DEPTHS if d * PAGE_SIZE < n]
+    print(f"N={n}  page size={PAGE_SIZE}  median of {REPEAT}")
+    print(f"{'endpoint':<22}{'page':>7}{'offset ms':>11}{'cursor ms':>11}{'same rows':>11}")
+    for name, fn, kwargs in endpoints:
+        cursors = await cursors_at(session_factory, fn, depths, **kwargs)
+        for depth in depths:
+            if depth not in cursors:
+                break
+            if fn is item_crud.get_items_list:
+                offset_ms, (offset_items, _) = await timed(session_factory, fn, limit=PAGE_SIZE, skip=depth * PAGE_SIZE)
+            else:
+                # 出品者の一覧は OFFSET を受け付けないので、同じクエリを OFFSET で読んだときの参考値は出さない
+                offset_ms, offset_items = None, None
+            cursor_ms, (cursor_items, _) = await timed(
+                session_factory, fn, limit=PAGE_SIZE, cursor=cursors[depth], **kwargs
+            )
+            same = "-" if offset_items is None else str([i.id for i in offset_items] == [i.id for i in cursor_items])
+            offset_col = "-" if offset_ms is None else f"{offset_ms:.2f}"
+            print(f"{name:<22}{depth:>7}{offset_col:>11}{cursor_ms:>11.2f}{same:>11}")
+    await engine.dispose()
+
+def main(n: int = 200000, db_url: str = "sqlite+aiosqlite://"):
+    asyncio.run(run(n, db_url))
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200000,
+        sys.argv[2] if len(sys.argv) > 2 else "sqlite+aiosqlite://",
+    )
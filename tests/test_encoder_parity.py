@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from api.utils.searcher import VectorSearchEngine
+from api.utils.two_tower_model import TwoTowerModel, save_bundle
+from api.utils.vocab import save_vocab
+
+# ---------------------------------------------------------
+# int8 / torchscript バックエンドの出力が fp32 からずれていないか
+# 小さな BERT をランダムな重みで作り、モデルバンドルにしてから各バックエンドで読み込む (ネットワーク不要)
+# ---------------------------------------------------------
+BACKENDS = ["int8", "torchscript", "int8-torchscript"]
+# fp32 の出力とのコサイン類似度の低下の許容値
+MAX_COSINE_DRIFT = 0.02
+
+SAMPLE_TITLES = ["nintendo switch", "iphone 13 pro", "スニーカー 27cm", "ナイキ", "lego star wars"]
+SAMPLE_ITEMS = [
+    {"title": t, "price": 1000 * (i + 1), "brand_id": i, "category_id": i * 3, "condition_id": i % 5 + 1}
+    for i, t in enumerate(SAMPLE_TITLES)
+]
+
+@pytest.fixture(scope="module")
+def model_files(tmp_path_factory):
+    root = tmp_path_factory.mktemp("twotower")
+    tokens = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+    tokens += sorted(set("".join(SAMPLE_TITLES).replace(" ", "")))
+    vocab_file = root / "wordpiece.txt"
+    vocab_file.write_text("\n".join(tokens) + "\n", encoding="utf-8")
+    tokenizer = transformers.BertTokenizerFast(vocab_file=str(vocab_file))
+
+    config = transformers.BertConfig(
+        vocab_size=len(tokens), hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+        intermediate_size=64, max_position_embeddings=64,
+    )
+    vocabs = {"brand_id": range(5), "c2_id": range(0, 15, 3), "item_condition_id": range(1, 6)}
+    dims = {name: len(keys) + 1 for name, keys in vocabs.items()}
+    torch.manual_seed(0)
+    model = TwoTowerModel(dims, bert_config=config).eval()
+
+    bundle_dir = root / "bundle"
+    save_bundle(model, tokenizer, str(bundle_dir))
+    vocab_path = root / "vocab.json"
+    save_vocab(str(vocab_path), vocabs, dims)
+    return str(bundle_dir), str(vocab_path)
+
+def encode_all(model_files, backend: str) -> np.ndarray:
+    engine = VectorSearchEngine(*model_files, backend=backend)
+    try:
+        return np.array(engine.encode_queries(SAMPLE_TITLES) + engine.encode_items(SAMPLE_ITEMS))
+    finally:
+        engine.close()
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backend_matches_fp32(model_files, backend):
+    reference = encode_all(model_files, "fp32")
+    vectors = encode_all(model_files, backend)
+    assert vectors.shape == reference.shape
+    cosine = np.sum(reference * vectors, axis=1)
+    assert 1 - float(np.min(cosine)) <= MAX_COSINE_DRIFT